@@ -0,0 +1,95 @@
+import functools
+import numpy as np
+
+
+def ReadConfigFile(filePath):
+    print("Opening camera configuration file in:",filePath)
+    with open(filePath, 'r') as f:
+        lines = f.readlines()
+
+    loadedData = {}
+    for line in lines:
+        splittedLine = [item.strip() for item in line.split("=")]
+        key_ = splittedLine[0]
+        if(key_ == "width" or key_=="height"):
+            val_ = int(splittedLine[1])
+        elif (key_=="dfov"):
+            val_ = float(splittedLine[1])
+        else:
+            raise ValueError("The key "+key_+" in file "+filePath+"is not a recognised argument. Expected width, height or dfov. I.e: width=3600")
+        loadedData[key_] = val_
+    return loadedData
+
+def GetCartesianBaseValues(width, height, dfov):
+    Cx = width/2 #Position of the centre pixel horizontally
+    Cy = height/2 #Position of the centre pixel vertically
+    H = ((width**2)+(height**2))**(0.5) #length in pixels of the diagonal
+    pd = dfov/H #degrees per pixel
+    #print("width [",width,"] height [",height,"] dfov [",dfov,"] -> Cx [",Cx,"] Cy [",Cy,"] pd [",pd,"]")
+    return pd, Cx, Cy
+
+@functools.lru_cache(maxsize=16)
+def GetRadiusLut(width, height, dfov, oversample):
+    """ tan() of the angle to the centre pixel, sampled every 1/oversample pixels of radius up to the image corner """
+    pd, Cx, Cy = GetCartesianBaseValues(width, height, dfov)
+    maxRadius = ((Cx**2)+(Cy**2))**0.5
+    radii = np.arange(0, int(np.ceil(maxRadius*oversample))+2, dtype=np.float64)/oversample
+    lut = np.tan(np.radians(radii*pd))
+    lut.setflags(write=False)
+    return lut
+
+
+class CameraModel:
+    """
+    Pinhole model of a video camera, built once per camParams file.
+    Turns arrays of normalised bounding box centres into bearings to north and ground distances,
+    with the same maths as GetAngle, GetDirectionAngle and TransformToMetres.
+    """
+    def __init__(self, width, height, dfov, useLut=False, lutOversample=8):
+        self.width = width
+        self.height = height
+        self.dfov = dfov
+        self.pd, self.Cx, self.Cy = GetCartesianBaseValues(width, height, dfov)
+        self.useLut = useLut
+        self.lutOversample = lutOversample
+
+    @classmethod
+    def FromConfigFile(cls, filePath, **kwargs):
+        params = ReadConfigFile(filePath)
+        return cls(params["width"], params["height"], params["dfov"], **kwargs)
+
+    def PixelOffsets(self, xNorm, yNorm):
+        x = np.asarray(xNorm, dtype=np.float64)*self.width-self.Cx # x position with respect to the image centre in pixels
+        y = self.Cy-np.asarray(yNorm, dtype=np.float64)*self.height # y position with respect to the image centre in pixels
+        return x, y
+
+    def TanAngles(self, x, y):
+        radius = np.sqrt((x**2)+(y**2))
+        if self.useLut:
+            lut = GetRadiusLut(self.width, self.height, self.dfov, self.lutOversample)
+            position = radius*self.lutOversample
+            index = np.minimum(position.astype(np.int64), lut.shape[0]-2)
+            weight = position-index
+            return lut[index]*(1-weight)+lut[index+1]*weight
+        return np.tan(np.radians(radius*self.pd))
+
+    def Directions(self, x, y, baseDirection):
+        #degrees to positive Y axis
+        deg_a = np.degrees(np.arctan2(y, x))
+        deg_a = np.where(deg_a > -90, deg_a-90, deg_a+270)
+        #Translate to degrees to North
+        degToNorth = np.asarray(baseDirection, dtype=np.float64)-deg_a
+        degToNorth = np.where(degToNorth > 180, 180-degToNorth, np.where(degToNorth <= -180, 180+degToNorth, degToNorth))
+        return degToNorth
+
+    def BearingsAndDistances(self, xNorm, yNorm, gimYaw, heightAboveCanopy):
+        """ Bearing to north (degrees) and distance in metres from the drone to every bounding box """
+        x, y = self.PixelOffsets(xNorm, yNorm)
+        bearings = self.Directions(x, y, gimYaw)
+        distances = np.asarray(heightAboveCanopy, dtype=np.float64)*self.TanAngles(x, y)
+        return bearings, distances
+
+
+@functools.lru_cache(maxsize=64)
+def LoadCameraModel(filePath, useLut=False):
+    return CameraModel.FromConfigFile(filePath, useLut=useLut)
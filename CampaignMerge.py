@@ -0,0 +1,253 @@
+import argparse
+import os
+import csv
+import json
+import shutil
+import numpy as np
+from Geodesy import MetresPerDegree
+from Clustering import ClusterGrid, LoadTrees
+from StageIO import ListVideoInputs, JsonIncrementalWriter
+from VideoPool import RunPerVideo
+from Metrics import Count, Phase, DefaultMetricsPath, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, Span
+
+#Side of the square partitions, in metres
+CELL_METRES = 250.0
+#Default width of the halo around a partition, in clustering thresholds
+HALO_THRESHOLDS = 4
+CAMPAIGN_NAME = "campaign"
+PARTITIONS_FOLDER = ".partitions"
+#Tree of a video copied to a partition: home (1) in the cell of its position, halo (0) in the neighbouring ones
+PARTITION_RECORD = np.dtype([("video", "<i4"), ("tree", "<i8"), ("x", "<f8"), ("y", "<f8"), ("members", "<i8"), ("class", "<i8"), ("home", "u1")])
+CAMPAIGN_CSV_HEADER = ['Tree', 'Lat', 'Lon', 'Sightings', 'Members', 'Videos', 'Class']
+
+
+class CampaignPartitioner:
+    """
+    Trees of the videos of a campaign spilled to one file per square cell of cellMetres, in a local metric frame
+    around the first tree. Every tree is written to the cell of its position (home) and, when it is closer than
+    halo to the border, to the neighbouring cells too (halo), so every partition can be merged on its own.
+    Only one video is in memory at a time.
+    """
+    def __init__(self, folder, cellMetres, halo):
+        if halo <= 0 or halo >= cellMetres:
+            raise ValueError("The halo ("+str(halo)+" m) must be positive and smaller than the cells ("+str(cellMetres)+" m).")
+        self.folder = folder
+        self.cellMetres = cellMetres
+        self.halo = halo
+        #originLat, originLon, metresPerDegreeLat, metresPerDegreeLon
+        self.origin = None
+        self.videos = []
+        #Trees read from every video, in the order of videos
+        self.videoTrees = []
+        self.cells = set()
+        self.trees = 0
+        shutil.rmtree(folder, ignore_errors=True)
+        os.makedirs(folder)
+
+    def CellPath(self, cell):
+        return os.path.join(self.folder, str(cell[0])+"_"+str(cell[1])+".bin")
+
+    def Add(self, videoName, trees):
+        videoIndex = len(self.videos)
+        self.videos.append(videoName)
+        self.videoTrees.append(len(trees))
+        if len(trees) == 0:
+            return
+        lats = np.array([tree["Lat"] for tree in trees], dtype=np.float64)
+        lons = np.array([tree["Lon"] for tree in trees], dtype=np.float64)
+        if self.origin is None:
+            metresPerDegreeLat, metresPerDegreeLon = MetresPerDegree(lats[0])
+            self.origin = (float(lats[0]), float(lons[0]), float(metresPerDegreeLat), float(metresPerDegreeLon))
+        originLat, originLon, metresPerDegreeLat, metresPerDegreeLon = self.origin
+        records = np.empty(len(trees), dtype=PARTITION_RECORD)
+        records["video"] = videoIndex
+        records["tree"] = np.arange(len(trees))
+        records["x"] = (lons-originLon)*metresPerDegreeLon
+        records["y"] = (lats-originLat)*metresPerDegreeLat
+        records["members"] = [tree["Members"] for tree in trees]
+        records["class"] = [tree["Class"] for tree in trees]
+        records["home"] = 1
+        cellX = np.floor(records["x"]/self.cellMetres).astype(np.int64)
+        cellY = np.floor(records["y"]/self.cellMetres).astype(np.int64)
+        offsetX = records["x"]-cellX*self.cellMetres
+        offsetY = records["y"]-cellY*self.cellMetres
+        everyTree = np.ones(len(trees), dtype=bool)
+        #Trees closer than halo to the west/east (south/north) border of their cell
+        nearX = {-1: offsetX < self.halo, 0: everyTree, 1: offsetX >= self.cellMetres-self.halo}
+        nearY = {-1: offsetY < self.halo, 0: everyTree, 1: offsetY >= self.cellMetres-self.halo}
+        targetsX, targetsY, copies = [], [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                selection = nearX[dx] & nearY[dy]
+                copy = records[selection]
+                if dx != 0 or dy != 0:
+                    copy["home"] = 0
+                targetsX.append(cellX[selection]+dx)
+                targetsY.append(cellY[selection]+dy)
+                copies.append(copy)
+        targetsX = np.concatenate(targetsX)
+        targetsY = np.concatenate(targetsY)
+        copies = np.concatenate(copies)
+        #Appended to the file of every cell in one write
+        order = np.lexsort((targetsY, targetsX))
+        targetsX, targetsY, copies = targetsX[order], targetsY[order], copies[order]
+        starts = np.flatnonzero(np.r_[True, (targetsX[1:] != targetsX[:-1]) | (targetsY[1:] != targetsY[:-1])])
+        ends = np.r_[starts[1:], copies.shape[0]]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            cell = (int(targetsX[start]), int(targetsY[start]))
+            with open(self.CellPath(cell), 'ab') as f:
+                copies[start:end].tofile(f)
+            self.cells.add(cell)
+        self.trees += len(trees)
+        Count("CampaignMerge.haloCopies", copies.shape[0]-len(trees))
+
+
+def MergePartition(records, hThreshold, vThreshold):
+    """
+    Merge the trees of a partition seen in different videos, with a ClusterGrid fed in (video, tree) order where the
+    video plays the role of the frame: a merged tree never takes two trees of the same video.
+    Returns (cluster, founderHome, members, classCounts, sources) of the merged trees founded by a home tree, the
+    ones this partition owns. The others are owned, and merged the same way, by the partition of their founder.
+    """
+    records = records[np.lexsort((records["tree"], records["video"]))]
+    grid = ClusterGrid(hThreshold, vThreshold)
+    merged = {}
+    for video, tree, x, y, members, boxClass, home in records.tolist():
+        cluster = grid.Add(video, x, y, boxClass)
+        if cluster.members == 1:
+            merged[cluster.clusterId] = [home, 0, {}, []]
+        entry = merged[cluster.clusterId]
+        entry[1] += members
+        entry[2][boxClass] = entry[2].get(boxClass, 0)+members
+        entry[3].append((video, tree))
+    return [(cluster,)+tuple(merged[cluster.clusterId]) for cluster in grid.clusters if merged[cluster.clusterId][0] == 1]
+
+def _MergePartitionJob(context, cellName, partitionPath, partPath, hThreshold, vThreshold, origin, videos):
+    originLat, originLon, metresPerDegreeLat, metresPerDegreeLon = origin
+    records = np.fromfile(partitionPath, dtype=PARTITION_RECORD)
+    with Span("merging"):
+        owned = MergePartition(records, hThreshold, vThreshold)
+    sources = []
+    with Span("output writing"), open(partPath, 'w', encoding='utf-8') as f:
+        for cluster, _, members, classCounts, treeSources in owned:
+            centreX, centreY = cluster.Centre()
+            f.write(json.dumps({
+                "Lat": originLat+centreY/metresPerDegreeLat,
+                "Lon": originLon+centreX/metresPerDegreeLon,
+                "Sightings": cluster.members,
+                "Members": members,
+                "Videos": list(dict.fromkeys(videos[video] for video, _ in treeSources)),
+                "Class": max(sorted(classCounts.items()), key=lambda item: item[1])[0],
+                "Sources": [[videos[video], tree] for video, tree in treeSources],
+            })+"\n")
+            sources.extend(treeSources)
+    Count("CampaignMerge.partitionTrees", int(records.shape[0]))
+    return len(owned), np.array(sources, dtype=np.int64).reshape(-1, 2)
+
+def CheckSources(videoTrees, sources):
+    """
+    Every tree read must be the source of exactly one campaign tree. Chains of sightings longer than the halo can be
+    merged differently on both sides of a border, leaving a tree in no campaign tree or in two of them.
+    videoTrees are the trees read from every video, sources the [video, tree] arrays of every partition.
+    """
+    offsets = np.concatenate(([0], np.cumsum(videoTrees, dtype=np.int64)))
+    counts = np.zeros(int(offsets[-1]), dtype=np.int64)
+    for partitionSources in sources:
+        np.add.at(counts, offsets[partitionSources[:, 0]]+partitionSources[:, 1], 1)
+    dropped = int(np.count_nonzero(counts == 0))
+    duplicated = int(np.count_nonzero(counts > 1))
+    if dropped > 0 or duplicated > 0:
+        print("WARNING: ", dropped, " trees were not merged and ", duplicated, " were merged more than once. Use a wider --halo.")
+        Count("CampaignMerge.conflicts", dropped+duplicated)
+    return dropped, duplicated
+
+def WriteCampaign(outputFolder, partPaths):
+    """ <outputFolder>/campaign.json and .csv from the merged trees of every partition, read one partition at a time """
+    os.makedirs(outputFolder, exist_ok=True)
+    finalPathJson = os.path.join(outputFolder, CAMPAIGN_NAME+".json")
+    finalPathCsv = os.path.join(outputFolder, CAMPAIGN_NAME+".csv")
+    writer = JsonIncrementalWriter(finalPathJson)
+    treeId = 0
+    try:
+        with open(finalPathCsv, mode='w') as csvFile:
+            csvWriter = csv.writer(csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            csvWriter.writerow(CAMPAIGN_CSV_HEADER)
+            for partPath in partPaths:
+                with open(partPath, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        tree = json.loads(line)
+                        writer.Add(str(treeId), tree)
+                        csvWriter.writerow([treeId, tree["Lat"], tree["Lon"], tree["Sightings"], tree["Members"], " ".join(tree["Videos"]), tree["Class"]])
+                        treeId += 1
+    finally:
+        writer.Close()
+    print("\nWriting results:")
+    print("\t (1/2) Json >> ", finalPathJson)
+    print("\t (2/2) Json >> ", finalPathCsv)
+    return treeId
+
+def MergeCampaign(treesFolder, outputFolder, hThreshold, vThreshold, cellMetres=CELL_METRES, halo=None, workers=1):
+    """
+    Deduplicate the trees of every video of treesFolder (Clustering output) seen again by overlapping flights.
+    Trees of different videos within the thresholds (metres) are merged into one campaign tree: mean position of the
+    sightings, detections (Members) and class weighted by detections, and the [video, tree] it comes from.
+    The area is partitioned into cells of cellMetres, each one merged on its own (on a pool of processes with
+    workers > 1) with a halo of halo metres (default HALO_THRESHOLDS thresholds) borrowed from its neighbours:
+    neither the videos nor the campaign are ever in memory all at once.
+    Writes <outputFolder>/campaign.json and .csv. Returns the number of campaign trees.
+    """
+    with Phase("CampaignMerge"), ProfileStage("CampaignMerge"):
+        return _MergeCampaign(treesFolder, outputFolder, hThreshold, vThreshold, cellMetres, halo, workers)
+
+def _MergeCampaign(treesFolder, outputFolder, hThreshold, vThreshold, cellMetres, halo, workers):
+    if hThreshold <= 0 or vThreshold <= 0:
+        raise ValueError("The merging thresholds must be positive. Got horizontal "+str(hThreshold)+", vertical "+str(vThreshold))
+    if halo is None:
+        halo = HALO_THRESHOLDS*max(hThreshold, vThreshold)
+    partitionsFolder = os.path.join(outputFolder, PARTITIONS_FOLDER)
+    partitioner = CampaignPartitioner(partitionsFolder, cellMetres, halo)
+    try:
+        with Phase("CampaignMerge.partition"):
+            for videoName, path in ListVideoInputs(treesFolder).items():
+                partitioner.Add(videoName, LoadTrees(path))
+        print("Campaign: ", partitioner.trees, " trees of ", len(partitioner.videos), " videos in ", len(partitioner.cells),
+            " partitions of ", cellMetres, " m (halo ", halo, " m)")
+        cells = sorted(partitioner.cells)
+        partPaths = [partitioner.CellPath(cell)[:-len(".bin")]+".jsonl" for cell in cells]
+        jobs = [(str(cell[0])+"_"+str(cell[1]), (str(cell[0])+"_"+str(cell[1]), partitioner.CellPath(cell), partPath, hThreshold, vThreshold,
+            partitioner.origin, partitioner.videos)) for cell, partPath in zip(cells, partPaths)]
+        results = RunPerVideo("CampaignMerge.partitions", _MergePartitionJob, jobs, workers)
+        CheckSources(partitioner.videoTrees, [result[1] for result in results.values()])
+        with Phase("CampaignMerge.write"):
+            campaignTrees = WriteCampaign(outputFolder, partPaths)
+    finally:
+        shutil.rmtree(partitionsFolder, ignore_errors=True)
+    print("Campaign: ", partitioner.trees, " trees merged into ", campaignTrees, " trees")
+    Count("CampaignMerge.videos", len(partitioner.videos))
+    Count("CampaignMerge.trees", partitioner.trees)
+    Count("CampaignMerge.campaignTrees", campaignTrees)
+    return campaignTrees
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--treesFolder', type=str, required=True, default='/content/output/clustering/', help='Output folder of Clustering, with the trees of every video')
+    parser.add_argument('--verticalThreshold', required=True, type=float, default=2.0, help='north-south distance in metres in which the trees of two videos are considered the same tree')
+    parser.add_argument('--horizontalThreshold', required=True, type=float, default=2.0, help='east-west distance in metres in which the trees of two videos are considered the same tree')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/campaign/', help='Output folder of the campaign trees (not inside treesFolder)')
+    parser.add_argument('--cellSize', type=float, default=CELL_METRES, help='Side in metres of the square partitions merged independently')
+    parser.add_argument('--halo', type=float, default=None, help='Metres of the neighbouring partitions read by every partition (default: '+str(HALO_THRESHOLDS)+' times the largest threshold)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes merging different partitions at the same time')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: <outputFolder>.metrics.json)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the merge and of every partition are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    MergeCampaign(args.treesFolder, args.outputFolder, args.horizontalThreshold, args.verticalThreshold, args.cellSize, args.halo, args.workers)
+    WriteRunMetrics(args.metrics or DefaultMetricsPath(args.outputFolder), "CampaignMerge", args)
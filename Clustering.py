@@ -1,178 +1,446 @@
-import argparse
-import os
-import json
-import csv
-import math
-#from subprocess import REALTIME_PRIORITY_CLASS
-import geopy.distance
-
-
-
-def getListOfFiles(dirName):
-    print("Scanning in "+dirName)
-    # create a list of file and sub directories 
-    # names in the given directory 
-    listOfFile = os.listdir(dirName)
-    allFiles = list()
-    # Iterate over all the entries
-    for entry in listOfFile:
-        # Create full path
-        fullPath = os.path.join(dirName, entry)
-        # If entry is a directory then get the list of files in this directory 
-        if os.path.isdir(fullPath):
-            allFiles = allFiles + getListOfFiles(fullPath)
-        else:
-            allFiles.append(fullPath)
-                
-    return allFiles
-
-def filteredListOfFiles(dirName, filter):
-    fullFileList = getListOfFiles(dirName)
-    resultingList = []
-    for file in fullFileList:
-        if file.endswith(filter):
-            resultingList.append(file)
-    return resultingList
-
-def ReadConfigFile(filePath):
-    print("Opening camera configuration file in:",filePath)
-    with open(filePath, 'r') as f:
-        lines = f.readlines()
-    
-    loadedData = {}
-    for line in lines:
-        splittedLine = [item.strip() for item in line.split("=")]
-        key_ = splittedLine[0]
-        if(key_ == "width" or key_=="height"):
-            val_ = int(splittedLine[1])
-        elif (key_=="dfov"):
-            val_ = float(splittedLine[1])
-        else:
-            raise ValueError("The key "+key_+" in file "+filePath+"is not a recognised argument. Expected width, height or dfov. I.e: width=3600")
-        loadedData[key_] = val_
-    return loadedData
-
-def GetCartesianBaseValues(width, height, dfov):
-    Cx = width/2 #Position of the centre pixel horizontally
-    Cy = height/2 #Position of the centre pixel vertically
-    H = ((width**2)+(height**2))**(0.5) #length in pixels of the diagonal
-    pd = dfov/H #degrees per pixel
-    #print("width [",width,"] height [",height,"] dfov [",dfov,"] -> Cx [",Cx,"] Cy [",Cy,"] pd [",pd,"]")
-    return pd, Cx, Cy
-
-def GetAngle(x, y, pd):
-    angle = (((x**2)+(y**2))**0.5)*pd
-    #print("X[",x,"], Y[",y,"], angle [",angle,"]")
-    return angle
-
-def TransformToMetres(x, y, degrees, height):
-    distanceMts = height*math.tan(math.radians(degrees)) # distance in metres away from the centre of the image
-    
-    #print("distancePx [",distancePx,"], heightToTreeLevel[",height,"], distanceMts [",distanceMts,"] Xm [",Xm,"] Ym [",Ym,"] ")
-    return distanceMts
-
-def CalculateCoordinate(originLat, originLon, GimYaw, distanceMetres):
-    pointCoord = geopy.distance.distance(kilometers=(distanceMetres/1000.0)).destination((originLat, originLon), bearing=GimYaw)
-    #print("originLat[", originLat,"], originLon[", originLon,"], GimYaw[", GimYaw,"], distanceMetres[", distanceMetres,"] --> finalLatitude[", pointCoord.latitude,"], finalLongitude[", pointCoord.longitude,"]")
-    return pointCoord.latitude, pointCoord.longitude
-
-'''
-    def CalculateCoordinate(Xm, Ym, GimYaw):
-    degreesToRotate = 0.0
-    if GimYaw >= 0:
-        degreesToRotate = math.radians(GimYaw)
-    else:
-        degreesToRotate = math.radians(360.0-GimYaw)
-
-    deg1 = math.cos(degreesToRotate)
-    deg2 = math.sin(degreesToRotate)
-    Xm2 =  deg1 * (Xm) - deg2 * (Ym)
-    Ym2 = deg2 * (Xm) + deg1 * (Ym)
-
-    return Xm2, Ym2'''
-
-'''
-def TranslateToCoordinates(X, Y, OriginLat, OriginLon):
-    # Define starting point.
-    origin = geopy.Point(48.853, 2.349)
-
-    # Define a general distance object, initialized with a distance of 1 km.
-    d = geopy.distance.VincentyDistance(kilometers = 1)
-
-    # Use the `destination` method with a bearing of 0 degrees (which is north)
-    # in order to go from point `start` 1 km to north.
-    print d.destination(point=origin, bearing=0)
-    '''
-
-def Clustering():
-    framesFolder, outputFolder, vThreshold, hThreshold = \
-        args.framesFolder, args.outputFolder, args.verticalThreshold, args.horizontalThreshold
-    print("Loading frames data")    
-    jsonFiles = filteredListOfFiles(framesFolder, ".json")
-    videosList = {}
-    for jsonFile in jsonFiles:
-        videoName = os.path.splitext(os.path.basename(jsonFile))[0]
-
-        f = open(jsonFile)        
-        jsonData = json.load(f)
-        videosList[videoName] = jsonData
-    
-    print("Loaded ", len(videosList), "'.json' files")
-
-    for videoName, videoData in videosList.items():
-        #Iterate per frame
-        frames = videoData[0]
-        frameIndex = 0
-        totalFrames = len(frames)
-        for frameName, frameData in frames.items():
-            frameIndex+=1
-            print("Frame")
-            #Iterate per bounding box
-            for box in boundingBoxesList:
-                print("BB")
-            if(int(frameIndex)%100==0 or frameIndex == totalFrames):
-                print("[",round((frameIndex/totalFrames*100), 1),"%]Frame ", frameName, " of ",  totalFrames)
-
-
-
-        #Save the results
-        print("\nWriting results:")
-        os.makedirs(outputFolder, exist_ok=True)
-        finalPathJson = os.path.join(outputFolder,videoName+ ".json")
-        finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
-        with open(finalPathJson, 'w', encoding='utf-8') as f:
-            json.dump(videoData[0], f, ensure_ascii=False, indent=4)
-        print("\t (1/2) Json >> ", finalPathJson)
-
-
-        line_header = ['Frame', 'Lat', 'Lon', 'Alt', 'TerrainElevation',  'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', 'BoundingBox_Lat', 'BoundingBox_Lon']
-        lines_content = []
-        #{FrameNum:[[Labels],{sensor:sensorData}]}
-        for frame_key, frame_value in videoData[0].items():
-            droneData = []
-            if(len(frame_value[1]) > 0):
-                droneData = \
-                    [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"], frame_value[1]["Height"], \
-                    frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
-                    frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"],\
-                    frame_value[1]["BoundingBox_Lat"], frame_value[1]["BoundingBox_Lon"]]
-            else:
-                droneData = ['', '', '', '', '', '', '', '', '', '', '', '']
-
-            for label_tmp in frame_value[0]:
-                lines_content.append([frame_key] + droneData + label_tmp)
-        with open(finalPathCsv, mode='w') as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-            csv_writer.writerow(line_header)
-            csv_writer.writerows(lines_content)  
-        print("\t (2/2) Json >> ", finalPathCsv)  
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--framesFolder', type=str,required=True, default='/content/output/localisation_boxes/', help='Folder containing the .json and .csv files as input')
-parser.add_argument('--verticalThreshold', required=True, type=int, default=20, help='latitude degrees in which the variation of the bounding box is still considered of the same object')
-parser.add_argument('--horizontalThreshold', required=True, type=int, default=20, help='longitude degrees in which the variation of the bounding box is still considered of the same object')
-parser.add_argument('--outputFolder', type=str, default='/content/output/clustering/', help='Output folder for the clustering algorithm')
-args = parser.parse_args()
-print(args)
-Clustering()
\ No newline at end of file
+import argparse
+import os
+import json
+import csv
+import math
+from collections import deque
+from Geodesy import MetresPerDegree
+from StageIO import ListVideoInputs, LoadVideo, IterJsonItems, JsonIncrementalWriter
+from Columnar import OUTPUT_FORMATS, WritesJson, WritesColumnar, WriteTreesColumnar, ReadTreesColumnar, IsColumnar, ReadDetectionsColumnar, IterDetectionsColumnar
+from GeoExport import EXPORT_FORMATS, ExportTrees
+from Manifest import RunIncremental, InputKey, FileFingerprint, DataDigest
+from Metrics import Count, Phase, PathSize, DefaultMetricsPath, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, Span
+
+
+class TreeCluster:
+    """ Detections of the same tree across frames """
+    def __init__(self, clusterId, frameNum, x, y, boxClass):
+        self.clusterId = clusterId
+        self.sumX = x
+        self.sumY = y
+        self.members = 1
+        self.firstFrame = frameNum
+        self.lastFrame = frameNum
+        self.classCounts = {boxClass: 1}
+        self.cell = None
+
+    def Centre(self):
+        return self.sumX/self.members, self.sumY/self.members
+
+    def Add(self, frameNum, x, y, boxClass):
+        self.sumX += x
+        self.sumY += y
+        self.members += 1
+        self.firstFrame = min(self.firstFrame, frameNum)
+        self.lastFrame = max(self.lastFrame, frameNum)
+        self.classCounts[boxClass] = self.classCounts.get(boxClass, 0)+1
+
+    def MainClass(self):
+        return max(sorted(self.classCounts.items()), key=lambda item: item[1])[0]
+
+
+class ClusterGrid:
+    """
+    Greedy clustering of detections in local metric coordinates.
+    Every detection joins the nearest cluster whose centre is within the horizontal (east) and vertical (north)
+    thresholds and that has no detection of the same frame yet, otherwise it starts a new cluster.
+    Cluster centres are kept in a hash grid with cells of the threshold size, so only the 3x3 neighbouring
+    cells are checked and clustering n detections is O(n) on average.
+    Without keepClusters the grid only holds the open clusters, the caller keeps track of them and Remove()s the finished ones.
+    """
+    def __init__(self, hThreshold, vThreshold, keepClusters=True):
+        if hThreshold <= 0 or vThreshold <= 0:
+            raise ValueError("The clustering thresholds must be positive. Got horizontal "+str(hThreshold)+", vertical "+str(vThreshold))
+        self.hThreshold = hThreshold
+        self.vThreshold = vThreshold
+        self.cells = {}
+        self.clusters = [] if keepClusters else None
+        self.nextId = 0
+
+    def CellOf(self, x, y):
+        return (int(math.floor(x/self.hThreshold)), int(math.floor(y/self.vThreshold)))
+
+    def _Place(self, cluster):
+        cell = self.CellOf(*cluster.Centre())
+        if cell != cluster.cell:
+            if cluster.cell is not None:
+                self.cells[cluster.cell].remove(cluster)
+                if len(self.cells[cluster.cell]) == 0:
+                    del self.cells[cluster.cell]
+            self.cells.setdefault(cell, []).append(cluster)
+            cluster.cell = cell
+
+    def Remove(self, cluster):
+        """ Take a finished cluster out of the grid: no detection can join it anymore """
+        self.cells[cluster.cell].remove(cluster)
+        if len(self.cells[cluster.cell]) == 0:
+            del self.cells[cluster.cell]
+        cluster.cell = None
+
+    def Nearest(self, frameNum, x, y):
+        cellX, cellY = self.CellOf(x, y)
+        best = None
+        bestDistance = None
+        for i in (-1, 0, 1):
+            for j in (-1, 0, 1):
+                for cluster in self.cells.get((cellX+i, cellY+j), ()):
+                    if cluster.lastFrame == frameNum:
+                        continue #a tree only appears once per frame
+                    centreX, centreY = cluster.Centre()
+                    dx = abs(centreX-x)/self.hThreshold
+                    dy = abs(centreY-y)/self.vThreshold
+                    if dx > 1 or dy > 1:
+                        continue
+                    distance = dx*dx+dy*dy
+                    if best is None or distance < bestDistance or (distance == bestDistance and cluster.clusterId < best.clusterId):
+                        best = cluster
+                        bestDistance = distance
+        return best
+
+    def Add(self, frameNum, x, y, boxClass):
+        cluster = self.Nearest(frameNum, x, y)
+        if cluster is None:
+            cluster = TreeCluster(self.nextId, frameNum, x, y, boxClass)
+            self.nextId += 1
+            if self.clusters is not None:
+                self.clusters.append(cluster)
+        else:
+            cluster.Add(frameNum, x, y, boxClass)
+        self._Place(cluster)
+        return cluster
+
+
+def GetDetections(frames):
+    """ Localised bounding boxes of a video as (frame, lat, lon, class), in frame order """
+    detections = []
+    for frameName in sorted(frames, key=lambda frameKey: int(frameKey)):
+        for box in frames[frameName][0]:
+            if len(box) < 2 or len(box[1]) < 2:
+                continue #bounding box without coordinates
+            detections.append((int(frameName), box[1][0], box[1][1], int(box[0][0])))
+    return detections
+
+def ClusterDetections(detections, hThreshold, vThreshold):
+    """
+    Merge the detections (frame, lat, lon, class) of the same tree. Thresholds are in metres.
+    Returns a list of trees {Lat, Lon, Members, FirstFrame, LastFrame, Class}.
+    """
+    if len(detections) == 0:
+        return []
+    originLat = detections[0][1]
+    originLon = detections[0][2]
+    metresPerDegreeLat, metresPerDegreeLon = MetresPerDegree(originLat)
+    metresPerDegreeLat, metresPerDegreeLon = float(metresPerDegreeLat), float(metresPerDegreeLon)
+    grid = ClusterGrid(hThreshold, vThreshold)
+    for frameNum, lat_, lon_, boxClass in detections:
+        grid.Add(frameNum, (lon_-originLon)*metresPerDegreeLon, (lat_-originLat)*metresPerDegreeLat, boxClass)
+
+    return [_Tree(cluster, originLat, originLon, metresPerDegreeLat, metresPerDegreeLon) for cluster in grid.clusters]
+
+def _Tree(cluster, originLat, originLon, metresPerDegreeLat, metresPerDegreeLon):
+    centreX, centreY = cluster.Centre()
+    return {
+        "Lat": originLat+centreY/metresPerDegreeLat,
+        "Lon": originLon+centreX/metresPerDegreeLon,
+        "Members": cluster.members,
+        "FirstFrame": cluster.firstFrame,
+        "LastFrame": cluster.lastFrame,
+        "Class": cluster.MainClass(),
+    }
+
+
+class OnlineClusterer:
+    """
+    ClusterGrid fed one detection at a time, in frame order, which only keeps the clusters still in view.
+    The field of view is the bounding box of the detections of the last viewFrames frames. When a frame is complete,
+    the clusters whose centre is more than the thresholds away from it are finished and passed to onTree in
+    clusterId order: memory depends on the area seen by the camera, not on the length of the flight.
+    A tree that leaves the view and is flown over again later starts a new tree.
+    """
+    def __init__(self, hThreshold, vThreshold, onTree, viewFrames=30):
+        if viewFrames < 1:
+            raise ValueError("The field of view must span at least one frame. Got viewFrames "+str(viewFrames))
+        self.grid = ClusterGrid(hThreshold, vThreshold, keepClusters=False)
+        self.onTree = onTree
+        self.viewFrames = viewFrames
+        self.open = {}
+        #(frameNum, minX, minY, maxX, maxY) of the detections of the last frames
+        self.view = deque()
+        self.frameNum = None
+        self.origin = None
+        self.trees = 0
+        self.maxOpen = 0
+        self.frames = 0
+        self.detections = 0
+
+    def Add(self, frameNum, lat_, lon_, boxClass):
+        if self.origin is None:
+            metresPerDegreeLat, metresPerDegreeLon = MetresPerDegree(lat_)
+            self.origin = (lat_, lon_, float(metresPerDegreeLat), float(metresPerDegreeLon))
+        if frameNum != self.frameNum:
+            if self.frameNum is not None and frameNum < self.frameNum:
+                raise ValueError("The detections must be fed in frame order. Got frame "+str(frameNum)+" after frame "+str(self.frameNum))
+            self.EndFrame()
+            self.frameNum = frameNum
+            self.frames += 1
+            self.view.append([frameNum, math.inf, math.inf, -math.inf, -math.inf])
+        originLat, originLon, metresPerDegreeLat, metresPerDegreeLon = self.origin
+        x = (lon_-originLon)*metresPerDegreeLon
+        y = (lat_-originLat)*metresPerDegreeLat
+        frameView = self.view[-1]
+        frameView[1:] = [min(frameView[1], x), min(frameView[2], y), max(frameView[3], x), max(frameView[4], y)]
+        cluster = self.grid.Add(frameNum, x, y, boxClass)
+        self.detections += 1
+        self.open[cluster.clusterId] = cluster
+        self.maxOpen = max(self.maxOpen, len(self.open))
+
+    def EndFrame(self):
+        """ Finish the clusters out of the view once the detections of the current frame are all added """
+        if self.frameNum is None:
+            return
+        while self.view[0][0] <= self.frameNum-self.viewFrames:
+            self.view.popleft()
+        minX = min(frameView[1] for frameView in self.view)-self.grid.hThreshold
+        minY = min(frameView[2] for frameView in self.view)-self.grid.vThreshold
+        maxX = max(frameView[3] for frameView in self.view)+self.grid.hThreshold
+        maxY = max(frameView[4] for frameView in self.view)+self.grid.vThreshold
+        finished = []
+        for cluster in self.open.values():
+            centreX, centreY = cluster.Centre()
+            if centreX < minX or centreX > maxX or centreY < minY or centreY > maxY:
+                finished.append(cluster)
+        self._Finish(finished)
+
+    def Close(self):
+        """ Finish every open cluster, at the end of the detections """
+        self._Finish(list(self.open.values()))
+        self.view.clear()
+
+    def _Finish(self, clusters):
+        for cluster in sorted(clusters, key=lambda cluster: cluster.clusterId):
+            self.grid.Remove(cluster)
+            del self.open[cluster.clusterId]
+            self.onTree(_Tree(cluster, *self.origin))
+            self.trees += 1
+
+def ClusterDetectionsOnline(detections, hThreshold, vThreshold, onTree, viewFrames=30):
+    """
+    Merge the detections (frame, lat, lon, class), an iterable in frame order, with an OnlineClusterer.
+    Every tree is passed to onTree as soon as it is finished. Returns the clusterer, for its counts.
+    """
+    clusterer = OnlineClusterer(hThreshold, vThreshold, onTree, viewFrames)
+    for frameNum, lat_, lon_, boxClass in detections:
+        clusterer.Add(frameNum, lat_, lon_, boxClass)
+    clusterer.Close()
+    return clusterer
+
+def ClusterVideo(videoName, detections, hThreshold, vThreshold):
+    trees = ClusterDetections(detections, hThreshold, vThreshold)
+    print("Video ", videoName, ": ", len(detections), " localised bounding boxes merged into ", len(trees), " trees")
+    Count("Clustering.frames", len(set(detection[0] for detection in detections)))
+    Count("Clustering.boxes", len(detections))
+    Count("Clustering.trees", len(trees))
+    return trees
+
+class TreeWriter:
+    """
+    Results of a video written as its trees arrive: .json entries and .csv rows, the columnar folder and the
+    exported layers (exportFormats) once closed
+    """
+    def __init__(self, outputFolder, videoName, outputFormat='json', exportFormats=()):
+        self.outputFolder = outputFolder
+        self.videoName = videoName
+        self.outputFormat = outputFormat
+        self.exportFormats = exportFormats
+        self.trees = [] if WritesColumnar(outputFormat) or exportFormats else None
+        self.json = None
+        self.treeId = 0
+        if WritesJson(outputFormat):
+            os.makedirs(outputFolder, exist_ok=True)
+            self.finalPathJson = os.path.join(outputFolder,videoName+ ".json")
+            self.finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
+            self.json = JsonIncrementalWriter(self.finalPathJson)
+            self.csvFile = open(self.finalPathCsv, mode='w')
+            self.csvWriter = csv.writer(self.csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+            self.csvWriter.writerow(['Tree', 'Lat', 'Lon', 'Members', 'FirstFrame', 'LastFrame', 'Class'])
+
+    def Add(self, tree):
+        if self.trees is not None:
+            self.trees.append(tree)
+        if self.json is not None:
+            self.json.Add(str(self.treeId), tree)
+            self.csvWriter.writerow([self.treeId, tree["Lat"], tree["Lon"], tree["Members"], tree["FirstFrame"], tree["LastFrame"], tree["Class"]])
+        self.treeId += 1
+
+    def Flush(self):
+        """ Push the trees written so far to the files, for the readers of a run still going on """
+        if self.json is not None:
+            self.json.Flush()
+            self.csvFile.flush()
+
+    def Close(self):
+        if WritesColumnar(self.outputFormat):
+            print("\t Columnar >> ", WriteTreesColumnar(self.outputFolder, self.videoName, self.trees))
+        ExportTrees(self.outputFolder, self.videoName, self.trees, self.exportFormats)
+        if self.json is not None:
+            self.json.Close()
+            self.csvFile.close()
+            #Save the results
+            print("\nWriting results:")
+            print("\t (1/2) Json >> ", self.finalPathJson)
+            print("\t (2/2) Json >> ", self.finalPathCsv)
+
+def WriteClusters(outputFolder, videoName, trees, outputFormat='json', exportFormats=()):
+    writer = TreeWriter(outputFolder, videoName, outputFormat, exportFormats)
+    try:
+        for tree in trees:
+            writer.Add(tree)
+    finally:
+        writer.Close()
+
+def LoadTrees(path):
+    """ Trees written by WriteClusters, from the .json file or the columnar folder """
+    if IsColumnar(path):
+        return ReadTreesColumnar(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return list(json.load(f).values())
+
+def LoadDetections(path):
+    """ Detections of a video from a .json file or a columnar folder, which only maps the columns the clustering needs """
+    if IsColumnar(path):
+        return ReadDetectionsColumnar(path)
+    return GetDetections(LoadVideo(path))
+
+def IterDetections(path):
+    """
+    LoadDetections() one detection at a time, for the online clustering: only the current frame of the columnar folder
+    or the current entry of the .json file is in memory. The .json frames come in the file order, the frame order of the stages
+    """
+    if IsColumnar(path):
+        yield from IterDetectionsColumnar(path)
+        return
+    Count("bytesRead", PathSize(path))
+    for frameName, frameData in IterJsonItems(path):
+        for box in frameData[0]:
+            if len(box) < 2 or len(box[1]) < 2:
+                continue #bounding box without coordinates
+            yield (int(frameName), box[1][0], box[1][1], int(box[0][0]))
+
+def ClusterVideoOnline(videoName, detections, hThreshold, vThreshold, viewFrames, writer=None, keepTrees=True):
+    """
+    Trees of a video with an OnlineClusterer, passed to writer as they are finished. Returns them when keepTrees.
+    detections can be an iterator (IterDetections), it is only read once
+    """
+    trees = [] if keepTrees else None
+    def OnTree(tree):
+        if writer is not None:
+            writer.Add(tree)
+        if trees is not None:
+            trees.append(tree)
+    clusterer = ClusterDetectionsOnline(detections, hThreshold, vThreshold, OnTree, viewFrames)
+    print("Video ", videoName, ": ", clusterer.detections, " localised bounding boxes merged online into ", clusterer.trees, " trees (",
+        clusterer.maxOpen, " open at most)")
+    Count("Clustering.frames", clusterer.frames)
+    Count("Clustering.boxes", clusterer.detections)
+    Count("Clustering.trees", clusterer.trees)
+    return trees
+
+def _ClusterJob(context, videoName, detections, hThreshold, vThreshold, outputFolder, outputFormat, stream, online=None, exportFormats=()):
+    if stream:
+        #read in the process that clusters it, as the clustering goes when online
+        detections = IterDetections(detections) if online is not None else LoadDetections(detections)
+    if online is not None:
+        #Trees are written as soon as they leave the field of view
+        writer = TreeWriter(outputFolder, videoName, outputFormat, exportFormats) if outputFolder is not None else None
+        try:
+            with Span("clustering"):
+                trees = ClusterVideoOnline(videoName, detections, hThreshold, vThreshold, online, writer, keepTrees=not stream)
+        finally:
+            if writer is not None:
+                with Span("output writing"):
+                    writer.Close()
+        return trees
+    with Span("clustering"):
+        trees = ClusterVideo(videoName, detections, hThreshold, vThreshold)
+    if outputFolder is not None:
+        with Span("output writing"):
+            WriteClusters(outputFolder, videoName, trees, outputFormat, exportFormats)
+    return None if stream else trees
+
+def ClusteringDetections(detectionsPerVideo, hThreshold, vThreshold, outputFolder=None, outputFormat='json', workers=1, force=False, stream=False,
+                         online=False, viewFrames=30, exportFormats=()):
+    """
+    Merge the detections (frame, lat, lon, class) of every video into trees. Returns {videoName: [trees]}.
+    With workers > 1 the videos are clustered on a pool of processes.
+    Videos whose detections and thresholds did not change since they were written to outputFolder are read back instead, unless force.
+    With stream, detectionsPerVideo is {videoName: inputPath} (ListVideoInputs) and every video is read, clustered and written
+    before the next one: a single video is in memory at a time and nothing is returned.
+    With online, the detections are clustered in frame order by an OnlineClusterer keeping the clusters seen in the last
+    viewFrames frames, and the trees are written as soon as they leave the field of view. With stream too, the detections
+    are read from the input files as they are clustered.
+    exportFormats ("gpkg", "parquet") also writes the trees of every video as a spatially indexed point layer to outputFolder.
+    """
+    with Phase("Clustering"), ProfileStage("Clustering"):
+        return _ClusteringDetections(detectionsPerVideo, hThreshold, vThreshold, outputFolder, outputFormat, workers, force, stream, online, viewFrames, exportFormats)
+
+def _ClusteringDetections(detectionsPerVideo, hThreshold, vThreshold, outputFolder, outputFormat, workers, force, stream, online, viewFrames, exportFormats):
+    onlineView = viewFrames if online else None
+    jobs = [(videoName, (videoName, detections, hThreshold, vThreshold, outputFolder, outputFormat, stream, onlineView, exportFormats)) for videoName, detections in detectionsPerVideo.items()]
+    #Online trees differ from the batch ones where a tree is flown over again
+    extra = ("online", viewFrames) if online else ()
+    if exportFormats:
+        extra += ("export",)+tuple(exportFormats)
+    def KeyOf(videoName):
+        if stream:
+            #Keyed on its file: the detections are only read by the job
+            path = detectionsPerVideo[videoName]
+            return InputKey("Clustering", path, FileFingerprint(path), hThreshold, vThreshold, outputFormat, *extra)
+        return InputKey("Clustering", DataDigest(detectionsPerVideo[videoName]), hThreshold, vThreshold, outputFormat, *extra)
+    treesPerVideo = RunIncremental("Clustering", _ClusterJob, jobs, KeyOf, outputFolder, outputFormat, None if stream else LoadTrees, workers, force=force)
+    return None if stream else dict(treesPerVideo)
+
+def Clustering(videosList, hThreshold, vThreshold, outputFolder=None, outputFormat='json', workers=1, force=False, online=False, viewFrames=30,
+               exportFormats=()):
+    """ Merge the localised bounding boxes of every video into trees. Returns {videoName: [trees]} """
+    detectionsPerVideo = {videoName: GetDetections(frames) for videoName, frames in videosList.items()}
+    return ClusteringDetections(detectionsPerVideo, hThreshold, vThreshold, outputFolder, outputFormat, workers, force, online=online, viewFrames=viewFrames,
+                               exportFormats=exportFormats)
+
+def LoadDetectionsFromFolder(framesFolder):
+    """ Detections of every video of framesFolder """
+    detectionsPerVideo = {}
+    for videoName, path in ListVideoInputs(framesFolder).items():
+        detectionsPerVideo[videoName] = LoadDetections(path)
+    print("Loaded ", len(detectionsPerVideo), " videos")
+    return detectionsPerVideo
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--framesFolder', type=str,required=True, default='/content/output/localisation_boxes/', help='Folder containing the .json and .csv files as input')
+    parser.add_argument('--verticalThreshold', required=True, type=float, default=2.0, help='north-south distance in metres in which the variation of the bounding box is still considered of the same object')
+    parser.add_argument('--horizontalThreshold', required=True, type=float, default=2.0, help='east-west distance in metres in which the variation of the bounding box is still considered of the same object')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/clustering/', help='Output folder for the clustering algorithm')
+    parser.add_argument('--outputFormat', type=str, default='json', choices=OUTPUT_FORMATS, help='Format of the results: json (.json and .csv), columnar (memory-mappable .npy columns) or both')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes working on different videos at the same time')
+    parser.add_argument('--force', action='store_true', help='Process every video again, even the ones whose inputs did not change since the last run')
+    parser.add_argument('--stream', action='store_true', help='Keep a single video in memory at a time (per process): each video is read, processed and written before the next one')
+    parser.add_argument('--online', action='store_true', help='Cluster the boxes in frame order and write every tree as soon as the drone has flown away from it: memory depends on the field of view, not on the length of the flight. The boxes are read from the input files as they are clustered (implies --stream)')
+    parser.add_argument('--viewFrames', type=int, default=30, help='With --online, number of frames whose boxes make up the field of view. Clusters further than the thresholds from it are finished')
+    parser.add_argument('--export', type=str, action='append', default=[], choices=EXPORT_FORMATS, help='Also write the trees of every video as a point layer with a spatial index for GIS tools: gpkg (GeoPackage with an R-tree) or parquet (GeoParquet, needs pyarrow). Can be repeated')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: <outputFolder>.metrics.json)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the stage and of every video are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    stream = args.stream or args.online
+    detectionsPerVideo = ListVideoInputs(args.framesFolder) if stream else LoadDetectionsFromFolder(args.framesFolder)
+    ClusteringDetections(detectionsPerVideo, args.horizontalThreshold, args.verticalThreshold, args.outputFolder, args.outputFormat, args.workers, args.force, stream,
+                         args.online, args.viewFrames, args.export)
+    WriteRunMetrics(args.metrics or DefaultMetricsPath(args.outputFolder), "Clustering", args)
@@ -0,0 +1,223 @@
+import os
+import json
+import shutil
+from collections import OrderedDict
+import numpy as np
+
+COLUMNAR_SUFFIX = ".columns"
+META_FILE = "columns.meta"
+COLUMNAR_VERSION = 1
+
+OUTPUT_FORMATS = ["json", "columnar", "both"]
+
+#Columns of the boxes table. BoxLat/BoxLon only exist once the boxes are geolocalised
+BOX_VALUE_COLUMNS = ["BoxClass", "BoxCentreX", "BoxCentreY", "BoxWidth", "BoxHeight"]
+BOX_COORDINATE_COLUMNS = ["BoxLat", "BoxLon"]
+TREE_COLUMNS = ["Lat", "Lon", "Members", "FirstFrame", "LastFrame", "Class"]
+
+
+def WritesJson(outputFormat):
+    return outputFormat in ("json", "both")
+
+def WritesColumnar(outputFormat):
+    return outputFormat in ("columnar", "both")
+
+def ColumnarPath(folder, videoName):
+    return os.path.join(folder, videoName+COLUMNAR_SUFFIX)
+
+def IsColumnar(path):
+    return os.path.isfile(os.path.join(path, META_FILE))
+
+
+def FramesToColumns(frames):
+    """
+    {frameNum: [[boxes], {sensor:value}]} -> frames table (Frame + one column per sensor key, NaN when missing)
+    and boxes table (FrameRow, the row of its frame, + box values [+ BoxLat/BoxLon])
+    """
+    frameKeys = list(frames.keys())
+    sensorKeys = {}
+    boxCount = 0
+    located = False
+    for frameData in frames.values():
+        for key in frameData[1]:
+            sensorKeys.setdefault(key, len(sensorKeys))
+        boxCount += len(frameData[0])
+        if len(frameData[0]) > 0 and isinstance(frameData[0][0][0], list):
+            located = True
+
+    frameTable = OrderedDict()
+    frameTable["Frame"] = np.array([int(frameKey) for frameKey in frameKeys], dtype=np.int64)
+    sensorValues = np.full((len(sensorKeys), len(frameKeys)), np.nan, dtype=np.float64)
+    frameRows = np.empty(boxCount, dtype=np.int64)
+    boxValues = np.full((boxCount, len(BOX_VALUE_COLUMNS)), np.nan, dtype=np.float64)
+    boxCoordinates = np.full((boxCount, 2), np.nan, dtype=np.float64)
+    row = 0
+    for frameRow, frameKey in enumerate(frameKeys):
+        frameData = frames[frameKey]
+        for key, value in frameData[1].items():
+            sensorValues[sensorKeys[key], frameRow] = value
+        for box in frameData[0]:
+            frameRows[row] = frameRow
+            if located:
+                boxValues[row] = box[0][:len(BOX_VALUE_COLUMNS)]
+                if len(box[1]) >= 2:
+                    boxCoordinates[row] = box[1][:2]
+            else:
+                boxValues[row] = box[:len(BOX_VALUE_COLUMNS)]
+            row += 1
+    for key, index in sensorKeys.items():
+        frameTable[key] = sensorValues[index]
+
+    boxTable = OrderedDict()
+    boxTable["FrameRow"] = frameRows
+    for index, column in enumerate(BOX_VALUE_COLUMNS):
+        boxTable[column] = boxValues[:, index]
+    if located:
+        for index, column in enumerate(BOX_COORDINATE_COLUMNS):
+            boxTable[column] = boxCoordinates[:, index]
+    return frameTable, boxTable
+
+def ColumnsToFrames(frameTable, boxTable):
+    """ Inverse of FramesToColumns """
+    frameNums = np.asarray(frameTable["Frame"]).tolist()
+    sensorKeys = [key for key in frameTable if key != "Frame"]
+    sensorRows = np.column_stack([np.asarray(frameTable[key]) for key in sensorKeys]).tolist() if len(sensorKeys) > 0 else [[] for _ in frameNums]
+    frameRows = np.asarray(boxTable["FrameRow"])
+    starts = np.searchsorted(frameRows, np.arange(len(frameNums)), side='left').tolist()
+    ends = np.searchsorted(frameRows, np.arange(len(frameNums)), side='right').tolist()
+    classes = np.asarray(boxTable[BOX_VALUE_COLUMNS[0]]).astype(np.int64).tolist()
+    values = np.column_stack([np.asarray(boxTable[column]) for column in BOX_VALUE_COLUMNS[1:]]).tolist()
+    located = BOX_COORDINATE_COLUMNS[0] in boxTable
+    if located:
+        coordinates = np.column_stack([np.asarray(boxTable[column]) for column in BOX_COORDINATE_COLUMNS]).tolist()
+
+    frames = OrderedDict()
+    for frameRow, frameNum in enumerate(frameNums):
+        sensor = {}
+        for key, value in zip(sensorKeys, sensorRows[frameRow]):
+            if value == value: #skip NaN
+                sensor[key] = value
+        boxes = []
+        for i in range(starts[frameRow], ends[frameRow]):
+            box = [classes[i]]+values[i]
+            if located:
+                boxes.append([box, coordinates[i] if coordinates[i][0] == coordinates[i][0] else []])
+            else:
+                boxes.append(box)
+        frames[frameNum] = [boxes, sensor]
+    return frames
+
+
+def WriteTables(path, tables, kind):
+    """
+    Write {tableName: {column: array}} as one .npy file per column, replacing path atomically.
+    A column given as the path of an .npy file is copied as it is
+    """
+    tmpPath = path+".tmp"
+    shutil.rmtree(tmpPath, ignore_errors=True)
+    os.makedirs(tmpPath)
+    meta = {"version": COLUMNAR_VERSION, "kind": kind, "tables": {}}
+    for tableName, columns in tables.items():
+        os.makedirs(os.path.join(tmpPath, tableName))
+        meta["tables"][tableName] = list(columns)
+        for column, values in columns.items():
+            if isinstance(values, str):
+                shutil.copyfile(values, os.path.join(tmpPath, tableName, column+".npy"))
+            else:
+                np.save(os.path.join(tmpPath, tableName, column+".npy"), np.ascontiguousarray(values))
+    with open(os.path.join(tmpPath, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    os.replace(tmpPath, path)
+    return path
+
+def ReadMeta(path):
+    with open(os.path.join(path, META_FILE), 'r', encoding='utf-8') as f:
+        meta = json.load(f)
+    if meta.get("version") != COLUMNAR_VERSION:
+        raise ValueError("The columnar data in "+path+" has version "+str(meta.get("version"))+", expected "+str(COLUMNAR_VERSION))
+    return meta
+
+def ReadTable(path, tableName, columns=None, meta=None):
+    """ Memory-mapped columns of a table. Only the requested columns are opened """
+    if meta is None:
+        meta = ReadMeta(path)
+    available = meta["tables"][tableName]
+    if columns is None:
+        columns = available
+    table = OrderedDict()
+    for column in columns:
+        if column not in available:
+            raise KeyError("Column "+column+" not found in table "+tableName+" of "+path)
+        table[column] = np.load(os.path.join(path, tableName, column+".npy"), mmap_mode='r')
+    return table
+
+
+def WriteFramesColumnar(outputFolder, videoName, frames):
+    frameTable, boxTable = FramesToColumns(frames)
+    os.makedirs(outputFolder, exist_ok=True)
+    return WriteTables(ColumnarPath(outputFolder, videoName), {"frames": frameTable, "boxes": boxTable}, "frames")
+
+def ExtendColumnar(path, outputFolder, videoName, additions):
+    """
+    Columnar folder of videoName in outputFolder with the columns of the columnar folder path and the additions
+    {tableName: {column: array}}, which replace the columns of the same name. The other columns are copied without being read
+    """
+    meta = ReadMeta(path)
+    tables = OrderedDict()
+    for tableName, columns in meta["tables"].items():
+        tables[tableName] = OrderedDict((column, os.path.join(path, tableName, column+".npy")) for column in columns)
+        tables[tableName].update(additions.get(tableName, {}))
+    os.makedirs(outputFolder, exist_ok=True)
+    return WriteTables(ColumnarPath(outputFolder, videoName), tables, meta["kind"])
+
+def ReadFramesColumnar(path):
+    meta = ReadMeta(path)
+    return ColumnsToFrames(ReadTable(path, "frames", meta=meta), ReadTable(path, "boxes", meta=meta))
+
+def ReadDetectionsColumnar(path):
+    """ Localised boxes as (frame, lat, lon, class) in frame order, reading only the four columns involved """
+    meta = ReadMeta(path)
+    frameNums = np.asarray(ReadTable(path, "frames", ["Frame"], meta)["Frame"])
+    boxTable = ReadTable(path, "boxes", ["FrameRow", "BoxClass"]+BOX_COORDINATE_COLUMNS, meta)
+    boxFrames = frameNums[np.asarray(boxTable["FrameRow"])]
+    lats = np.asarray(boxTable["BoxLat"])
+    keep = np.flatnonzero(lats == lats)
+    keep = keep[np.argsort(boxFrames[keep], kind='stable')]
+    return list(zip(boxFrames[keep].tolist(), lats[keep].tolist(), np.asarray(boxTable["BoxLon"])[keep].tolist(),
+        np.asarray(boxTable["BoxClass"])[keep].astype(np.int64).tolist()))
+
+def IterDetectionsColumnar(path):
+    """ ReadDetectionsColumnar() one frame at a time: only the boxes of the current frame are read from the mapped columns """
+    meta = ReadMeta(path)
+    frameNums = np.asarray(ReadTable(path, "frames", ["Frame"], meta)["Frame"])
+    boxTable = ReadTable(path, "boxes", ["FrameRow", "BoxClass"]+BOX_COORDINATE_COLUMNS, meta)
+    #Boxes are stored grouped by the row of their frame
+    frameRows = np.arange(len(frameNums))
+    starts = np.searchsorted(boxTable["FrameRow"], frameRows, side='left').tolist()
+    ends = np.searchsorted(boxTable["FrameRow"], frameRows, side='right').tolist()
+    for frameRow in np.argsort(frameNums, kind='stable').tolist():
+        start, end = starts[frameRow], ends[frameRow]
+        if start == end:
+            continue
+        frameNum = int(frameNums[frameRow])
+        lats = np.asarray(boxTable["BoxLat"][start:end])
+        keep = lats == lats
+        lons = np.asarray(boxTable["BoxLon"][start:end])[keep]
+        classes = np.asarray(boxTable["BoxClass"][start:end])[keep].astype(np.int64)
+        for lat_, lon_, boxClass in zip(lats[keep].tolist(), lons.tolist(), classes.tolist()):
+            yield frameNum, lat_, lon_, boxClass
+
+def WriteTreesColumnar(outputFolder, videoName, trees):
+    table = OrderedDict()
+    for column in TREE_COLUMNS:
+        dtype = np.float64 if column in ("Lat", "Lon") else np.int64
+        table[column] = np.array([tree[column] for tree in trees], dtype=dtype)
+    os.makedirs(outputFolder, exist_ok=True)
+    return WriteTables(ColumnarPath(outputFolder, videoName), {"trees": table}, "trees")
+
+def ReadTreesColumnar(path):
+    table = ReadTable(path, "trees")
+    columns = {column: np.asarray(values).tolist() for column, values in table.items()}
+    return [{column: columns[column][i] for column in TREE_COLUMNS} for i in range(len(columns[TREE_COLUMNS[0]]))]
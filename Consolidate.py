@@ -1,245 +1,210 @@
-import argparse
-import os
-from posixpath import basename
-import sys
-from collections import OrderedDict
-import cv2
-import datetime
-#import pprint
-import json
-import csv
-
-
-def getListOfFiles(dirName):
-    print("Scanning in "+dirName)
-    # create a list of file and sub directories 
-    # names in the given directory 
-    listOfFile = os.listdir(dirName)
-    allFiles = list()
-    # Iterate over all the entries
-    for entry in listOfFile:
-        # Create full path
-        fullPath = os.path.join(dirName, entry)
-        # If entry is a directory then get the list of files in this directory 
-        if os.path.isdir(fullPath):
-            allFiles = allFiles + getListOfFiles(fullPath)
-        else:
-            allFiles.append(fullPath)
-                
-    return allFiles
-
-def printArgs(sourceFolder, predictionFolder, outputFolder, weightsPath, imageSize, confidenceScore, modelPath):
-    print("sourceFolder: ", sourceFolder)
-    print("predictionFolder: ", predictionFolder)
-    print("outputFolder: ", outputFolder)
-    print("weightsPath: ", weightsPath)
-    print("imageSize: ", str(imageSize))
-    print("confidenceScore: ", str(confidenceScore))
-    print("modelPath: ", modelPath)
-
-def GetSources(sourceFolder):
-    dictSubt = {}
-    #load available subtitles list
-    subtitlesPath = os.path.join(sourceFolder, "subtitles")
-    subtitlesList = getListOfFiles(subtitlesPath)
-    for subtPath in subtitlesList:
-        split = os.path.splitext(subtPath)
-        tmpKey = os.path.basename(split[0])
-        if split[1] == ".srt":
-            dictSubt[tmpKey] = subtPath
-        else :
-            print("WARNING: The file "+subtPath+" found is not an .srt subtitles file! This file has been omited.")
-        #print("\t"+"("+tmpKey+")"+subtPath+" "+warningTxt) #Debug
-    #load available videos list
-    dictFiles = {}
-    videosPath = os.path.join(sourceFolder, "videos")
-    videosList = getListOfFiles(videosPath)    
-    for vidPath in videosList:
-        tmpKey = os.path.basename(os.path.splitext(vidPath)[0])
-        #print("\t"+"("+tmpKey+")"+vidPath) #Debug
-        if tmpKey in dictSubt:
-            #Create a dictionary {objectName: [videoPath, subtitlesPath, {FrameNum:[Labels]}]}
-            dictFiles[tmpKey] = [vidPath, dictSubt[tmpKey], {}]
-        else:
-            raise Exception("The file "+vidPath+" does not have a matching subtitles file (.srt).")
-    print(str(len(dictFiles))+" object(s) were found as source file(s)")
-    return dictFiles
-
-def timestamp_to_miliseconds(line):
-    timeValues = line.split("-->")
-    startValuesTxt = timeValues[0].strip().replace(",",":").split(":")
-    endValuesTxt = timeValues[1].strip().replace(",",":").split(":")
-    startValuesList = list(map(int, startValuesTxt))    
-    endValuesList = list(map(int, endValuesTxt))
-    startValueMs = (startValuesList[0] * 60 * 60 * 1000) + (startValuesList[1] * 60000) + (startValuesList[2] * 1000) + startValuesList[3]
-    endValueMs = (endValuesList[0] * 60 * 60 * 1000) + (endValuesList[1] * 60000) + (endValuesList[2] * 1000) + endValuesList[3]
-    return startValueMs, endValueMs
-
-def Consolidate():
-    print("Consolidating!")
-    sourceFolder, predictionFolder, outputFolder, weightsPath, imageSize, confidenceScore, inferencePath = \
-        args.sourceFolder, args.predictionFolder, args.outputFolder, args.weightsPath, args.imageSize, args.confidenceScore, args.inferencePath
-    printArgs(sourceFolder, predictionFolder, outputFolder, weightsPath, imageSize, confidenceScore, inferencePath)
-
-    #Check the videos in the source folder and their subtitles
-    #{objectName: [videoPath, subtitlesPath, {FrameNum:[Labels],{sensor:sensorData}}]}
-    sourceObjects = GetSources(sourceFolder)
-
-    #loadedInference = dict()
-
-    inferenceFileList = getListOfFiles(predictionFolder)
-    for fileTmp in inferenceFileList:
-        #print("File ", fileTmp) #Debug
-        split = os.path.splitext(fileTmp)
-        fileName = os.path.basename(split[0])
-        if split[1] == ".txt":
-            split2 = fileName.rpartition('_')
-            basename = split2[0]
-            frameNum = int(split2[2])
-#            /*if not basename in loadedInference:
-#                loadedInference[basename] = OrderedDict()
-
-            with open(fileTmp, 'r') as reader:
-                #print("opening '"+basename+"' frame "+frameNum) #Debug
-                attr = []
-                for line in reader.readlines():
-                    x = line.split(' ')
-                    x.pop()
-                    attr.append([int(x[0]), float(x[1]), float(x[2]), float(x[3]), float(x[4])])
-                    
-            ((sourceObjects[basename])[2])[frameNum] = [attr, {}]
-            # {baseName : {frameNum, (labels)}}
-    
-    #sort
-    for keySort, valueSort in sourceObjects.items():
-        unsortedDict = valueSort[2]
-        sourceObjects[keySort][2] = OrderedDict(sorted(unsortedDict.items()))
-
-    #Print - Debug
-    print("Number of objects: ", len(sourceObjects.keys()))
-    for keyOne, valueOne in sourceObjects.items():
-        print("\tVideo '", keyOne, "' has ", len(valueOne[2]))
-        #for keyTwo, valueTwo in valueOne[2].items():
-            #print("\t\tFrame ", keyTwo)
-
-    #Load Subtitles data per video
-    for keyObjFPS, valueObjFPS in sourceObjects.items():
-
-        #Load Subtitles file
-        subtitles = OrderedDict()
-        with open(valueObjFPS[1], 'r', encoding='utf-8') as f:
-            text = f.readlines()
-            startMs = 0
-            endMs = 0
-            l = 0
-            for line_ in text:
-                #print("line:", line_, "->", l)
-                if l == 1:
-                    startMs, endMs = timestamp_to_miliseconds(line_)
-                    #print("Start: ", startMs, " End: ", endMs)
-                elif l == 2:
-                    vals = line_.split(" ")
-                    varDict = {}
-                    #print("Vals:", vals)
-                    for var in vals:
-                        #print("Var:", var)
-                        sd = var.split(":")
-                        if(len(sd)==2):
-                            varDict[sd[0]] = float(sd[1])
-
-                    subtitles[startMs] = [endMs, varDict]
-                    startMs = 0
-                    endMs = 0
-                l+=1
-                if(l==4):
-                    l=0
-        subtitles = OrderedDict(sorted(subtitles.items()))
-        #pprint.pprint(subtitles)
-
-        #Get FPS of video        
-        cam = cv2.VideoCapture(valueObjFPS[0])
-        fps = cam.get(cv2.CAP_PROP_FPS)
-        #print("FPS:", fps)
-
-        #loop the frames dictionary
-        for frameIndexKey, frameIndexValues in valueObjFPS[2].items():
-            #print("Matching frame ", frameIndexKey, " with subtitles values")
-            timestamp = float(frameIndexKey)/fps
-            frameMs = 1000.0*timestamp
-            #timestampR = datetime.datetime.fromtimestamp(frameMs//1000)
-            #print("\t\tFrame: ", frameIndexKey, " -> timestamp: ", timestamp, " -> frameMs:", round(frameMs,2))
-            relevantSubt = {}
-            for d_key, d_value in subtitles.items():
-                if(frameMs >= d_key):
-                    if(frameMs < d_value[0]):
-                        relevantSubt = dict(d_value[1])
-                else:
-                    break
-            if(len(relevantSubt) == 0):
-                print("\t\t\tWarning! No sensor data found in the .srt file for frame "+str(frameIndexKey)+"!")
-            relevantSubt["Timestamp"] = timestamp
-            frameIndexValues[1] = relevantSubt
-            sourceObjects[keyObjFPS][2][frameIndexKey] = frameIndexValues
-            #print(sourceObjects[keyObjFPS][2][frameIndexKey])
-        
-        #print(sourceObjects[keyObjFPS][2])
-        #pprint.pprint(sourceObjects[keyObjFPS])
-
-
-        frame_count = int(cam.get(cv2.CAP_PROP_FRAME_COUNT))
-        duration = frame_count/fps
-        print('fps = ' + str(fps))
-        print('number of frames = ' + str(frame_count))
-        print('duration (ms) = ' + str(duration*1000.0))
-        minutes = int(duration/60)
-        seconds = duration%60
-        print('duration (M:S) = ' + str(minutes) + ':' + str(seconds))
-
-        #Save the results
-        print("\nWriting results:")
-        os.makedirs(outputFolder, exist_ok=True)
-        finalPathJson = os.path.join(outputFolder,keyObjFPS+ ".json")
-        finalPathCsv = os.path.join(outputFolder,keyObjFPS+ ".csv")
-        with open(finalPathJson, 'w', encoding='utf-8') as f:
-            json.dump(sourceObjects[keyObjFPS][2], f, ensure_ascii=False, indent=4)
-        print("\t (1/2) Json >> ", finalPathJson)
-
-
-        line_header = ['Frame', 'Lat', 'Lon', 'Alt', 'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'Timestamp', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', ]
-        lines_content = []
-        #{FrameNum:[[Labels],{sensor:sensorData}]}
-        for frame_key, frame_value in sourceObjects[keyObjFPS][2].items():
-            droneData = []
-            if(len(frame_value[1]) > 1):
-                droneData = \
-                    [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"],\
-                    frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
-                    frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"], frame_value[1]["Timestamp"]]
-            else:
-                droneData = ['', '', '', '', '', '', '', '', '', '']
-
-            for label_tmp in frame_value[0]:
-                lines_content.append([frame_key] + droneData + label_tmp)
-        with open(finalPathCsv, mode='w') as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-            csv_writer.writerow(line_header)
-            csv_writer.writerows(lines_content)  
-        print("\t (2/2) Json >> ", finalPathCsv)
-
-    
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--sourceFolder', type=str, default='/content/input/source/', help='Folder containing the video folder and srt subtitles folder')
-parser.add_argument('--predictionFolder', type=str, default='/content/output/inference/', help='Output folder for the prediction model')
-parser.add_argument('--outputFolder', type=str, default='/content/output/localisation/', help='Output folder for the localisation algorithm')  # output folder
-parser.add_argument('--weightsPath', type=str, default='/content/input/weights/weights.pt', help='Path of the weights file of the prediction model')
-parser.add_argument('--imageSize', type=int, default=448, help='Size of the images used at model training')
-parser.add_argument('--confidenceScore', type=float, default=0.4, help='Confidence score used when predicting')
-parser.add_argument('--inferencePath', type=str, default='/content/ScaledYOLOv4/inference/output/', help='Path of the predictor result folder')
-args = parser.parse_args()
-print(args)
-Consolidate()
-
-
-
+import argparse
+import os
+from collections import OrderedDict
+#import pprint
+import csv
+import numpy as np
+from SrtTelemetry import LoadSrtTelemetry, SubtitleIndex, CACHE_SUFFIX as SRT_CACHE_SUFFIX
+from LabelLoader import LoadLabels
+from SourceCatalog import FindSources
+from VideoMetadata import VideoMetadataProvider, ProbeVideo, DefaultCachePath
+from Columnar import OUTPUT_FORMATS, WritesJson, WritesColumnar, WriteFramesColumnar
+from StageIO import LoadVideo, WriteJsonIncremental
+from Manifest import RunIncremental, InputKey, FileFingerprint, ArrayDigest
+from Metrics import Count, Phase, DefaultMetricsPath, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, Span
+
+
+def printArgs(sourceFolder, predictionFolder, outputFolder, weightsPath, imageSize, confidenceScore, modelPath):
+    print("sourceFolder: ", sourceFolder)
+    print("predictionFolder: ", predictionFolder)
+    print("outputFolder: ", outputFolder)
+    print("weightsPath: ", weightsPath)
+    print("imageSize: ", str(imageSize))
+    print("confidenceScore: ", str(confidenceScore))
+    print("modelPath: ", modelPath)
+
+def GetSources(sourceFolder):
+    """ {objectName: [videoPath, subtitlesPath, {}]} of the videos of sourceFolder, through its source catalog """
+    #The telemetry cache is written next to the .srt
+    return FindSources(sourceFolder, ignoredSuffixes=[SRT_CACHE_SUFFIX])
+
+def ConsolidateVideo(videoName, videoPath, srtPath, frames, srtCache=True, metadata=None):
+    """
+    Attach to every frame {FrameNum:[[Labels],{}]} of a video the sensor data of its subtitles record.
+    metadata is the VideoMetadataProvider entry of the video, it is probed here when None.
+    """
+    #Load Subtitles file
+    with Span("SRT parsing"):
+        telemetry = LoadSrtTelemetry(srtPath, useCache=srtCache)
+
+    #Get FPS of video        
+    if metadata is None:
+        metadata = ProbeVideo(videoPath)
+    fps = metadata["fps"]
+    #print("FPS:", fps)
+
+    #Match every frame with its subtitles record in one pass
+    subtitleIndex = SubtitleIndex(telemetry)
+    frameKeys = list(frames.keys())
+    timestamps = np.array(frameKeys, dtype=np.float64)/fps
+    matches = subtitleIndex.Match(1000.0*timestamps)
+    framesWithoutSensor = []
+    for frameIndexKey, timestamp, match in zip(frameKeys, timestamps.tolist(), matches.tolist()):
+        frameIndexValues = frames[frameIndexKey]
+        relevantSubt = subtitleIndex.Record(match)
+        if(len(relevantSubt) == 0):
+            framesWithoutSensor.append(frameIndexKey)
+        relevantSubt["Timestamp"] = timestamp
+        frameIndexValues[1] = relevantSubt
+        #print(frames[frameIndexKey])
+    #One line per video instead of one per frame
+    if len(framesWithoutSensor) > 0:
+        print("\t\t\tWarning! No sensor data found in the .srt file for "+str(len(framesWithoutSensor))+" frame(s) of "+videoName+ \
+            ", first: "+", ".join(str(frameNum) for frameNum in framesWithoutSensor[:5]))
+    Count("Consolidate.frames", len(frameKeys))
+    Count("Consolidate.boxes", sum(len(frameData[0]) for frameData in frames.values()))
+    Count("Consolidate.framesWithoutTelemetry", len(framesWithoutSensor))
+
+    frame_count = metadata["frameCount"]
+    duration = metadata["duration"]
+    print('fps = ' + str(fps))
+    print('number of frames = ' + str(frame_count))
+    print('duration (ms) = ' + str(duration*1000.0))
+    minutes = int(duration/60)
+    seconds = duration%60
+    print('duration (M:S) = ' + str(minutes) + ':' + str(seconds))
+    return frames
+
+def WriteConsolidated(outputFolder, videoName, frames, outputFormat='json'):
+    if WritesColumnar(outputFormat):
+        print("\t Columnar >> ", WriteFramesColumnar(outputFolder, videoName, frames))
+    if not WritesJson(outputFormat):
+        return
+    #Save the results
+    print("\nWriting results:")
+    os.makedirs(outputFolder, exist_ok=True)
+    finalPathJson = os.path.join(outputFolder,videoName+ ".json")
+    finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
+    WriteJsonIncremental(finalPathJson, frames.items())
+    print("\t (1/2) Json >> ", finalPathJson)
+
+
+    line_header = ['Frame', 'Lat', 'Lon', 'Alt', 'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'Timestamp', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', ]
+    with open(finalPathCsv, mode='w') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        csv_writer.writerow(line_header)
+        #{FrameNum:[[Labels],{sensor:sensorData}]}
+        for frame_key, frame_value in frames.items():
+            droneData = []
+            if(len(frame_value[1]) > 1):
+                droneData = \
+                    [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"],\
+                    frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
+                    frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"], frame_value[1]["Timestamp"]]
+            else:
+                droneData = ['', '', '', '', '', '', '', '', '', '']
+
+            for label_tmp in frame_value[0]:
+                csv_writer.writerow([frame_key] + droneData + label_tmp)
+    print("\t (2/2) Json >> ", finalPathCsv)
+
+def FramesFromLabels(videoLabels):
+    """ {FrameNum:[[Labels],{}]} sorted by frame. None: video without labels """
+    frames = OrderedDict()
+    if videoLabels is not None:
+        for frameNum, attr in sorted(videoLabels.BoxesPerFrame().items()):
+            frames[frameNum] = [attr, {}]
+    return frames
+
+def _ConsolidateJob(context, videoName, videoPath, srtPath, videoLabels, metadata, srtCache, outputFolder, outputFormat, stream):
+    frames = ConsolidateVideo(videoName, videoPath, srtPath, FramesFromLabels(videoLabels), srtCache, metadata)
+    if outputFolder is not None:
+        with Span("output writing"):
+            WriteConsolidated(outputFolder, videoName, frames, outputFormat)
+    return None if stream else frames
+
+def Consolidate(sourceFolder, predictionFolder, outputFolder=None, srtCache=True, labelArchive=None, labelWorkers=16, outputFormat='json', workers=1, force=False, stream=False,
+        metadataCache=None, probeWorkers=8):
+    """
+    Consolidate the predictions and the subtitles of every video of sourceFolder.
+    Returns {videoName: {FrameNum:[[Labels],{sensor:sensorData}]}}. Results are written to outputFolder when given.
+    With workers > 1 the videos are consolidated on a pool of processes.
+    Videos whose video, subtitles and labels did not change since they were written to outputFolder are read back instead, unless force.
+    With stream the frames of a video are only built while it is processed and released once written: nothing is returned.
+    The frame rate and length of the videos are probed on probeWorkers threads and cached in metadataCache
+    (default: <sourceFolder>.videoMetadata.json).
+    """
+    with Phase("Consolidate"), ProfileStage("Consolidate"):
+        return _Consolidate(sourceFolder, predictionFolder, outputFolder, srtCache, labelArchive, labelWorkers, outputFormat, workers, force, stream,
+            metadataCache, probeWorkers)
+
+def _Consolidate(sourceFolder, predictionFolder, outputFolder, srtCache, labelArchive, labelWorkers, outputFormat, workers, force, stream, metadataCache, probeWorkers):
+    print("Consolidating!")
+
+    #Check the videos in the source folder and their subtitles
+    #{objectName: [videoPath, subtitlesPath, {}]}
+    sourceObjects = GetSources(sourceFolder)
+
+    #Labels stay packed in arrays until their video is processed
+    with Phase("Consolidate.loadLabels"), Span("label loading"):
+        labelsPerVideo = LoadLabels(predictionFolder, labelArchive=labelArchive, workers=labelWorkers)
+    unknownVideos = [basename for basename in labelsPerVideo if basename not in sourceObjects]
+    if len(unknownVideos) > 0:
+        raise Exception("The labels of "+", ".join(unknownVideos)+" do not have a matching video in "+sourceFolder)
+
+    #Print - Debug
+    print("Number of objects: ", len(sourceObjects.keys()))
+    for keyOne in sourceObjects:
+        print("\tVideo '", keyOne, "' has ", len(labelsPerVideo[keyOne].frames) if keyOne in labelsPerVideo else 0)
+
+    #Frame rate of every video, without opening the ones probed in a previous run
+    with Phase("Consolidate.probeVideos"):
+        provider = VideoMetadataProvider(metadataCache or DefaultCachePath(sourceFolder), workers=probeWorkers)
+        metadataPerVideo = provider.Probe([valueObjFPS[0] for valueObjFPS in sourceObjects.values()])
+
+    #Load Subtitles data per video
+    jobs = [(keyObjFPS, (keyObjFPS, valueObjFPS[0], valueObjFPS[1], labelsPerVideo.get(keyObjFPS), metadataPerVideo[valueObjFPS[0]], srtCache, outputFolder, outputFormat, stream)) \
+        for keyObjFPS, valueObjFPS in sourceObjects.items()]
+    def KeyOf(videoName):
+        videoPath, srtPath, _ = sourceObjects[videoName]
+        videoLabels = labelsPerVideo.get(videoName)
+        labelsDigest = ArrayDigest(videoLabels.frames, videoLabels.boxes) if videoLabels is not None else None
+        return InputKey("Consolidate", videoPath, FileFingerprint(videoPath), srtPath, FileFingerprint(srtPath), labelsDigest, outputFormat)
+    videosList = RunIncremental("Consolidate", _ConsolidateJob, jobs, KeyOf, outputFolder, outputFormat, None if stream else LoadVideo, workers, force=force)
+    return None if stream else dict(videosList)
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sourceFolder', type=str, default='/content/input/source/', help='Folder containing the video folder and srt subtitles folder')
+    parser.add_argument('--predictionFolder', type=str, default='/content/output/inference/', help='Output folder for the prediction model')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/localisation/', help='Output folder for the localisation algorithm')  # output folder
+    parser.add_argument('--weightsPath', type=str, default='/content/input/weights/weights.pt', help='Path of the weights file of the prediction model')
+    parser.add_argument('--imageSize', type=int, default=448, help='Size of the images used at model training')
+    parser.add_argument('--confidenceScore', type=float, default=0.4, help='Confidence score used when predicting')
+    parser.add_argument('--inferencePath', type=str, default='/content/ScaledYOLOv4/inference/output/', help='Path of the predictor result folder')
+    parser.add_argument('--noSrtCache', action='store_true', help='Always parse the .srt files instead of reusing the .npz telemetry cache written next to them')
+    parser.add_argument('--labelArchive', type=str, default=None, help='Packed .npz archive of the prediction labels. Read instead of predictionFolder when it exists, written from predictionFolder otherwise')
+    parser.add_argument('--labelWorkers', type=int, default=16, help='Number of threads used to read the prediction label files')
+    parser.add_argument('--videoMetadataCache', type=str, default=None, help='Path of the cache of the frame rate and length of the videos (default: <sourceFolder>.videoMetadata.json)')
+    parser.add_argument('--probeWorkers', type=int, default=8, help='Number of threads used to probe the videos missing from the metadata cache')
+    parser.add_argument('--outputFormat', type=str, default='json', choices=OUTPUT_FORMATS, help='Format of the results: json (.json and .csv), columnar (memory-mappable .npy columns) or both')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes working on different videos at the same time')
+    parser.add_argument('--force', action='store_true', help='Process every video again, even the ones whose inputs did not change since the last run')
+    parser.add_argument('--stream', action='store_true', help='Keep a single video in memory at a time (per process): the results are only written to outputFolder')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: <outputFolder>.metrics.json)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the stage and of every video are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    printArgs(args.sourceFolder, args.predictionFolder, args.outputFolder, args.weightsPath, args.imageSize, args.confidenceScore, args.inferencePath)
+    Consolidate(args.sourceFolder, args.predictionFolder, args.outputFolder, srtCache=not args.noSrtCache, \
+        labelArchive=args.labelArchive, labelWorkers=args.labelWorkers, outputFormat=args.outputFormat, workers=args.workers, force=args.force, stream=args.stream, \
+        metadataCache=args.videoMetadataCache, probeWorkers=args.probeWorkers)
+    WriteRunMetrics(args.metrics or DefaultMetricsPath(args.outputFolder), "Consolidate", args)
@@ -0,0 +1,188 @@
+from collections import OrderedDict
+import numpy as np
+from osgeo import gdal, osr
+
+
+class LRUCache:
+    """ Size-bounded least-recently-used cache that keeps hit/miss counters """
+    def __init__(self, maxSize, sizeOf=None):
+        self.maxSize = maxSize
+        self.sizeOf = sizeOf if sizeOf is not None else (lambda value: 1)
+        self.entries = OrderedDict()
+        self.currentSize = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def Get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def Put(self, key, value):
+        if key in self.entries:
+            self.currentSize -= self.sizeOf(self.entries.pop(key))
+        self.entries[key] = value
+        self.currentSize += self.sizeOf(value)
+        #Always keep the newest entry, even if it is bigger than the whole cache
+        while self.currentSize > self.maxSize and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.currentSize -= self.sizeOf(evicted)
+            self.evictions += 1
+
+    def Stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitRate": (self.hits/lookups) if lookups > 0 else 0.0,
+            "entries": len(self.entries),
+            "size": self.currentSize,
+        }
+
+
+class DemTile:
+    """ Open GeoTIF tile with everything needed to map a lat/lon to one of its pixels """
+    def __init__(self, path, dataset, latLonToTile):
+        self.path = path
+        self.dataset = dataset
+        self.band = dataset.GetRasterBand(1)
+        self.latLonToTile = latLonToTile
+        self.cols = dataset.RasterXSize
+        self.rows = dataset.RasterYSize
+        transform = dataset.GetGeoTransform()
+        self.xOrigin = transform[0]
+        self.yOrigin = transform[3]
+        self.pixelWidth = transform[1]
+        self.pixelHeight = -transform[5]
+        self.blockCols, self.blockRows = self.band.GetBlockSize()
+
+    def PixelFromProjected(self, X, Y):
+        col = int((X - self.xOrigin) / self.pixelWidth)
+        row = int((self.yOrigin - Y) / self.pixelHeight)
+        return row, col
+
+
+class ElevationService:
+    """
+    Terrain elevation lookups over a set of GeoTIF tiles.
+    Open datasets, coordinate transformations and decoded raster blocks are kept in LRU caches,
+    so a lookup only reads (and decodes) the block that holds the requested pixel.
+    """
+    def __init__(self, maxOpenTiles=32, blockCacheMB=256, maxTransforms=16):
+        self.tiles = LRUCache(maxOpenTiles)
+        self.transforms = LRUCache(maxTransforms)
+        self.blocks = LRUCache(blockCacheMB*1024*1024, sizeOf=lambda block: block.nbytes)
+        self.bytesRead = 0
+
+    def GetTransform(self, projectionWkt):
+        ct = self.transforms.Get(projectionWkt)
+        if ct is None:
+            srs = osr.SpatialReference()
+            srs.ImportFromWkt(projectionWkt)
+            srsLatLong = srs.CloneGeogCS()
+            ct = osr.CoordinateTransformation(srsLatLong, srs)
+            self.transforms.Put(projectionWkt, ct)
+        return ct
+
+    def GetTile(self, tilePath):
+        tile = self.tiles.Get(tilePath)
+        if tile is None:
+            dataset = gdal.Open(tilePath, gdal.GA_ReadOnly)
+            if dataset is None:
+                raise IOError("The DEM tile "+str(tilePath)+" could not be opened.")
+            tile = DemTile(tilePath, dataset, self.GetTransform(dataset.GetProjection()))
+            self.tiles.Put(tilePath, tile)
+        return tile
+
+    def GetBlock(self, tile, blockX, blockY):
+        key = (tile.path, blockX, blockY)
+        block = self.blocks.Get(key)
+        if block is None:
+            xOff = blockX*tile.blockCols
+            yOff = blockY*tile.blockRows
+            xSize = min(tile.blockCols, tile.cols - xOff)
+            ySize = min(tile.blockRows, tile.rows - yOff)
+            block = tile.band.ReadAsArray(xOff, yOff, xSize, ySize)
+            self.bytesRead += block.nbytes
+            self.blocks.Put(key, block)
+        return block
+
+    def ReadPixel(self, tile, row, col):
+        if not (0 <= row < tile.rows and 0 <= col < tile.cols):
+            raise IndexError("Pixel (row "+str(row)+", col "+str(col)+") is outside of the DEM tile "+str(tile.path))
+        blockX = col // tile.blockCols
+        blockY = row // tile.blockRows
+        block = self.GetBlock(tile, blockX, blockY)
+        return block[row - blockY*tile.blockRows][col - blockX*tile.blockCols]
+
+    def GetAltitude(self, lat_, lon_, tilePath):
+        tile = self.GetTile(tilePath)
+        (X, Y, height) = tile.latLonToTile.TransformPoint(lon_, lat_)
+        row, col = tile.PixelFromProjected(X, Y)
+        return self.ReadPixel(tile, row, col)
+
+    def GetAltitudes(self, lats, lons, tilePaths):
+        """
+        Batch version of GetAltitude. Points are grouped by tile, each group is transformed with a single
+        TransformPoints call, then by raster block: every distinct block is read once through the block cache
+        and the heights of its points are taken with one fancy-indexing operation.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        tilePaths = np.asarray(tilePaths, dtype=object)
+        groups = []
+        for tilePath in dict.fromkeys(tilePaths.tolist()):
+            if tilePath is None:
+                raise ValueError("No DEM tile covers "+str(int(np.count_nonzero(tilePaths == None)))+" of the requested points.")
+            selection = np.flatnonzero(tilePaths == tilePath)
+            tile = self.GetTile(tilePath)
+            projected = np.asarray(tile.latLonToTile.TransformPoints(list(zip(lons[selection].tolist(), lats[selection].tolist()))), dtype=np.float64)
+            #astype(int) truncates towards zero like int() in PixelFromProjected
+            cols = ((projected[:, 0] - tile.xOrigin) / tile.pixelWidth).astype(np.int64)
+            rows = ((tile.yOrigin - projected[:, 1]) / tile.pixelHeight).astype(np.int64)
+            if rows.min() < 0 or cols.min() < 0 or rows.max() >= tile.rows or cols.max() >= tile.cols:
+                raise IndexError("Some of the requested pixels are outside of the DEM tile "+str(tilePath))
+            blockXs = cols // tile.blockCols
+            blockYs = rows // tile.blockRows
+            blockKeys = blockYs*(-(-tile.cols//tile.blockCols)) + blockXs
+            #Points sorted by block, one run of points per block
+            order = np.argsort(blockKeys, kind='stable')
+            sortedKeys = blockKeys[order]
+            starts = np.flatnonzero(np.r_[True, sortedKeys[1:] != sortedKeys[:-1]])
+            ends = np.r_[starts[1:], len(order)]
+            values = None
+            for start, end in zip(starts.tolist(), ends.tolist()):
+                points = order[start:end]
+                blockX, blockY = int(blockXs[points[0]]), int(blockYs[points[0]])
+                block = self.GetBlock(tile, blockX, blockY)
+                if values is None:
+                    values = np.empty(len(order), dtype=block.dtype)
+                values[points] = block[rows[points] - blockY*tile.blockRows, cols[points] - blockX*tile.blockCols]
+            groups.append((selection, values))
+        #Keep the data type of the rasters, as GetAltitude does
+        heights = np.empty(lats.shape[0], dtype=np.result_type(*[values.dtype for _, values in groups]) if groups else np.float64)
+        for selection, values in groups:
+            heights[selection] = values
+        return heights
+
+    def Stats(self):
+        return {
+            "tiles": self.tiles.Stats(),
+            "transforms": self.transforms.Stats(),
+            "blocks": self.blocks.Stats(),
+            "bytesRead": self.bytesRead,
+        }
+
+    def PrintStats(self):
+        print("DEM cache statistics:")
+        for name, stats in self.Stats().items():
+            if isinstance(stats, dict):
+                print("\t", name, ": hits ", stats["hits"], ", misses ", stats["misses"], ", evictions ", stats["evictions"], ", hit rate ", round(stats["hitRate"]*100, 1), "%")
+            else:
+                print("\t", name, ": ", stats)
@@ -0,0 +1,263 @@
+import os
+import json
+import math
+import numpy as np
+from osgeo import osr
+from Manifest import FileFingerprint, DataDigest
+from Metrics import Count
+
+MOSAIC_VERSION = 2
+#Pixels kept around the flight footprint
+MARGIN_PIXELS = 16
+
+
+def MosaicPaths(basePath):
+    """ Heights, owner tiles and description of the mosaic stored at basePath """
+    return basePath+".heights.npy", basePath+".owner.npy", basePath+".json"
+
+class DemMosaic:
+    """
+    Crops of the DEM tiles under the flights, mosaicked into one memory-mapped array with a geotransform.
+    Every connected group of tiles under the flights is a part of the mosaic, cropped to the flights over it, so distant
+    sites do not allocate the ground between them. It answers GetAltitude(s) like ElevationService, without tile lookups.
+    Every pixel keeps the number of the tile it comes from (0: none), so the pixel of a point is computed from the origin
+    of its own tile, as ElevationService does.
+    """
+    def __init__(self, basePath):
+        heightsPath, ownerPath, metaPath = MosaicPaths(basePath)
+        with open(metaPath, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != MOSAIC_VERSION:
+            raise ValueError("The DEM mosaic "+basePath+" has version "+str(self.meta.get("version"))+", expected "+str(MOSAIC_VERSION)+". Build it again.")
+        self.basePath = basePath
+        #Pixels of every part, one part after the other
+        self.heights = np.load(heightsPath, mmap_mode='r')
+        self.owner = np.load(ownerPath, mmap_mode='r')
+        #xOrigin, yOrigin, rowOffset, colOffset of every tile
+        self.tileOrigins = np.asarray(self.meta["tileOrigins"], dtype=np.float64).reshape(-1, 4)
+        #minLat, minLon, maxLat, maxLon of the flights and rowOffset, colOffset, rows, cols, start of the pixels of every part
+        self.footprints = np.asarray([part["footprint"] for part in self.meta["parts"]], dtype=np.float64).reshape(-1, 4)
+        self.partGrid = np.asarray([part["offset"]+part["shape"]+[part["start"]] for part in self.meta["parts"]], dtype=np.int64).reshape(-1, 5)
+        srs = osr.SpatialReference()
+        srs.ImportFromWkt(self.meta["projection"])
+        self.latLonToMosaic = osr.CoordinateTransformation(srs.CloneGeogCS(), srs)
+        self.xAnchor, self.yAnchor = self.meta["anchor"]
+        self.pixelWidth, self.pixelHeight = self.meta["pixelSize"]
+
+    def _Index(self, partOf, rows, cols):
+        """ Index in the pixel arrays of the pixels (rows, cols of the grid of the anchor) in their part, -1 outside of it """
+        grid = self.partGrid[np.maximum(partOf, 0)]
+        rows = rows - grid[:, 0]
+        cols = cols - grid[:, 1]
+        inside = (partOf >= 0) & (rows >= 0) & (cols >= 0) & (rows < grid[:, 2]) & (cols < grid[:, 3])
+        return np.where(inside, grid[:, 4] + rows*grid[:, 3] + cols, -1)
+
+    def Pixels(self, lats, lons):
+        """ Index in the pixel arrays of the points. Points outside of the tiles get -1 """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        projected = np.asarray(self.latLonToMosaic.TransformPoints(list(zip(lons.tolist(), lats.tolist()))), dtype=np.float64).reshape(-1, 3)
+        X = projected[:, 0]
+        Y = projected[:, 1]
+        cols = np.floor((X - self.xAnchor) / self.pixelWidth).astype(np.int64)
+        rows = np.floor((self.yAnchor - Y) / self.pixelHeight).astype(np.int64)
+        #Part of every point: the one of the flights over it, otherwise any part reaching it
+        partOf = np.full(lats.shape[0], -1, dtype=np.int64)
+        for part, (minLat, minLon, maxLat, maxLon) in enumerate(self.footprints.tolist()):
+            partOf[(partOf < 0) & (lats >= minLat) & (lons >= minLon) & (lats <= maxLat) & (lons <= maxLon)] = part
+        for part, (rowOffset, colOffset, partRows, partCols, _) in enumerate(self.partGrid.tolist()):
+            partOf[(partOf < 0) & (rows >= rowOffset) & (cols >= colOffset) & (rows < rowOffset+partRows) & (cols < colOffset+partCols)] = part
+        #Tile of every point, from the pixel counted from the anchor
+        index = self._Index(partOf, rows, cols)
+        owner = np.zeros(index.shape[0], dtype=np.int64)
+        owner[index >= 0] = self.owner[index[index >= 0]]
+        #Pixel counted from the origin of that tile, truncated like ElevationService
+        origins = self.tileOrigins[np.maximum(owner-1, 0)]
+        cols = ((X - origins[:, 0]) / self.pixelWidth).astype(np.int64) + origins[:, 3].astype(np.int64)
+        rows = ((origins[:, 1] - Y) / self.pixelHeight).astype(np.int64) + origins[:, 2].astype(np.int64)
+        index = self._Index(partOf, rows, cols)
+        index[owner == 0] = -1
+        return index
+
+    def GetAltitudes(self, lats, lons, tilePaths=None):
+        index = self.Pixels(lats, lons)
+        missing = index < 0
+        if missing.any():
+            raise ValueError("The DEM mosaic "+self.basePath+" does not cover "+str(int(np.count_nonzero(missing)))+" of the requested points.")
+        return self.heights[index]
+
+    def GetAltitude(self, lat_, lon_, tilePath=None):
+        return self.GetAltitudes([lat_], [lon_])[0]
+
+
+def _TileBox(tile):
+    """ (minLat, minLon, maxLat, maxLon) of a tile of the tile list """
+    return tile[2][1], tile[3][0], tile[1][1], tile[2][0]
+
+def FlightGroups(videoPositions, tileIndex):
+    """
+    Footprints (minLat, minLon, maxLat, maxLon) of the flights over every connected group of the tiles under them,
+    from the (lats, lons) positions of every video. Tiles touching each other are in the same group.
+    """
+    lats = np.concatenate([np.empty(0)]+[positions[0] for positions in videoPositions])
+    lons = np.concatenate([np.empty(0)]+[positions[1] for positions in videoPositions])
+    orderOf = {tile[4]: order for order, tile in enumerate(tileIndex.tileList)}
+    pointTiles = np.array([-1 if tilePath is None else orderOf[tilePath] for tilePath in tileIndex.FindMany(lats.tolist(), lons.tolist())], dtype=np.int64)
+    #Union-find of the tiles under the flights
+    parent = {order: order for order in np.unique(pointTiles[pointTiles >= 0]).tolist()}
+    def Root(order):
+        while parent[order] != order:
+            parent[order] = parent[parent[order]]
+            order = parent[order]
+        return order
+    for order in list(parent):
+        for tilePath in tileIndex.Intersecting(*_TileBox(tileIndex.tileList[order])):
+            if orderOf[tilePath] in parent:
+                parent[Root(orderOf[tilePath])] = Root(order)
+    groupOf = np.full(len(tileIndex.tileList)+1, -1, dtype=np.int64)
+    for order in parent:
+        groupOf[order] = Root(order)
+    pointGroups = groupOf[pointTiles]
+    footprints = []
+    for group in np.unique(pointGroups[pointGroups >= 0]).tolist():
+        inGroup = pointGroups == group
+        footprints.append((float(lats[inGroup].min()), float(lons[inGroup].min()), float(lats[inGroup].max()), float(lons[inGroup].max())))
+    return footprints
+
+def _TileGrid(tiles):
+    """ Offset (rows, cols) of every tile on the pixel grid of the first one. None when the tiles do not share a grid """
+    first = tiles[0]
+    projection = first.dataset.GetProjection()
+    offsets = []
+    for tile in tiles:
+        if tile.dataset.GetProjection() != projection or not math.isclose(tile.pixelWidth, first.pixelWidth, rel_tol=1e-9) \
+                or not math.isclose(tile.pixelHeight, first.pixelHeight, rel_tol=1e-9):
+            return None
+        colOffset = (tile.xOrigin - first.xOrigin) / first.pixelWidth
+        rowOffset = (first.yOrigin - tile.yOrigin) / first.pixelHeight
+        if abs(colOffset-round(colOffset)) > 1e-6 or abs(rowOffset-round(rowOffset)) > 1e-6:
+            return None
+        offsets.append((int(round(rowOffset)), int(round(colOffset))))
+    return offsets
+
+def BuildDemMosaic(basePath, footprints, tileIndex, elevationService, demFiles, marginPixels=MARGIN_PIXELS):
+    """
+    Mosaic of the tiles (in TileIndex order, the first one wins where they overlap) with one part per flight footprint
+    (FlightGroups), cropped to it. demFiles, the GeoTIF files of the DEM folder, are recorded to notice new tiles.
+    Returns None when the tiles do not share projection and pixel grid, or do not reach the flights.
+    """
+    orderOf = {tile[4]: order for order, tile in enumerate(tileIndex.tileList)}
+    partTiles = [tileIndex.Intersecting(*footprint) for footprint in footprints]
+    tilePaths = sorted(set(tilePath for tiles in partTiles for tilePath in tiles), key=orderOf.get)
+    tiles = [elevationService.GetTile(tilePath) for tilePath in tilePaths]
+    offsets = _TileGrid(tiles) if len(tiles) > 0 else None
+    if offsets is None:
+        if len(tiles) > 0:
+            print("WARNING: The DEM tiles under the flights do not share a projection and pixel grid, they cannot be mosaicked.")
+        else:
+            print("WARNING: The DEM tiles do not reach the flights, no mosaic was built.")
+        return None
+    first = tiles[0]
+    numberOf = {tilePath: tileNum for tileNum, tilePath in enumerate(tilePaths)}
+    parts = []
+    pixels = 0
+    for footprint, partPaths in zip(footprints, partTiles):
+        numbers = sorted(numberOf[tilePath] for tilePath in partPaths)
+        minLat, minLon, maxLat, maxLon = footprint
+        corners = np.asarray(first.latLonToTile.TransformPoints([(minLon, minLat), (minLon, maxLat), (maxLon, minLat), (maxLon, maxLat)]), dtype=np.float64)
+        colMin = math.floor((corners[:, 0].min() - first.xOrigin) / first.pixelWidth) - marginPixels
+        colMax = math.floor((corners[:, 0].max() - first.xOrigin) / first.pixelWidth) + marginPixels
+        rowMin = math.floor((first.yOrigin - corners[:, 1].max()) / first.pixelHeight) - marginPixels
+        rowMax = math.floor((first.yOrigin - corners[:, 1].min()) / first.pixelHeight) + marginPixels
+        rowMin = max(rowMin, min(offsets[tileNum][0] for tileNum in numbers))
+        colMin = max(colMin, min(offsets[tileNum][1] for tileNum in numbers))
+        rowMax = min(rowMax, max(offsets[tileNum][0]+tiles[tileNum].rows for tileNum in numbers)-1)
+        colMax = min(colMax, max(offsets[tileNum][1]+tiles[tileNum].cols for tileNum in numbers)-1)
+        if rowMax < rowMin or colMax < colMin:
+            continue
+        rows, cols = rowMax-rowMin+1, colMax-colMin+1
+        parts.append({"footprint": list(footprint), "offset": [rowMin, colMin], "shape": [rows, cols], "start": pixels, "tiles": numbers,
+            "geoTransform": [first.xOrigin+colMin*first.pixelWidth, first.pixelWidth, 0.0, first.yOrigin-rowMin*first.pixelHeight, 0.0, -first.pixelHeight]})
+        pixels += rows*cols
+    if len(parts) == 0:
+        print("WARNING: The DEM tiles do not reach the flights, no mosaic was built.")
+        return None
+
+    heightsPath, ownerPath, metaPath = MosaicPaths(basePath)
+    os.makedirs(os.path.dirname(os.path.abspath(basePath)), exist_ok=True)
+    if os.path.isfile(metaPath):
+        os.remove(metaPath)
+    heights = None
+    owner = np.lib.format.open_memmap(ownerPath+".tmp", mode='w+', dtype=np.int32, shape=(pixels,))
+    owner[:] = 0
+    for part in parts:
+        (rowMin, colMin), (rows, cols), start = part["offset"], part["shape"], part["start"]
+        partOwner = owner[start:start+rows*cols].reshape(rows, cols)
+        #Last tile first, so the tiles earlier in the list overwrite the later ones
+        for tileNum in reversed(part.pop("tiles")):
+            (rowOff, colOff), tile = offsets[tileNum], tiles[tileNum]
+            top, left = max(rowMin, rowOff), max(colMin, colOff)
+            bottom, right = min(rowMin+rows-1, rowOff+tile.rows-1), min(colMin+cols-1, colOff+tile.cols-1)
+            if bottom < top or right < left:
+                continue
+            window = tile.band.ReadAsArray(left-colOff, top-rowOff, right-left+1, bottom-top+1)
+            Count("bytesRead", window.nbytes)
+            if heights is None:
+                heights = np.lib.format.open_memmap(heightsPath+".tmp", mode='w+', dtype=window.dtype, shape=(pixels,))
+            heights[start:start+rows*cols].reshape(rows, cols)[top-rowMin:bottom-rowMin+1, left-colMin:right-colMin+1] = window
+            partOwner[top-rowMin:bottom-rowMin+1, left-colMin:right-colMin+1] = tileNum+1
+    if heights is None:
+        del owner
+        os.remove(ownerPath+".tmp")
+        print("WARNING: The DEM tiles do not reach the flights, no mosaic was built.")
+        return None
+    heights.flush()
+    owner.flush()
+    del heights, owner
+    os.replace(heightsPath+".tmp", heightsPath)
+    os.replace(ownerPath+".tmp", ownerPath)
+    meta = {
+        "version": MOSAIC_VERSION,
+        "demFiles": DataDigest(demFiles),
+        "tiles": {tilePath: FileFingerprint(tilePath) for tilePath in tilePaths},
+        "projection": first.dataset.GetProjection(),
+        "anchor": [first.xOrigin, first.yOrigin],
+        "pixelSize": [first.pixelWidth, first.pixelHeight],
+        "tileOrigins": [[tile.xOrigin, tile.yOrigin, rowOff, colOff] for (rowOff, colOff), tile in zip(offsets, tiles)],
+        "parts": parts,
+    }
+    #The description is written last: a mosaic without it is never used
+    tmpPath = metaPath+".tmp"
+    with open(tmpPath, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=4)
+    os.replace(tmpPath, metaPath)
+    print("DEM mosaic of ", len(tiles), " tile(s) in ", len(parts), " part(s), ", pixels, " pixels >> ", basePath)
+    return DemMosaic(basePath)
+
+def ReuseDemMosaic(basePath, demFiles, videoPositions):
+    """
+    The mosaic at basePath while it is still valid for the (lats, lons) positions of every video: built from the same
+    GeoTIF files (demFiles), none of its tiles changed and every position within the flights of one of its parts.
+    Only the tiles of the mosaic are looked at, the DEM folder is not indexed. Returns None otherwise.
+    """
+    metaPath = MosaicPaths(basePath)[2]
+    if not os.path.isfile(metaPath):
+        return None
+    try:
+        with open(metaPath, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get("version") != MOSAIC_VERSION or meta["demFiles"] != DataDigest(demFiles) \
+                or not all(FileFingerprint(tilePath) == fingerprint for tilePath, fingerprint in meta["tiles"].items()):
+            return None
+        footprints = [part["footprint"] for part in meta["parts"]]
+        for lats, lons in videoPositions:
+            covered = np.zeros(len(lats), dtype=bool)
+            for minLat, minLon, maxLat, maxLon in footprints:
+                covered |= (lats >= minLat) & (lons >= minLon) & (lats <= maxLat) & (lons <= maxLon)
+            if not covered.all():
+                return None
+    except (OSError, ValueError, KeyError):
+        print("WARNING: The DEM mosaic "+basePath+" could not be read. It will be built again.")
+        return None
+    print("DEM mosaic reused: ", basePath)
+    return DemMosaic(basePath)
@@ -0,0 +1,374 @@
+import argparse
+import os
+import json
+import time
+import struct
+import sqlite3
+from collections import OrderedDict
+import numpy as np
+from Columnar import FramesToColumns, BOX_VALUE_COLUMNS
+from SourceCatalog import ScanFiles
+
+EXPORT_FORMATS = ["gpkg", "parquet"]
+EXPORT_EXTENSIONS = {"gpkg": ".gpkg", "parquet": ".parquet"}
+#Rows per insert batch (GeoPackage) and per row group (GeoParquet)
+EXPORT_BATCH = 50000
+
+#GeoPackage 1.2: 'GPKG' application id and version
+GPKG_APPLICATION_ID = 0x47504B47
+GPKG_USER_VERSION = 10200
+WGS84_SRS_ID = 4326
+WGS84_WKT = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563,AUTHORITY["EPSG","7030"]],AUTHORITY["EPSG","6326"]],' \
+    'PRIMEM["Greenwich",0,AUTHORITY["EPSG","8901"]],UNIT["degree",0.0174532925199433,AUTHORITY["EPSG","9122"]],AXIS["Latitude",NORTH],AXIS["Longitude",EAST],AUTHORITY["EPSG","4326"]]'
+#Little endian WKB point, inside a GeoPackage geometry header without envelope (magic, version, flags, srs id)
+WKB_POINT = np.dtype([("order", "u1"), ("type", "<u4"), ("x", "<f8"), ("y", "<f8")])
+GPKG_POINT = np.dtype([("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("srsId", "<i4"), ("wkb", WKB_POINT)])
+
+
+def ExportPath(outputFolder, videoName, exportFormat):
+    if exportFormat not in EXPORT_EXTENSIONS:
+        raise ValueError("Unknown export format "+str(exportFormat)+". Expected one of: "+", ".join(EXPORT_FORMATS))
+    return os.path.join(outputFolder, videoName+EXPORT_EXTENSIONS[exportFormat])
+
+def BoxPoints(videoName, frames):
+    """ Point columns of the localised boxes of a video: the box values, not the telemetry of their frame """
+    frameTable, boxTable = FramesToColumns(frames)
+    if "BoxLat" not in boxTable:
+        raise ValueError("The boxes of "+videoName+" are not geolocalised, they cannot be exported as points.")
+    located = np.flatnonzero(boxTable["BoxLat"] == boxTable["BoxLat"])
+    points = OrderedDict()
+    points["Video"] = np.full(located.shape[0], videoName, dtype=object)
+    points["Frame"] = frameTable["Frame"][boxTable["FrameRow"][located]]
+    points["Class"] = boxTable["BoxClass"][located].astype(np.int64)
+    for column in BOX_VALUE_COLUMNS[1:]:
+        points[column[len("Box"):]] = boxTable[column][located]
+    points["Lat"] = boxTable["BoxLat"][located]
+    points["Lon"] = boxTable["BoxLon"][located]
+    return points
+
+def TreePoints(videoName, trees):
+    """ Point columns of the trees of a video. Tree is the number of the tree in the .json and .csv outputs """
+    points = OrderedDict()
+    points["Video"] = np.full(len(trees), videoName, dtype=object)
+    points["Tree"] = np.arange(len(trees), dtype=np.int64)
+    for column in ("Members", "FirstFrame", "LastFrame", "Class"):
+        points[column] = np.array([tree[column] for tree in trees], dtype=np.int64)
+    points["Lat"] = np.array([tree["Lat"] for tree in trees], dtype=np.float64)
+    points["Lon"] = np.array([tree["Lon"] for tree in trees], dtype=np.float64)
+    return points
+
+def _WkbPoints(lons, lats):
+    points = np.empty(lons.shape[0], dtype=WKB_POINT)
+    points["order"] = 1
+    points["type"] = 1
+    points["x"] = lons
+    points["y"] = lats
+    return points
+
+def _Blobs(records):
+    """ One bytes object per record of a structured array """
+    data = records.tobytes()
+    size = records.dtype.itemsize
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+def _SqlType(values):
+    if values.dtype.kind in "iub":
+        return "INTEGER"
+    if values.dtype.kind == "f":
+        return "DOUBLE"
+    return "TEXT"
+
+
+def WriteGeoPackage(path, layerName, points):
+    """
+    GeoPackage with one point layer (WGS84) from the columns of points (Lat and Lon are the geometry).
+    The rows are inserted in batches of EXPORT_BATCH and the R-tree spatial index (gpkg_rtree_index) is built
+    once they are all in, which is much faster than updating it row by row.
+    """
+    lats = np.asarray(points["Lat"], dtype=np.float64)
+    lons = np.asarray(points["Lon"], dtype=np.float64)
+    attributes = [column for column in points if column not in ("Lat", "Lon")]
+    geometries = np.empty(lats.shape[0], dtype=GPKG_POINT)
+    geometries["magic"] = b"GP"
+    geometries["version"] = 0
+    geometries["flags"] = 1 #little endian, no envelope
+    geometries["srsId"] = WGS84_SRS_ID
+    geometries["wkb"] = _WkbPoints(lons, lats)
+    blobs = _Blobs(geometries)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmpPath = path+".tmp"
+    if os.path.isfile(tmpPath):
+        os.remove(tmpPath)
+    connection = sqlite3.connect(tmpPath)
+    try:
+        #Written to a temporary file replaced at the end: no journal needed
+        connection.execute("PRAGMA journal_mode = OFF")
+        connection.execute("PRAGMA synchronous = OFF")
+        connection.execute("PRAGMA application_id = "+str(GPKG_APPLICATION_ID))
+        connection.execute("PRAGMA user_version = "+str(GPKG_USER_VERSION))
+        _CreateGeoPackageTables(connection)
+        columns = ", ".join('"'+column+'" '+_SqlType(np.asarray(points[column])) for column in attributes)
+        connection.execute('CREATE TABLE "'+layerName+'" (fid INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, geom POINT'+(", "+columns if columns else "")+")")
+        insert = 'INSERT INTO "'+layerName+'" (fid, geom'+"".join(', "'+column+'"' for column in attributes)+") VALUES (?, ?"+", ?"*len(attributes)+")"
+        for start in range(0, len(blobs), EXPORT_BATCH):
+            end = min(start+EXPORT_BATCH, len(blobs))
+            values = [np.asarray(points[column][start:end]).tolist() for column in attributes]
+            connection.executemany(insert, zip(range(start+1, end+1), blobs[start:end], *values))
+            connection.commit()
+        extent = (float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())) if lats.shape[0] > 0 else (None, None, None, None)
+        connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, max_x, max_y, srs_id) VALUES (?, 'features', ?, ?, ?, ?, ?, ?)",
+            (layerName, layerName)+extent+(WGS84_SRS_ID,))
+        connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'POINT', ?, 0, 0)", (layerName, WGS84_SRS_ID))
+        _CreateRTree(connection, layerName, lons, lats)
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmpPath, path)
+    return path
+
+def _CreateGeoPackageTables(connection):
+    connection.execute("CREATE TABLE gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, "
+        "organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)")
+    connection.executemany("INSERT INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, ?)", [
+        ("Undefined cartesian SRS", -1, "NONE", -1, "undefined", "undefined cartesian coordinate reference system"),
+        ("Undefined geographic SRS", 0, "NONE", 0, "undefined", "undefined geographic coordinate reference system"),
+        ("WGS 84 geodetic", WGS84_SRS_ID, "EPSG", WGS84_SRS_ID, WGS84_WKT, "longitude/latitude coordinates in decimal degrees on the WGS 84 spheroid"),
+    ])
+    connection.execute("CREATE TABLE gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, data_type TEXT NOT NULL, identifier TEXT UNIQUE, "
+        "description TEXT DEFAULT '', last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+        "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, srs_id INTEGER, "
+        "CONSTRAINT fk_gc_r_srs_id FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys(srs_id))")
+    connection.execute("CREATE TABLE gpkg_geometry_columns (table_name TEXT NOT NULL, column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, "
+        "srs_id INTEGER NOT NULL, z TINYINT NOT NULL, m TINYINT NOT NULL, CONSTRAINT pk_geom_cols PRIMARY KEY (table_name, column_name), "
+        "CONSTRAINT uk_gc_table_name UNIQUE (table_name), CONSTRAINT fk_gc_tn FOREIGN KEY (table_name) REFERENCES gpkg_contents(table_name), "
+        "CONSTRAINT fk_gc_srs FOREIGN KEY (srs_id) REFERENCES gpkg_spatial_ref_sys (srs_id))")
+    connection.execute("CREATE TABLE gpkg_extensions (table_name TEXT, column_name TEXT, extension_name TEXT NOT NULL, definition TEXT NOT NULL, "
+        "scope TEXT NOT NULL, CONSTRAINT ge_tce UNIQUE (table_name, column_name, extension_name))")
+
+def _CreateRTree(connection, layerName, lons, lats):
+    """ gpkg_rtree_index of the geom column, bulk loaded, with the triggers of the specification keeping it up to date on edits """
+    rtree = "rtree_"+layerName+"_geom"
+    table = '"'+layerName+'"'
+    connection.execute('CREATE VIRTUAL TABLE "'+rtree+'" USING rtree(id, minx, maxx, miny, maxy)')
+    #The envelope of a point is the point. Features are numbered from 1 in insertion order
+    _BulkLoadRTree(connection, rtree, np.arange(1, lats.shape[0]+1, dtype=np.int64), lons, lons, lats, lats)
+    connection.execute("INSERT INTO gpkg_extensions VALUES (?, 'geom', 'gpkg_rtree_index', 'http://www.geopackage.org/spec120/#extension_rtree', 'write-only')", (layerName,))
+    rtree = '"'+rtree+'"'
+    envelope = "NEW.fid, ST_MinX(NEW.geom), ST_MaxX(NEW.geom), ST_MinY(NEW.geom), ST_MaxY(NEW.geom)"
+    present = "(NEW.geom NOT NULL AND NOT ST_IsEmpty(NEW.geom))"
+    missing = "(NEW.geom IS NULL OR ST_IsEmpty(NEW.geom))"
+    triggers = [
+        ("insert", "AFTER INSERT ON "+table+" WHEN "+present, "INSERT OR REPLACE INTO "+rtree+" VALUES ("+envelope+");"),
+        ("update1", "AFTER UPDATE OF geom ON "+table+" WHEN OLD.fid = NEW.fid AND "+present, "INSERT OR REPLACE INTO "+rtree+" VALUES ("+envelope+");"),
+        ("update2", "AFTER UPDATE OF geom ON "+table+" WHEN OLD.fid = NEW.fid AND "+missing, "DELETE FROM "+rtree+" WHERE id = OLD.fid;"),
+        ("update3", "AFTER UPDATE ON "+table+" WHEN OLD.fid != NEW.fid AND "+present,
+            "DELETE FROM "+rtree+" WHERE id = OLD.fid; INSERT OR REPLACE INTO "+rtree+" VALUES ("+envelope+");"),
+        ("update4", "AFTER UPDATE ON "+table+" WHEN OLD.fid != NEW.fid AND "+missing, "DELETE FROM "+rtree+" WHERE id IN (OLD.fid, NEW.fid);"),
+        ("delete", "AFTER DELETE ON "+table+" WHEN OLD.geom NOT NULL", "DELETE FROM "+rtree+" WHERE id = OLD.fid;"),
+    ]
+    for name, when, action in triggers:
+        connection.execute('CREATE TRIGGER "rtree_'+layerName+'_geom_'+name+'" '+when+" BEGIN "+action+" END")
+
+#Cell of an SQLite R-tree node: rowid (or child node) and the float32 box, big endian
+RTREE_CELL = np.dtype([("id", ">i8"), ("minx", ">f4"), ("maxx", ">f4"), ("miny", ">f4"), ("maxy", ">f4")])
+
+def _Float32Down(values):
+    rounded = values.astype(np.float32)
+    return np.where(rounded > values, np.nextafter(rounded, np.float32(-np.inf)), rounded)
+
+def _Float32Up(values):
+    rounded = values.astype(np.float32)
+    return np.where(rounded < values, np.nextafter(rounded, np.float32(np.inf)), rounded)
+
+def _BulkLoadRTree(connection, rtree, ids, minx, maxx, miny, maxy):
+    """
+    Fill an empty SQLite R-tree virtual table with a Sort-Tile-Recursive packed tree, written straight to its
+    _node, _parent and _rowid tables. Inserting the rows one by one costs tens of microseconds each, and the
+    packed tree is also better balanced. Boxes are rounded outwards to float32, as the R-tree module does.
+    """
+    if ids.shape[0] == 0:
+        return
+    nodeSize = connection.execute('SELECT length(data) FROM "'+rtree+'_node" WHERE nodeno = 1').fetchone()[0]
+    capacity = (nodeSize-4)//RTREE_CELL.itemsize
+    #Entries of the level being packed, starting with the leaves
+    entries = np.empty(ids.shape[0], dtype=RTREE_CELL)
+    entries["id"] = ids
+    entries["minx"] = _Float32Down(np.asarray(minx, dtype=np.float64))
+    entries["maxx"] = _Float32Up(np.asarray(maxx, dtype=np.float64))
+    entries["miny"] = _Float32Down(np.asarray(miny, dtype=np.float64))
+    entries["maxy"] = _Float32Up(np.asarray(maxy, dtype=np.float64))
+    levels = []
+    while True:
+        nodes = -(-entries.shape[0]//capacity)
+        sliceSize = int(np.ceil(np.sqrt(nodes)))*capacity
+        centreX = (entries["minx"].astype(np.float64)+entries["maxx"])/2
+        centreY = (entries["miny"].astype(np.float64)+entries["maxy"])/2
+        xRank = np.empty(entries.shape[0], dtype=np.int64)
+        xRank[np.argsort(centreX, kind='stable')] = np.arange(entries.shape[0])
+        entries = entries[np.lexsort((centreY, xRank//sliceSize))]
+        starts = np.arange(0, entries.shape[0], capacity)
+        levels.append((entries, starts))
+        if nodes == 1:
+            break
+        #Cells of the next level point to their node of this level by its index, sorted along with them
+        parents = np.empty(nodes, dtype=RTREE_CELL)
+        parents["id"] = np.arange(nodes)
+        parents["minx"] = np.minimum.reduceat(entries["minx"], starts)
+        parents["maxx"] = np.maximum.reduceat(entries["maxx"], starts)
+        parents["miny"] = np.minimum.reduceat(entries["miny"], starts)
+        parents["maxy"] = np.maximum.reduceat(entries["maxy"], starts)
+        entries = parents
+
+    #Node numbers from the root (1) down, level by level
+    firstNode = {}
+    nextNode = 1
+    for depth in range(len(levels)-1, -1, -1):
+        firstNode[depth] = nextNode
+        nextNode += levels[depth][1].shape[0]
+    nodeRows = []
+    parentRows = []
+    rowidRows = []
+    for depth, (entries, starts) in enumerate(levels):
+        nodeNumbers = np.arange(starts.shape[0], dtype=np.int64)+firstNode[depth]
+        if depth > 0:
+            entries = entries.copy()
+            entries["id"] += firstNode[depth-1]
+            parentRows.extend(zip(entries["id"].tolist(), np.repeat(nodeNumbers, np.diff(np.append(starts, entries.shape[0]))).tolist()))
+        else:
+            #Appended in rowid order, much faster than random inserts in the B-tree
+            leaves = np.repeat(nodeNumbers, np.diff(np.append(starts, entries.shape[0])))
+            order = np.argsort(entries["id"], kind='stable')
+            rowidRows.extend(zip(entries["id"][order].tolist(), leaves[order].tolist()))
+        ends = np.append(starts[1:], entries.shape[0])
+        for nodeNo, start, end in zip(nodeNumbers.tolist(), starts.tolist(), ends.tolist()):
+            #Tree depth in the root, cell count, cells, zero padding
+            header = np.array([len(levels)-1 if nodeNo == 1 else 0, end-start], dtype=">u2").tobytes()
+            data = header+entries[start:end].tobytes()
+            nodeRows.append((nodeNo, data+bytes(nodeSize-len(data))))
+    connection.execute('DELETE FROM "'+rtree+'_node"')
+    connection.executemany('INSERT INTO "'+rtree+'_node" (nodeno, data) VALUES (?, ?)', nodeRows)
+    connection.executemany('INSERT INTO "'+rtree+'_parent" (nodeno, parentnode) VALUES (?, ?)', parentRows)
+    connection.executemany('INSERT INTO "'+rtree+'_rowid" (rowid, nodeno) VALUES (?, ?)', rowidRows)
+
+def QueryGeoPackage(path, minLat, minLon, maxLat, maxLon, layerName=None):
+    """ Rows {column: value, Lat, Lon} of the points of a GeoPackage layer inside the box, found through its R-tree """
+    connection = sqlite3.connect("file:"+path+"?mode=ro", uri=True)
+    try:
+        if layerName is None:
+            layerName = connection.execute("SELECT table_name FROM gpkg_geometry_columns").fetchone()[0]
+        cursor = connection.execute('SELECT t.* FROM "'+layerName+'" t JOIN "rtree_'+layerName+'_geom" r ON t.fid = r.id '
+            "WHERE r.minx <= ? AND r.maxx >= ? AND r.miny <= ? AND r.maxy >= ?", (maxLon, minLon, maxLat, minLat))
+        columns = [description[0] for description in cursor.description]
+        rows = []
+        for values in cursor:
+            row = dict(zip(columns, values))
+            #WKB point after the 8 bytes of the GeoPackage header: byte order, type, x, y
+            row["Lon"], row["Lat"] = struct.unpack_from("<dd", row.pop("geom"), 8+5)
+            #The R-tree holds float32 envelopes rounded outwards, a superset of the box
+            if minLat <= row["Lat"] <= maxLat and minLon <= row["Lon"] <= maxLon:
+                rows.append(row)
+        return rows
+    finally:
+        connection.close()
+
+
+def WriteGeoParquet(path, points):
+    """
+    GeoParquet 1.1 file of the points (WKB geometry in OGC:CRS84, plus a bbox covering column). Rows are sorted along
+    a Z-order curve and written in row groups of EXPORT_BATCH, so readers skip the row groups outside a queried box.
+    Needs pyarrow.
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("The GeoParquet export needs pyarrow (pip install pyarrow). The GeoPackage export has no extra dependency.")
+    lats = np.asarray(points["Lat"], dtype=np.float64)
+    lons = np.asarray(points["Lon"], dtype=np.float64)
+    order = np.argsort(_ZOrder(lons, lats), kind='stable')
+    lats = lats[order]
+    lons = lons[order]
+    arrays = OrderedDict()
+    for column in points:
+        if column in ("Lat", "Lon"):
+            continue
+        values = np.asarray(points[column])[order]
+        arrays[column] = pyarrow.array(values.tolist() if values.dtype == object else values)
+    arrays["bbox"] = pyarrow.StructArray.from_arrays([pyarrow.array(lons), pyarrow.array(lats), pyarrow.array(lons), pyarrow.array(lats)],
+        names=["xmin", "ymin", "xmax", "ymax"])
+    arrays["geometry"] = pyarrow.array(_Blobs(_WkbPoints(lons, lats)), type=pyarrow.binary())
+    geo = {"version": "1.1.0", "primary_column": "geometry", "columns": {"geometry": {
+        "encoding": "WKB",
+        "geometry_types": ["Point"],
+        "bbox": [float(lons.min()), float(lats.min()), float(lons.max()), float(lats.max())] if lats.shape[0] > 0 else [],
+        "covering": {"bbox": {"xmin": ["bbox", "xmin"], "ymin": ["bbox", "ymin"], "xmax": ["bbox", "xmax"], "ymax": ["bbox", "ymax"]}},
+    }}}
+    table = pyarrow.table(arrays).replace_schema_metadata({"geo": json.dumps(geo)})
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmpPath = path+".tmp"
+    pyarrow.parquet.write_table(table, tmpPath, row_group_size=EXPORT_BATCH, compression="zstd", write_statistics=True)
+    os.replace(tmpPath, path)
+    return path
+
+def _ZOrder(lons, lats, bits=16):
+    """ Morton code of every point on a 2^bits grid over the extent of the points """
+    if lons.shape[0] == 0:
+        return np.zeros(0, dtype=np.uint64)
+    def Quantise(values):
+        span = values.max()-values.min()
+        scaled = (values-values.min())/span if span > 0 else np.zeros_like(values)
+        return np.minimum((scaled*(1 << bits)).astype(np.uint64), (1 << bits)-1)
+    x = Quantise(lons)
+    y = Quantise(lats)
+    code = np.zeros(lons.shape[0], dtype=np.uint64)
+    for bit in range(bits):
+        code |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit)
+        code |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2*bit+1)
+    return code
+
+
+def ExportPoints(outputFolder, videoName, layerName, points, exportFormat):
+    """ Write the points of a video to <outputFolder>/<videoName>.gpkg or .parquet. Returns the path """
+    path = ExportPath(outputFolder, videoName, exportFormat)
+    if exportFormat == "gpkg":
+        return WriteGeoPackage(path, layerName, points)
+    return WriteGeoParquet(path, points)
+
+def ExportBoxes(outputFolder, videoName, frames, exportFormats):
+    """ Localised boxes of a video as a "boxes" point layer in every export format """
+    if len(exportFormats) == 0:
+        return
+    points = BoxPoints(videoName, frames)
+    for exportFormat in exportFormats:
+        print("\t Export >> ", ExportPoints(outputFolder, videoName, "boxes", points, exportFormat))
+
+def ExportTrees(outputFolder, videoName, trees, exportFormats):
+    """ Trees of a video as a "trees" point layer in every export format """
+    if len(exportFormats) == 0:
+        return
+    points = TreePoints(videoName, trees)
+    for exportFormat in exportFormats:
+        print("\t Export >> ", ExportPoints(outputFolder, videoName, "trees", points, exportFormat))
+
+
+def QueryCampaign(folder, minLat, minLon, maxLat, maxLon):
+    """ Points inside the box of every GeoPackage under folder (the videos of a campaign), with their file """
+    rows = []
+    for path in sorted(ScanFiles(folder, ".gpkg")):
+        for row in QueryGeoPackage(path, minLat, minLon, maxLat, maxLon):
+            row["File"] = path
+            rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--folder', type=str, required=True, help='Folder with the exported .gpkg files of a campaign (the outputFolder of GeoLocaliseBoxes or Clustering)')
+    parser.add_argument('--box', type=float, nargs=4, required=True, metavar=('MIN_LAT', 'MIN_LON', 'MAX_LAT', 'MAX_LON'), help='Bounding box of the query in degrees')
+    args = parser.parse_args()
+    start = time.perf_counter()
+    rows = QueryCampaign(args.folder, *args.box)
+    print(len(rows), " point(s) found in ", round((time.perf_counter()-start)*1000.0, 2), " ms")
+    for row in rows[:20]:
+        print("\t", row)
@@ -1,231 +1,251 @@
-import argparse
-import os
-import json
-import csv
-import math
-import numpy as np
-#from subprocess import REALTIME_PRIORITY_CLASS
-import geopy.distance
-
-
-
-def getListOfFiles(dirName):
-    print("Scanning in "+dirName)
-    # create a list of file and sub directories 
-    # names in the given directory 
-    listOfFile = os.listdir(dirName)
-    allFiles = list()
-    # Iterate over all the entries
-    for entry in listOfFile:
-        # Create full path
-        fullPath = os.path.join(dirName, entry)
-        # If entry is a directory then get the list of files in this directory 
-        if os.path.isdir(fullPath):
-            allFiles = allFiles + getListOfFiles(fullPath)
-        else:
-            allFiles.append(fullPath)
-                
-    return allFiles
-
-def filteredListOfFiles(dirName, filter):
-    fullFileList = getListOfFiles(dirName)
-    resultingList = []
-    for file in fullFileList:
-        if file.endswith(filter):
-            resultingList.append(file)
-    return resultingList
-
-def ReadConfigFile(filePath):
-    print("Opening camera configuration file in:",filePath)
-    with open(filePath, 'r') as f:
-        lines = f.readlines()
-    
-    loadedData = {}
-    for line in lines:
-        splittedLine = [item.strip() for item in line.split("=")]
-        key_ = splittedLine[0]
-        if(key_ == "width" or key_=="height"):
-            val_ = int(splittedLine[1])
-        elif (key_=="dfov"):
-            val_ = float(splittedLine[1])
-        else:
-            raise ValueError("The key "+key_+" in file "+filePath+"is not a recognised argument. Expected width, height or dfov. I.e: width=3600")
-        loadedData[key_] = val_
-    return loadedData
-
-def GetCartesianBaseValues(width, height, dfov):
-    Cx = width/2 #Position of the centre pixel horizontally
-    Cy = height/2 #Position of the centre pixel vertically
-    H = ((width**2)+(height**2))**(0.5) #length in pixels of the diagonal
-    pd = dfov/H #degrees per pixel
-    #print("width [",width,"] height [",height,"] dfov [",dfov,"] -> Cx [",Cx,"] Cy [",Cy,"] pd [",pd,"]")
-    return pd, Cx, Cy
-
-def GetAngle(x, y, pd):
-    angle = (((x**2)+(y**2))**0.5)*pd
-    #print("X[",x,"], Y[",y,"], angle [",angle,"]")
-    return angle
-
-def TransformToMetres(x, y, degrees, height):
-    distanceMts = height*math.tan(math.radians(degrees)) # distance in metres away from the centre of the image
-    
-    #print("distancePx [",distancePx,"], heightToTreeLevel[",height,"], distanceMts [",distanceMts,"] Xm [",Xm,"] Ym [",Ym,"] ")
-    return distanceMts
-
-def CalculateCoordinate(originLat, originLon, direction, distanceMetres):
-    pointCoord = geopy.distance.distance(kilometers=(distanceMetres/1000.0)).destination((originLat, originLon), bearing=direction)
-    #print("originLat[", originLat,"], originLon[", originLon,"], GimYaw[", GimYaw,"], distanceMetres[", distanceMetres,"] --> finalLatitude[", pointCoord.latitude,"], finalLongitude[", pointCoord.longitude,"]")
-    return pointCoord.latitude, pointCoord.longitude
-
-
-def GetDirectionAngle(x, y, baseDirection):
-    #calculate degrees to positive Y axis
-    deg_a = math.degrees(np.arctan2(y, x))
-    if deg_a > -90:
-        deg_a = deg_a-90
-    elif deg_a <= -90:
-        deg_a = deg_a+270
-
-    #Translate to degrees to North
-    degToNorth = baseDirection-deg_a
-    # print(f_deg)
-    if degToNorth > 180:
-        degToNorth = 180-degToNorth
-    elif degToNorth <= -180:
-        degToNorth = 180+degToNorth
-    return degToNorth
-
-'''
-    def CalculateCoordinate(Xm, Ym, GimYaw):
-    degreesToRotate = 0.0
-    if GimYaw >= 0:
-        degreesToRotate = math.radians(GimYaw)
-    else:
-        degreesToRotate = math.radians(360.0-GimYaw)
-
-    deg1 = math.cos(degreesToRotate)
-    deg2 = math.sin(degreesToRotate)
-    Xm2 =  deg1 * (Xm) - deg2 * (Ym)
-    Ym2 = deg2 * (Xm) + deg1 * (Ym)
-
-    return Xm2, Ym2'''
-
-'''
-def TranslateToCoordinates(X, Y, OriginLat, OriginLon):
-    # Define starting point.
-    origin = geopy.Point(48.853, 2.349)
-
-    # Define a general distance object, initialized with a distance of 1 km.
-    d = geopy.distance.VincentyDistance(kilometers = 1)
-
-    # Use the `destination` method with a bearing of 0 degrees (which is north)
-    # in order to go from point `start` 1 km to north.
-    print d.destination(point=origin, bearing=0)
-    '''
-
-def GeoLocaliseBoxes():
-    framesFolder, camParams, outputFolder = \
-        args.framesFolder, args.camParams, args.outputFolder
-    print("Loading frames data")    
-    jsonFiles = filteredListOfFiles(framesFolder, ".json")
-    videosList = {}
-    for jsonFile in jsonFiles:
-        videoName = os.path.splitext(os.path.basename(jsonFile))[0]
-
-        f = open(jsonFile)        
-        jsonData = json.load(f)
-        videoCamParams = ReadConfigFile(os.path.join(camParams, videoName+".txt"))
-        videosList[videoName] = [jsonData, videoCamParams]
-    
-    print("Loaded ", len(videosList), " .json files")
-
-    for videoName, videoData in videosList.items():
-        cameraParams = videoData[1]
-        width = cameraParams["width"]
-        height = cameraParams["height"]
-        dfov = cameraParams["dfov"]
-        pd, Cx, Cy = GetCartesianBaseValues(width, height, dfov)
-        #Iterate per frame
-        frames = videoData[0]
-        frameIndex = 0
-        totalFrames = len(frames)
-        for frameName, frameData in frames.items():
-            frameIndex+=1
-            boundingBoxesList = frameData[0]
-            if(len(boundingBoxesList) == 0):
-                continue #skip if the frame has no data
-            if(len(frameData[1]) <= 1):
-                boxes = []
-                for box in boundingBoxesList:
-                    boxes.append([box, []])
-                videosList[videoName][0][frameName][0] = boxes
-                continue #skip if the frame has no data
-            #print("Frame Data:",frameData[1])
-            distanceToTopOfTrees = frameData[1]["Alt"]-frameData[1]["Height"]
-            #Iterate per bounding box
-            boxes = []
-            for box in boundingBoxesList:
-                #print(">>>> Calculating Frame [",frameName,"] BB:",box)
-                Xv = box[1]*width #x position of the bounding box in image coordinates
-                Yu = box[2]*height #y position of the bounding box in image coordinates
-                x = Xv-Cx # x position with respect to the image centre in pixels
-                y = Cy-Yu # y position with respect to the image centre in pixels
-                #print("Xv[", Xv,"], Yu[", Yu,"], x[", x,"], y[", y,"], Cx[", Cx,"], Cy[", Cy,"]")
-                degreesToPoint = GetAngle(x, y, pd) # angle between the centre pixel and the bounding box pixel
-                directionDegrees = GetDirectionAngle(x, y, frameData[1]["GimYaw"])
-                Hm = TransformToMetres(x, y, degreesToPoint, distanceToTopOfTrees) # transform the pixel coordinates to metres coordinates
-                boxLat, boxLon = CalculateCoordinate(frameData[1]["Lat"], frameData[1]["Lon"], directionDegrees, Hm)
-                #----Xm2, Ym2 = CalculateCoordinate(Xm, Ym, frameData[1]["GimYaw"])
-                #----boxLat, boxLon = TranslateToCoordinates(Xm2, Ym2, frameData[1]["Lat"], frameData[1]["Lon"])
-                boxes.append([box, [boxLat, boxLon]])
-            videosList[videoName][0][frameName][0] = boxes
-            #if(frameIndex > 150):
-                #break
-            if(int(frameIndex)%100==0 or frameIndex == totalFrames):
-                print("[",round((frameIndex/totalFrames*100), 1),"%]Frame ", frameName, " of ",  totalFrames)
-
-
-
-        #Save the results
-        print("\nWriting results:")
-        os.makedirs(outputFolder, exist_ok=True)
-        finalPathJson = os.path.join(outputFolder,videoName+ ".json")
-        finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
-        with open(finalPathJson, 'w', encoding='utf-8') as f:
-            json.dump(videoData[0], f, ensure_ascii=False, indent=4)
-        print("\t (1/2) Json >> ", finalPathJson)
-
-
-        line_header = ['Frame', 'Lat', 'Lon', 'Alt', 'Elevation',  'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'Timestamp', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', 'BoundingBox_Lat', 'BoundingBox_Lon']
-        lines_content = []
-        #{FrameNum:[[Labels],{sensor:sensorData}]}
-        for frame_key, frame_value in videoData[0].items():
-            droneData = []
-            if(len(frame_value[1]) > 1):
-                droneData = \
-                    [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"], frame_value[1]["Height"], \
-                    frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
-                    frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"], frame_value[1]["Timestamp"]]
-            else:
-                droneData = ['', '', '', '', '', '', '', '', '', '', '']
-
-            for label_tmp in frame_value[0]:
-                #print("frame:",frame_key, "label[0]:",label_tmp[0],"label[1]:",label_tmp[1])
-                lines_content.append([frame_key] + droneData + label_tmp[0]+label_tmp[1])
-        with open(finalPathCsv, mode='w') as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-            csv_writer.writerow(line_header)
-            csv_writer.writerows(lines_content)  
-        print("\t (2/2) Json >> ", finalPathCsv)  
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--framesFolder', type=str,required=True, default='/content/output/localisation_drone/', help='Folder containing the .json and .csv files')
-parser.add_argument('--camParams', required=True, type=str, default='/content/input/camParams/', help='Input folder containing all the videos camera parameter files')
-parser.add_argument('--outputFolder', type=str, default='/content/output/localisation_boxes/', help='Output folder for the localisation algorithm')
-args = parser.parse_args()
-print(args)
-GeoLocaliseBoxes()
-
-
-
+import argparse
+import os
+import csv
+import numpy as np
+from collections import OrderedDict
+#from subprocess import REALTIME_PRIORITY_CLASS
+import geopy.distance
+from Geodesy import GetProjectionEngine, PROJECTION_ENGINES
+from CameraModel import LoadCameraModel
+from SourceCatalog import FindCameraParams
+from StageIO import LoadVideosFromFolder, LoadVideo, ListVideoInputs, WriteJsonIncremental
+from Columnar import OUTPUT_FORMATS, BOX_COORDINATE_COLUMNS, WritesJson, WritesColumnar, WriteFramesColumnar, IsColumnar, ReadMeta, ReadTable, ExtendColumnar
+from GeoExport import EXPORT_FORMATS, ExportBoxes
+from Manifest import RunIncremental, InputKey, FileFingerprint, FileDigest, DataDigest
+from Metrics import Count, Phase, DefaultMetricsPath, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, Span
+
+
+def CalculateCoordinate(originLat, originLon, direction, distanceMetres):
+    pointCoord = geopy.distance.distance(kilometers=(distanceMetres/1000.0)).destination((originLat, originLon), bearing=direction)
+    #print("originLat[", originLat,"], originLon[", originLon,"], GimYaw[", GimYaw,"], distanceMetres[", distanceMetres,"] --> finalLatitude[", pointCoord.latitude,"], finalLongitude[", pointCoord.longitude,"]")
+    return pointCoord.latitude, pointCoord.longitude
+
+
+'''
+    def CalculateCoordinate(Xm, Ym, GimYaw):
+    degreesToRotate = 0.0
+    if GimYaw >= 0:
+        degreesToRotate = math.radians(GimYaw)
+    else:
+        degreesToRotate = math.radians(360.0-GimYaw)
+
+    deg1 = math.cos(degreesToRotate)
+    deg2 = math.sin(degreesToRotate)
+    Xm2 =  deg1 * (Xm) - deg2 * (Ym)
+    Ym2 = deg2 * (Xm) + deg1 * (Ym)
+
+    return Xm2, Ym2'''
+
+'''
+def TranslateToCoordinates(X, Y, OriginLat, OriginLon):
+    # Define starting point.
+    origin = geopy.Point(48.853, 2.349)
+
+    # Define a general distance object, initialized with a distance of 1 km.
+    d = geopy.distance.VincentyDistance(kilometers = 1)
+
+    # Use the `destination` method with a bearing of 0 degrees (which is north)
+    # in order to go from point `start` 1 km to north.
+    print d.destination(point=origin, bearing=0)
+    '''
+
+def ProjectBoxes(frames, cameraModel, projectionEngine):
+    """
+    Replace every bounding box of frames by [box, [lat, lon]] ([box, []] when the frame has no sensor data).
+    Returns the number of frames and boxes located, and of frames and boxes without sensor data.
+    """
+    #Frames with bounding boxes and sensor data are projected all at once
+    locatedFrames = []
+    boxCounts = []
+    boxRows = []
+    framesWithoutSensor = 0
+    boxesWithoutSensor = 0
+    for frameName, frameData in frames.items():
+        boundingBoxesList = frameData[0]
+        if(len(boundingBoxesList) == 0):
+            continue #skip if the frame has no data
+        if(len(frameData[1]) <= 1):
+            frameData[0] = [[box, []] for box in boundingBoxesList]
+            framesWithoutSensor += 1
+            boxesWithoutSensor += len(boundingBoxesList)
+            continue #skip if the frame has no data
+        locatedFrames.append(frameName)
+        boxCounts.append(len(boundingBoxesList))
+        boxRows.extend(boundingBoxesList)
+
+    if(len(locatedFrames) > 0):
+        sensorData = [frames[frameName][1] for frameName in locatedFrames]
+        counts = np.array(boxCounts)
+        boxArray = np.array(boxRows, dtype=np.float64)
+        gimYaw = np.repeat([sensor["GimYaw"] for sensor in sensorData], counts)
+        distanceToTopOfTrees = np.repeat([sensor["Alt"]-sensor["Height"] for sensor in sensorData], counts)
+        originLats = np.repeat([sensor["Lat"] for sensor in sensorData], counts)
+        originLons = np.repeat([sensor["Lon"] for sensor in sensorData], counts)
+        directions, distances = cameraModel.BearingsAndDistances(boxArray[:, 1], boxArray[:, 2], gimYaw, distanceToTopOfTrees)
+        boxLats, boxLons = projectionEngine(originLats, originLons, directions, distances)
+        coordinates = np.column_stack([boxLats, boxLons]).tolist()
+        offset = 0
+        for frameName, count in zip(locatedFrames, boxCounts):
+            frames[frameName][0] = [[box, coordinate] for box, coordinate in zip(frames[frameName][0], coordinates[offset:offset+count])]
+            offset += count
+    return len(locatedFrames), len(boxRows), framesWithoutSensor, boxesWithoutSensor
+
+def GeoLocaliseBoxesVideo(videoName, frames, cameraModel, projectionEngine):
+    """ Replace every bounding box of a video by [box, [lat, lon]] ([box, []] when the frame has no sensor data) """
+    locatedFrames, boxesLocated, framesWithoutSensor, boxesWithoutSensor = ProjectBoxes(frames, cameraModel, projectionEngine)
+    print("Video ", videoName, ": ", boxesLocated, " bounding boxes projected in ", locatedFrames, " of ", len(frames), " frames")
+    Count("GeoLocaliseBoxes.frames", len(frames))
+    Count("GeoLocaliseBoxes.boxes", boxesLocated+boxesWithoutSensor)
+    Count("GeoLocaliseBoxes.boxesLocated", boxesLocated)
+    Count("GeoLocaliseBoxes.framesWithoutTelemetry", framesWithoutSensor)
+    return frames
+
+def GeoLocaliseBoxesColumns(videoName, path, cameraModel, projectionEngine):
+    """
+    GeoLocaliseBoxesVideo() of a columnar video reading only the drone position and the centre of the boxes.
+    Returns the additions to its tables for ExtendColumnar(): the BoxLat and BoxLon columns (NaN without sensor data)
+    """
+    meta = ReadMeta(path)
+    frameCount = len(ReadTable(path, "frames", ["Frame"], meta)["Frame"])
+    boxTable = ReadTable(path, "boxes", ["FrameRow", "BoxCentreX", "BoxCentreY"], meta)
+    frameRows = np.asarray(boxTable["FrameRow"])
+    boxLats = np.full(len(frameRows), np.nan)
+    boxLons = np.full(len(frameRows), np.nan)
+    boxesLocated = np.zeros(len(frameRows), dtype=bool)
+    if "Lat" in meta["tables"]["frames"]:
+        sensor = ReadTable(path, "frames", ["Lat", "Lon", "Alt", "Height", "GimYaw"], meta)
+        lats = np.asarray(sensor["Lat"])
+        boxesLocated = (lats == lats)[frameRows] #NaN without sensor data
+        rows = frameRows[boxesLocated]
+    if boxesLocated.any():
+        distanceToTopOfTrees = np.asarray(sensor["Alt"])[rows]-np.asarray(sensor["Height"])[rows]
+        directions, distances = cameraModel.BearingsAndDistances(np.asarray(boxTable["BoxCentreX"], dtype=np.float64)[boxesLocated],
+            np.asarray(boxTable["BoxCentreY"], dtype=np.float64)[boxesLocated], np.asarray(sensor["GimYaw"])[rows], distanceToTopOfTrees)
+        boxLats[boxesLocated], boxLons[boxesLocated] = projectionEngine(lats[rows], np.asarray(sensor["Lon"])[rows], directions, distances)
+    locatedFrames = len(np.unique(frameRows[boxesLocated]))
+    framesWithoutSensor = len(np.unique(frameRows[~boxesLocated]))
+    print("Video ", videoName, ": ", int(boxesLocated.sum()), " bounding boxes projected in ", locatedFrames, " of ", frameCount, " frames")
+    Count("GeoLocaliseBoxes.frames", frameCount)
+    Count("GeoLocaliseBoxes.boxes", len(frameRows))
+    Count("GeoLocaliseBoxes.boxesLocated", int(boxesLocated.sum()))
+    Count("GeoLocaliseBoxes.framesWithoutTelemetry", framesWithoutSensor)
+    if len(frameRows) == 0:
+        return {}
+    return {"boxes": OrderedDict(zip(BOX_COORDINATE_COLUMNS, (boxLats, boxLons)))}
+
+BOXES_CSV_HEADER = ['Frame', 'Lat', 'Lon', 'Alt', 'Elevation',  'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'Timestamp', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', 'BoundingBox_Lat', 'BoundingBox_Lon']
+
+def BoxesCsvRows(frame_key, frame_value):
+    """ .csv rows of a localised frame, one per bounding box """
+    droneData = []
+    if(len(frame_value[1]) > 1):
+        droneData = \
+            [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"], frame_value[1]["Height"], \
+            frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
+            frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"], frame_value[1]["Timestamp"]]
+    else:
+        droneData = ['', '', '', '', '', '', '', '', '', '', '']
+    return [[frame_key] + droneData + label_tmp[0]+label_tmp[1] for label_tmp in frame_value[0]]
+
+def WriteBoxesLocalised(outputFolder, videoName, frames, outputFormat='json', exportFormats=()):
+    #GIS layers (GeoPackage / GeoParquet) next to the results
+    ExportBoxes(outputFolder, videoName, frames, exportFormats)
+    if WritesColumnar(outputFormat):
+        print("\t Columnar >> ", WriteFramesColumnar(outputFolder, videoName, frames))
+    if not WritesJson(outputFormat):
+        return
+    #Save the results
+    print("\nWriting results:")
+    os.makedirs(outputFolder, exist_ok=True)
+    finalPathJson = os.path.join(outputFolder,videoName+ ".json")
+    finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
+    WriteJsonIncremental(finalPathJson, frames.items())
+    print("\t (1/2) Json >> ", finalPathJson)
+
+
+    with open(finalPathCsv, mode='w') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        csv_writer.writerow(BOXES_CSV_HEADER)
+        #{FrameNum:[[Labels],{sensor:sensorData}]}
+        for frame_key, frame_value in frames.items():
+            csv_writer.writerows(BoxesCsvRows(frame_key, frame_value))
+    print("\t (2/2) Json >> ", finalPathCsv)
+
+def _GeoLocaliseBoxesJob(context, videoName, frames, cameraFile, projection, cameraLut, outputFolder, outputFormat, stream, exportFormats=()):
+    #A columnar video written back as columnar only is never turned into frames: only the columns projected are read
+    columns = stream and outputFolder is not None and outputFormat == 'columnar' and len(exportFormats) == 0 and IsColumnar(frames)
+    if stream and not columns:
+        frames = LoadVideo(frames) #read in the process that localises it
+    cameraModel = LoadCameraModel(cameraFile, useLut=cameraLut)
+    with Span("box projection"):
+        if columns:
+            additions = GeoLocaliseBoxesColumns(videoName, frames, cameraModel, GetProjectionEngine(projection))
+        else:
+            GeoLocaliseBoxesVideo(videoName, frames, cameraModel, GetProjectionEngine(projection))
+    if outputFolder is not None:
+        with Span("output writing"):
+            if columns:
+                print("\t Columnar >> ", ExtendColumnar(frames, outputFolder, videoName, additions))
+            else:
+                WriteBoxesLocalised(outputFolder, videoName, frames, outputFormat, exportFormats)
+    return None if stream else frames
+
+def GeoLocaliseBoxes(videosList, camParams, outputFolder=None, projection='geopy', cameraLut=False, outputFormat='json', workers=1, force=False, stream=False,
+                     exportFormats=()):
+    """
+    Geolocalise the bounding boxes of every video. Results are written to outputFolder when given.
+    With workers > 1 the videos are localised on a pool of processes.
+    Videos whose frames and camera parameters did not change since they were written to outputFolder are read back instead, unless force.
+    With stream, videosList is {videoName: inputPath} (ListVideoInputs) and every video is read, localised and written
+    before the next one: a single video is in memory at a time and nothing is returned. Columnar inputs written back
+    as columnar only (no exportFormats) are not read as frames: only the position columns and box centres are read.
+    exportFormats ("gpkg", "parquet") also writes the boxes of every video as a spatially indexed point layer to outputFolder.
+    """
+    with Phase("GeoLocaliseBoxes"), ProfileStage("GeoLocaliseBoxes"):
+        return _GeoLocaliseBoxes(videosList, camParams, outputFolder, projection, cameraLut, outputFormat, workers, force, stream, exportFormats)
+
+def _GeoLocaliseBoxes(videosList, camParams, outputFolder, projection, cameraLut, outputFormat, workers, force, stream, exportFormats):
+    GetProjectionEngine(projection) #fail on an unknown engine before starting the workers
+    #<videoName>.txt anywhere under camParams, the missing ones fail when their video is processed
+    cameraFiles = FindCameraParams(camParams)
+    for videoName in videosList:
+        cameraFiles.setdefault(videoName, os.path.join(camParams, videoName+".txt"))
+    jobs = [(videoName, (videoName, frames, cameraFiles[videoName], projection, cameraLut, outputFolder, outputFormat, stream, exportFormats)) for videoName, frames in videosList.items()]
+    extra = ("export",)+tuple(exportFormats) if exportFormats else ()
+    def KeyOf(videoName):
+        if stream:
+            #Keyed on its file: the video is only read by its job
+            path = videosList[videoName]
+            return InputKey("GeoLocaliseBoxes", path, FileFingerprint(path), FileDigest(cameraFiles[videoName]), projection, cameraLut, outputFormat, *extra)
+        return InputKey("GeoLocaliseBoxes", DataDigest(videosList[videoName]), FileDigest(cameraFiles[videoName]), projection, cameraLut, outputFormat, *extra)
+    localised = RunIncremental("GeoLocaliseBoxes", _GeoLocaliseBoxesJob, jobs, KeyOf, outputFolder, outputFormat, None if stream else LoadVideo, workers, force=force)
+    return None if stream else dict(localised)
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--framesFolder', type=str,required=True, default='/content/output/localisation_drone/', help='Folder containing the .json and .csv files')
+    parser.add_argument('--camParams', required=True, type=str, default='/content/input/camParams/', help='Input folder containing all the videos camera parameter files')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/localisation_boxes/', help='Output folder for the localisation algorithm')
+    parser.add_argument('--projection', type=str, default='geopy', choices=list(PROJECTION_ENGINES), help='Engine used to project the bounding boxes from the drone position: geopy (reference), vincenty (vectorised geodesic) or enu (local tangent plane)')
+    parser.add_argument('--cameraLut', action='store_true', help='Use cached per-resolution lookup tables for the angle of every pixel to the image centre')
+    parser.add_argument('--outputFormat', type=str, default='json', choices=OUTPUT_FORMATS, help='Format of the results: json (.json and .csv), columnar (memory-mappable .npy columns) or both')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes working on different videos at the same time')
+    parser.add_argument('--force', action='store_true', help='Process every video again, even the ones whose inputs did not change since the last run')
+    parser.add_argument('--stream', action='store_true', help='Keep a single video in memory at a time (per process): each video is read, processed and written before the next one')
+    parser.add_argument('--export', type=str, action='append', default=[], choices=EXPORT_FORMATS, help='Also write the localised boxes of every video as a point layer with a spatial index for GIS tools: gpkg (GeoPackage with an R-tree) or parquet (GeoParquet, needs pyarrow). Can be repeated')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: <outputFolder>.metrics.json)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the stage and of every video are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    videosList = ListVideoInputs(args.framesFolder) if args.stream else LoadVideosFromFolder(args.framesFolder)
+    GeoLocaliseBoxes(videosList, args.camParams, args.outputFolder, args.projection, args.cameraLut, args.outputFormat, args.workers, args.force, args.stream,
+                     args.export)
+    WriteRunMetrics(args.metrics or DefaultMetricsPath(args.outputFolder), "GeoLocaliseBoxes", args)
@@ -1,210 +1,307 @@
-import argparse
-import os
-from osgeo import gdal,osr
-import json
-import csv
-
-#DEBUG
-import matplotlib.pyplot as plt
-
-
-
-def getListOfFiles(dirName):
-    print("Scanning in "+dirName)
-    # create a list of file and sub directories 
-    # names in the given directory 
-    listOfFile = os.listdir(dirName)
-    allFiles = list()
-    # Iterate over all the entries
-    for entry in listOfFile:
-        # Create full path
-        fullPath = os.path.join(dirName, entry)
-        # If entry is a directory then get the list of files in this directory 
-        if os.path.isdir(fullPath):
-            allFiles = allFiles + getListOfFiles(fullPath)
-        else:
-            allFiles.append(fullPath)
-                
-    return allFiles
-
-def filteredListOfFiles(dirName, filter):
-    fullFileList = getListOfFiles(dirName)
-    resultingList = []
-    for file in fullFileList:
-        if file.endswith(filter):
-            resultingList.append(file)
-    return resultingList
-
-def GetExtent(ds):
-    """ Return list of corner coordinates from a gdal Dataset """
-    xmin, xpixel, _, ymax, _, ypixel = ds.GetGeoTransform()
-    width, height = ds.RasterXSize, ds.RasterYSize
-    xmax = xmin + width * xpixel
-    ymin = ymax + height * ypixel
-
-    return (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)
-
-def ReprojectCoords(coords,src_srs,tgt_srs):
-    """ Reproject a list of x,y coordinates. """
-    trans_coords=[]
-    transform = osr.CoordinateTransformation( src_srs, tgt_srs)
-    for x,y in coords:
-        x,y,z = transform.TransformPoint(x,y)
-        trans_coords.append([x,y])
-    return trans_coords
-
-def GetAltitudeFromLatLon(lat_, lon_, indataset):
-    #indataset = gdal.Open( infile)
-    srs = osr.SpatialReference()
-    srs.ImportFromWkt(indataset.GetProjection())
-
-    srsLatLong = srs.CloneGeogCS()
-    ct = osr.CoordinateTransformation(srsLatLong, srs)
-    (X, Y, height) = ct.TransformPoint(lon_, lat_)
-
-    # Report results
-    #print('longitude: %f\t\tlatitude: %f' % (lon_, lat_))
-    #print('X: %f\t\tY: %f' % (X, Y))
-    #VALUE OF COORDINATE IN METRES
-    #print(X ,Y)
-
-    #driver = gdal.GetDriverByName('GTiff')
-    band = indataset.GetRasterBand(1)
-
-    cols = indataset.RasterXSize
-    rows = indataset.RasterYSize
-
-    transform = indataset.GetGeoTransform()
-
-    xOrigin = transform[0]
-    yOrigin = transform[3]
-    pixelWidth = transform[1]
-    pixelHeight = -transform[5]
-    data = band.ReadAsArray(0, 0, cols, rows)
-
-    col = int((X - xOrigin) / pixelWidth )
-    row = int((yOrigin - Y ) / pixelHeight)
-    #ROW AND COLUMN VALUE
-    #print("R,C: ",row,col)
-    #Data AT THAT ROW COLUMN
-    return data[row][col]
-    
-def GetRasterCorners(ds):
-    ext=GetExtent(ds)
-    src_srs=osr.SpatialReference()
-    src_srs.ImportFromWkt(ds.GetProjection())
-    tgt_srs = src_srs.CloneGeogCS()
-    geo_ext=ReprojectCoords(ext, src_srs, tgt_srs)
-    return geo_ext
-
-def GetRelevantTifFile(lat_, lon_, tileList):
-    X = lon_
-    Y = lat_
-    for tile in tileList:
-        P2 = tile[1]
-        P3 = tile[2]
-        P4 = tile[3]
-        if(P3[0] > X >= P4[0]):
-            if(P2[1] > Y >= P3[1]):
-                #print("GetRelevantTifFile >> Tile found! ", tile[4])
-                return tile[4]
-
-
-def GeoLocaliseDrone():
-    framesFolder, demFolder, outputFolder = \
-        args.framesFolder, args.demFolder, args.outputFolder
-    print("Loading frames data")    
-    jsonFiles = filteredListOfFiles(framesFolder, ".json")
-    videosList = {}
-    for jsonFile in jsonFiles:
-        videoName = os.path.splitext(os.path.basename(jsonFile))[0]
-        videoFramesData = {}
-        f = open(jsonFile)
-        videosList[videoName] = json.load(f)
-    
-    print("Loaded ", len(videosList), " .json files")
-
-    print("Loading .tif files")
-    tifFiles = filteredListOfFiles(demFolder, ".tif")
-    print("GeoTif files found: ",len(tifFiles))
-
-    tileList = []
-    indexTile = 1
-    numTiles = len(tifFiles)
-    for tile in tifFiles:
-        print("(", indexTile, " of ", numTiles, ")Opening: ", tile)
-        raster = gdal.Open(tile, gdal.GA_ReadOnly)
-        corners_tmp = GetRasterCorners(raster)
-        corners_tmp.append(tile)
-        tileList.append(corners_tmp)
-        indexTile += 1
-
-    #for val in tileList:
-    #    print(type(val), ": ", val)
-
-    print("GeoTif files indexed. Starting translation of bounding boxes per frame...")
-    for videoName, videoData in videosList.items():
-        indexFrame = 0
-        for frameNum, frameData in videoData.items():
-            indexFrame += 1
-            if(int(indexFrame)%100==0):
-                print("[",round((indexFrame/len(videoData)*100), 1),"%]Frame ", frameNum, " of ",  len(videoData))
-            #listOfBoundingBoxes = frameData[0]
-            droneSensorData = frameData[1]
-            if(len(droneSensorData) > 1):
-                lat_ = droneSensorData["Lat"]
-                lon_ = droneSensorData["Lon"]
-                relevantTifFile = GetRelevantTifFile(lat_, lon_, tileList)
-
-                raster = gdal.Open(relevantTifFile, gdal.GA_ReadOnly)
-                height = GetAltitudeFromLatLon(lat_, lon_, raster)
-                #print(height, type(height))
-                videosList[videoName][frameNum][1]["Height"] = height.item()
-            else:
-                print("WARNING: The frame ", frameNum, " of video ", videoName, " does not contain sensor data. This frame will be ignored.")
-            
-            
-    
-        #Save the results
-        print("\nWriting results:")
-        os.makedirs(outputFolder, exist_ok=True)
-        finalPathJson = os.path.join(outputFolder,videoName+ ".json")
-        finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
-        with open(finalPathJson, 'w', encoding='utf-8') as f:
-            json.dump(videoData, f, ensure_ascii=False, indent=4)
-        print("\t (1/2) Json >> ", finalPathJson)
-
-
-        line_header = ['Frame', 'Lat', 'Lon', 'Alt', 'TerrainElevation',  'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'Timestamp', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', ]
-        lines_content = []
-        #{FrameNum:[[Labels],{sensor:sensorData}]}
-        for frame_key, frame_value in videoData.items():
-            droneData = []
-            if(len(frame_value[1]) > 1):
-                droneData = \
-                    [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"], frame_value[1]["Height"], \
-                    frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
-                    frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"], frame_value[1]["Timestamp"]]
-            else:
-                droneData = ['', '', '', '', '', '', '', '', '', '', '']
-
-            for label_tmp in frame_value[0]:
-                lines_content.append([frame_key] + droneData + label_tmp)
-        with open(finalPathCsv, mode='w') as csv_file:
-            csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
-            csv_writer.writerow(line_header)
-            csv_writer.writerows(lines_content)  
-        print("\t (2/2) Json >> ", finalPathCsv)  
-
-
-
-parser = argparse.ArgumentParser()
-parser.add_argument('--framesFolder', type=str, default='/content/output/consolidation/', help='Folder containing the .json and .csv files')
-parser.add_argument('--demFolder', type=str, default='/content/input/DEM/', help='Input folder containing all the GeoTIF images')
-parser.add_argument('--outputFolder', type=str, default='/content/output/localisation/', help='Output folder for the localisation algorithm')
-args = parser.parse_args()
-print(args)
-GeoLocaliseDrone()
-
-
-
+import argparse
+import os
+import csv
+import numpy as np
+from DemElevation import ElevationService
+from TileIndex import BuildTileList, TileIndex, DEFAULT_CATALOG_NAME
+from SourceCatalog import ListFiles
+from DemMosaic import DemMosaic, FlightGroups, BuildDemMosaic, ReuseDemMosaic
+from StageIO import LoadVideosFromFolder, LoadVideo, LoadPositions, ListVideoInputs, WriteJsonIncremental
+from Columnar import OUTPUT_FORMATS, WritesJson, WritesColumnar, WriteFramesColumnar, IsColumnar, ReadMeta, ReadTable, ExtendColumnar
+from Manifest import RunIncremental, InputKey, FileFingerprint, DataDigest
+from Metrics import Count, Phase, Progress, DefaultMetricsPath, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, Span
+
+
+def WarnFramesWithoutSensor(videoName, frameNums):
+    #One line per video instead of one per frame
+    Count("GeoLocaliseDrone.framesWithoutTelemetry", len(frameNums))
+    if len(frameNums) > 0:
+        print("WARNING: ", len(frameNums), " frame(s) of video ", videoName, " do not contain sensor data and will be ignored, first: ",
+            ", ".join(str(frameNum) for frameNum in frameNums[:5]))
+
+def GeoLocaliseDroneBatch(videoName, videoData, tileIndex, elevationService):
+    #Resolve the terrain height of every frame of the video in one pass, grouping the positions by tile
+    frameKeys = []
+    framesWithoutSensor = []
+    for frameNum, frameData in videoData.items():
+        if(len(frameData[1]) > 1):
+            frameKeys.append(frameNum)
+        else:
+            framesWithoutSensor.append(frameNum)
+    WarnFramesWithoutSensor(videoName, framesWithoutSensor)
+    if len(frameKeys) == 0:
+        return
+    tilePaths = ResolveHeights(videoData, frameKeys, tileIndex, elevationService)
+    if tilePaths is not None:
+        print("Video ", videoName, ": ", len(frameKeys), " frames resolved over ", len(set(tilePaths)), " tile(s)")
+    else:
+        print("Video ", videoName, ": ", len(frameKeys), " frames resolved from the DEM mosaic")
+
+def ResolveHeights(videoData, frameKeys, tileIndex, elevationService):
+    """ Add "Height" to the frames frameKeys, which have sensor data, in one pass. Returns the tile of every frame (None from a DemMosaic) """
+    lats = np.fromiter((videoData[frameNum][1]["Lat"] for frameNum in frameKeys), dtype=np.float64, count=len(frameKeys))
+    lons = np.fromiter((videoData[frameNum][1]["Lon"] for frameNum in frameKeys), dtype=np.float64, count=len(frameKeys))
+    #Without tile index the heights come from a DemMosaic, which needs no tile lookup
+    tilePaths = tileIndex.FindMany(lats.tolist(), lons.tolist()) if tileIndex is not None else None
+    heights = elevationService.GetAltitudes(lats, lons, tilePaths)
+    for frameNum, height in zip(frameKeys, heights.tolist()):
+        videoData[frameNum][1]["Height"] = height
+    return tilePaths
+
+def FramePositions(videoData):
+    """ Lat and Lon arrays of the frames of a video with sensor data, like StageIO.LoadPositions() """
+    positions = [(frameData[1]["Lat"], frameData[1]["Lon"]) for frameData in videoData.values() if len(frameData[1]) > 1]
+    positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+    return positions[:, 0], positions[:, 1]
+
+def VideoTiles(positions, tileIndex):
+    """ Sorted paths of the GeoTIF files under the (lats, lons) positions of a video """
+    lats, lons = positions
+    if len(lats) == 0:
+        return []
+    return sorted(set(tilePath for tilePath in tileIndex.FindMany(lats.tolist(), lons.tolist()) if tilePath is not None))
+
+def OpenDem(demFolder, tileCatalog=None, indexWorkers=8, maxOpenTiles=32, demCacheMB=256):
+    """ Index the GeoTIF tiles of demFolder. Returns the tile index and the elevation service reading them """
+    print("Loading .tif files")
+    tifFiles = ListFiles(demFolder, ".tif")
+    print("GeoTif files found: ",len(tifFiles))
+
+    if tileCatalog is None:
+        tileCatalog = os.path.join(demFolder, DEFAULT_CATALOG_NAME)
+    tileList = BuildTileList(tifFiles, tileCatalog, workers=indexWorkers)
+    tileIndex = TileIndex(tileList)
+
+    #for val in tileList:
+    #    print(type(val), ": ", val)
+
+    elevationService = ElevationService(maxOpenTiles=maxOpenTiles, blockCacheMB=demCacheMB)
+    print("GeoTif files indexed.")
+    return tileIndex, elevationService
+
+def GeoLocaliseDroneVideo(videoName, videoData, tileIndex, elevationService, batch=False):
+    """ Add the terrain elevation under the drone ("Height") to the sensor data of every frame of a video """
+    Count("GeoLocaliseDrone.frames", len(videoData))
+    Count("GeoLocaliseDrone.boxes", sum(len(frameData[0]) for frameData in videoData.values()))
+    if batch:
+        GeoLocaliseDroneBatch(videoName, videoData, tileIndex, elevationService)
+        return videoData
+    progress = Progress("Frames of "+videoName, len(videoData))
+    framesWithoutSensor = []
+    for frameNum, frameData in videoData.items():
+        progress.Update()
+        #listOfBoundingBoxes = frameData[0]
+        droneSensorData = frameData[1]
+        if(len(droneSensorData) > 1):
+            lat_ = droneSensorData["Lat"]
+            lon_ = droneSensorData["Lon"]
+            relevantTifFile = tileIndex.Find(lat_, lon_) if tileIndex is not None else None
+
+            height = elevationService.GetAltitude(lat_, lon_, relevantTifFile)
+            #print(height, type(height))
+            videoData[frameNum][1]["Height"] = height.item()
+        else:
+            framesWithoutSensor.append(frameNum)
+    WarnFramesWithoutSensor(videoName, framesWithoutSensor)
+    return videoData
+
+def GeoLocaliseDroneColumns(videoName, path, tileIndex, elevationService):
+    """
+    GeoLocaliseDroneVideo() of a columnar video reading only its Frame, Lat and Lon columns, in one pass.
+    Returns the additions to its tables for ExtendColumnar(): the Height column when a frame has sensor data
+    """
+    meta = ReadMeta(path)
+    frameNums = np.asarray(ReadTable(path, "frames", ["Frame"], meta)["Frame"])
+    Count("GeoLocaliseDrone.frames", len(frameNums))
+    Count("GeoLocaliseDrone.boxes", len(ReadTable(path, "boxes", ["FrameRow"], meta)["FrameRow"]))
+    if "Lat" not in meta["tables"]["frames"]:
+        WarnFramesWithoutSensor(videoName, frameNums.tolist())
+        return {}
+    table = ReadTable(path, "frames", ["Lat", "Lon"], meta)
+    lats = np.asarray(table["Lat"])
+    located = lats == lats #NaN without sensor data
+    WarnFramesWithoutSensor(videoName, frameNums[~located].tolist())
+    if not located.any():
+        return {}
+    lats = lats[located]
+    lons = np.asarray(table["Lon"])[located]
+    tilePaths = tileIndex.FindMany(lats.tolist(), lons.tolist()) if tileIndex is not None else None
+    heights = np.full(len(frameNums), np.nan)
+    heights[located] = elevationService.GetAltitudes(lats, lons, tilePaths)
+    if tilePaths is not None:
+        print("Video ", videoName, ": ", len(lats), " frames resolved over ", len(set(tilePaths)), " tile(s)")
+    else:
+        print("Video ", videoName, ": ", len(lats), " frames resolved from the DEM mosaic")
+    return {"frames": {"Height": heights}}
+
+def WriteDroneLocalised(outputFolder, videoName, videoData, outputFormat='json'):
+    if WritesColumnar(outputFormat):
+        print("\t Columnar >> ", WriteFramesColumnar(outputFolder, videoName, videoData))
+    if not WritesJson(outputFormat):
+        return
+    #Save the results
+    print("\nWriting results:")
+    os.makedirs(outputFolder, exist_ok=True)
+    finalPathJson = os.path.join(outputFolder,videoName+ ".json")
+    finalPathCsv = os.path.join(outputFolder,videoName+ ".csv")
+    WriteJsonIncremental(finalPathJson, videoData.items())
+    print("\t (1/2) Json >> ", finalPathJson)
+
+
+    line_header = ['Frame', 'Lat', 'Lon', 'Alt', 'TerrainElevation',  'Yaw', 'Pitch', 'Roll', 'GimYaw', 'GimPitch', 'GimRoll', 'Timestamp', 'BoundingBoxClass', 'BoundingBoxCentre_X', 'BoundingBoxCentre_Y', 'BoundingBox_Width%', 'BoundingBox_Height%', ]
+    with open(finalPathCsv, mode='w') as csv_file:
+        csv_writer = csv.writer(csv_file, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        csv_writer.writerow(line_header)
+        #{FrameNum:[[Labels],{sensor:sensorData}]}
+        for frame_key, frame_value in videoData.items():
+            droneData = []
+            if(len(frame_value[1]) > 1):
+                droneData = \
+                    [frame_value[1]["Lat"], frame_value[1]["Lon"], frame_value[1]["Alt"], frame_value[1]["Height"], \
+                    frame_value[1]["Yaw"], frame_value[1]["Pitch"], frame_value[1]["Roll"],\
+                    frame_value[1]["GimYaw"], frame_value[1]["GimPitch"], frame_value[1]["GimRoll"], frame_value[1]["Timestamp"]]
+            else:
+                droneData = ['', '', '', '', '', '', '', '', '', '', '']
+
+            for label_tmp in frame_value[0]:
+                csv_writer.writerow([frame_key] + droneData + label_tmp)
+    print("\t (2/2) Json >> ", finalPathCsv)  
+
+def _OpenElevationService(tileIndex, maxOpenTiles, demCacheMB):
+    #Every process opens its own GeoTIF files, only the tile index is shared
+    return tileIndex, ElevationService(maxOpenTiles=maxOpenTiles, blockCacheMB=demCacheMB)
+
+def _OpenDemMosaic(basePath):
+    #The mosaic is memory-mapped again in every process, they share its pages
+    return None, DemMosaic(basePath)
+
+def CountDemStats(before, after):
+    """ Add to the metrics the DEM cache activity between two ElevationService.Stats() """
+    for cache in ("tiles", "transforms", "blocks"):
+        for counter in ("hits", "misses", "evictions"):
+            Count("dem."+cache+"."+counter, after[cache][counter]-before[cache][counter])
+    Count("dem.bytesRead", after["bytesRead"]-before["bytesRead"])
+    Count("bytesRead", after["bytesRead"]-before["bytesRead"])
+
+def _GeoLocaliseDroneJob(context, videoName, videoData, batch, outputFolder, outputFormat, stream):
+    tileIndex, elevationService = context
+    #A columnar video written back as columnar only is never turned into frames: only its positions are read
+    columns = stream and outputFolder is not None and outputFormat == 'columnar' and IsColumnar(videoData)
+    if stream and not columns:
+        videoData = LoadVideo(videoData) #read in the process that localises it
+    #No tile index: elevationService is a DemMosaic
+    demStats = elevationService.Stats() if tileIndex is not None else None
+    with Span("DEM lookup"):
+        if columns:
+            additions = GeoLocaliseDroneColumns(videoName, videoData, tileIndex, elevationService)
+        else:
+            GeoLocaliseDroneVideo(videoName, videoData, tileIndex, elevationService, batch)
+    if demStats is not None:
+        CountDemStats(demStats, elevationService.Stats())
+    if outputFolder is not None:
+        with Span("output writing"):
+            if columns:
+                print("\t Columnar >> ", ExtendColumnar(videoData, outputFolder, videoName, additions))
+            else:
+                WriteDroneLocalised(outputFolder, videoName, videoData, outputFormat)
+    return None if stream else videoData
+
+def GeoLocaliseDrone(videosList, demFolder, outputFolder=None, tileCatalog=None, indexWorkers=8, maxOpenTiles=32, demCacheMB=256, batch=False, outputFormat='json', workers=1, force=False, stream=False,
+        demMosaic=None):
+    """
+    Add the terrain elevation to every frame of every video. Results are written to outputFolder when given.
+    With workers > 1 the videos are localised on a pool of processes, each one with its own elevation service.
+    Videos whose frames and GeoTIF files did not change since they were written to outputFolder are read back instead, unless force.
+    With stream, videosList is {videoName: inputPath} (ListVideoInputs) and every video is read, localised and written
+    before the next one: a single video is in memory at a time and nothing is returned. Columnar inputs written back
+    as columnar only are not read as frames: only their Lat and Lon columns are read. Streamed videos are up to date
+    while their input file and every GeoTIF file are unchanged.
+    With demMosaic (a path without extension) the tiles under the flights are first mosaicked into one memory-mapped array,
+    one part per connected group of tiles, and the heights are read from it instead of the tiles. The next runs over the
+    same area reuse it without indexing the DEM folder.
+    """
+    with Phase("GeoLocaliseDrone"), ProfileStage("GeoLocaliseDrone"):
+        return _GeoLocaliseDrone(videosList, demFolder, outputFolder, tileCatalog, indexWorkers, maxOpenTiles, demCacheMB, batch, outputFormat, workers, force, stream,
+            demMosaic)
+
+def _GeoLocaliseDrone(videosList, demFolder, outputFolder, tileCatalog, indexWorkers, maxOpenTiles, demCacheMB, batch, outputFormat, workers, force, stream, demMosaic):
+    tileIndex, elevationService = None, None
+    mosaic = None
+    if demMosaic is not None:
+        with Phase("GeoLocaliseDrone.prepareMosaic"):
+            #Streamed videos: only the positions are read
+            videoPositions = [LoadPositions(videoData) if stream else FramePositions(videoData) for videoData in videosList.values()]
+            demFiles = ListFiles(demFolder, ".tif")
+            #A mosaic still valid is used without indexing the DEM folder
+            mosaic = ReuseDemMosaic(demMosaic, demFiles, videoPositions)
+            if mosaic is None:
+                with Phase("GeoLocaliseDrone.openDem"):
+                    tileIndex, elevationService = OpenDem(demFolder, tileCatalog, indexWorkers, maxOpenTiles, demCacheMB)
+                mosaic = BuildDemMosaic(demMosaic, FlightGroups(videoPositions, tileIndex), tileIndex, elevationService, demFiles)
+        if mosaic is None:
+            print("WARNING: The heights are read from the DEM tiles.")
+    if mosaic is None and tileIndex is None:
+        with Phase("GeoLocaliseDrone.openDem"):
+            tileIndex, elevationService = OpenDem(demFolder, tileCatalog, indexWorkers, maxOpenTiles, demCacheMB)
+    print("Starting translation of bounding boxes per frame...")
+    jobs = [(videoName, (videoName, videoData, batch, outputFolder, outputFormat, stream)) for videoName, videoData in videosList.items()]
+    extra = ["mosaic"] if mosaic is not None else []
+    if mosaic is not None:
+        #The heights of every video come from the tiles of the mosaic
+        demTiles = sorted([tilePath]+fingerprint for tilePath, fingerprint in mosaic.meta["tiles"].items())
+    elif stream:
+        #The tiles under a streamed video are not known without reading it, every tile counts
+        demTiles = [[tile[4]]+FileFingerprint(tile[4]) for tile in tileIndex.tileList]
+    def KeyOf(videoName):
+        if stream:
+            #Keyed on its file: the video is only read by its job
+            path = videosList[videoName]
+            return InputKey("GeoLocaliseDrone", path, FileFingerprint(path), demTiles, batch, outputFormat, *extra)
+        videoData = videosList[videoName]
+        #Only the tiles under the video: changing another tile does not invalidate it
+        tiles = demTiles if mosaic is not None else [[tilePath]+FileFingerprint(tilePath) for tilePath in VideoTiles(FramePositions(videoData), tileIndex)]
+        return InputKey("GeoLocaliseDrone", DataDigest(videoData), tiles, batch, outputFormat, *extra)
+    loadOutput = None if stream else LoadVideo
+    if mosaic is not None:
+        localised = RunIncremental("GeoLocaliseDrone", _GeoLocaliseDroneJob, jobs, KeyOf, outputFolder, outputFormat, loadOutput, workers,
+            setup=_OpenDemMosaic if workers > 1 else (lambda: (None, mosaic)), setupArgs=(mosaic.basePath,) if workers > 1 else (), force=force)
+    elif workers > 1:
+        localised = RunIncremental("GeoLocaliseDrone", _GeoLocaliseDroneJob, jobs, KeyOf, outputFolder, outputFormat, loadOutput, workers,
+            setup=_OpenElevationService, setupArgs=(tileIndex, maxOpenTiles, demCacheMB), force=force)
+    else:
+        localised = RunIncremental("GeoLocaliseDrone", _GeoLocaliseDroneJob, jobs, KeyOf, outputFolder, outputFormat, loadOutput,
+            setup=lambda: (tileIndex, elevationService), force=force)
+        elevationService.PrintStats()
+    return None if stream else dict(localised)
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--framesFolder', type=str, default='/content/output/consolidation/', help='Folder containing the .json and .csv files')
+    parser.add_argument('--demFolder', type=str, default='/content/input/DEM/', help='Input folder containing all the GeoTIF images')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/localisation/', help='Output folder for the localisation algorithm')
+    parser.add_argument('--maxOpenTiles', type=int, default=32, help='Maximum number of GeoTIF files kept open at the same time')
+    parser.add_argument('--demCacheMB', type=int, default=256, help='Size in MB of the cache of decoded GeoTIF blocks')
+    parser.add_argument('--tileCatalog', type=str, default=None, help='Path of the sidecar catalog of GeoTIF footprints (default: '+DEFAULT_CATALOG_NAME+' inside demFolder)')
+    parser.add_argument('--indexWorkers', type=int, default=8, help='Number of threads used to open new or changed GeoTIF files')
+    parser.add_argument('--batch', action='store_true', help='Resolve the terrain height of all the frames of a video at once, grouped by GeoTIF file')
+    parser.add_argument('--demMosaic', type=str, default=None, help='Path (without extension) of the memory-mapped mosaic of the DEM tiles under the flights, built when missing or outdated and read instead of the tiles')
+    parser.add_argument('--outputFormat', type=str, default='json', choices=OUTPUT_FORMATS, help='Format of the results: json (.json and .csv), columnar (memory-mappable .npy columns) or both')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes working on different videos at the same time')
+    parser.add_argument('--force', action='store_true', help='Process every video again, even the ones whose inputs did not change since the last run')
+    parser.add_argument('--stream', action='store_true', help='Keep a single video in memory at a time (per process): each video is read, processed and written before the next one')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: <outputFolder>.metrics.json)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the stage and of every video are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    videosList = ListVideoInputs(args.framesFolder) if args.stream else LoadVideosFromFolder(args.framesFolder)
+    GeoLocaliseDrone(videosList, args.demFolder, args.outputFolder, args.tileCatalog, args.indexWorkers, \
+        args.maxOpenTiles, args.demCacheMB, args.batch, args.outputFormat, args.workers, args.force, args.stream, args.demMosaic)
+    WriteRunMetrics(args.metrics or DefaultMetricsPath(args.outputFolder), "GeoLocaliseDrone", args)
@@ -0,0 +1,290 @@
+import argparse
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from CameraModel import CameraModel
+from Geodesy import GetProjectionEngine, PROJECTION_ENGINES
+from SourceCatalog import FindCameraParams
+from GeoLocaliseDrone import OpenDem, ResolveHeights, CountDemStats
+from GeoLocaliseBoxes import ProjectBoxes
+from DemMosaic import DemMosaic
+from Manifest import FileFingerprint
+from Metrics import Count, CurrentMetrics, LatencyStats, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, ProfileCalls, Span
+
+#Sensor values needed to localise the boxes of a frame
+SENSOR_KEYS = ("Lat", "Lon", "Alt", "GimYaw")
+#Largest request body accepted, in bytes
+MAX_BODY_BYTES = 256*1024*1024
+#Latencies kept per endpoint for /stats
+LATENCY_SAMPLES = 10000
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large",
+    422: "Unprocessable Entity", 500: "Internal Server Error"}
+
+
+class GeoService:
+    """
+    DEM tile index, elevation caches and camera models loaded once and kept warm between requests.
+    Requests use the frame format of the stages, {frame: [[boxes], {sensor}]}, and are answered with the
+    GeoLocaliseBoxes output of those frames: Height added to the sensor data and every box replaced by [box, [lat, lon]].
+    Not thread safe (GDAL datasets and caches): the server calls it from a single thread.
+    """
+    def __init__(self, demFolder, camParams, tileCatalog=None, indexWorkers=8, maxOpenTiles=32, demCacheMB=256, demMosaic=None,
+            projection='geopy', cameraLut=False):
+        self.camParams = camParams
+        self.projection = projection
+        self.cameraLut = cameraLut
+        GetProjectionEngine(projection) #fail on an unknown engine before serving
+        if demMosaic is not None:
+            #An existing mosaic of the flight area, the service does not know the flights to build it
+            self.tileIndex, self.elevationService = None, DemMosaic(demMosaic)
+        else:
+            self.tileIndex, self.elevationService = OpenDem(demFolder, tileCatalog, indexWorkers, maxOpenTiles, demCacheMB)
+        self.cameraFiles = FindCameraParams(camParams) if camParams is not None else {}
+        #path: (FileFingerprint, CameraModel) of the camera parameter files, loaded again when they are edited
+        self.fileCameras = {}
+        self.inlineCameras = {}
+        self.latency = {}
+        self.startedAt = time.time()
+
+    def _CameraModel(self, request):
+        """ Camera of a request: "camera" (name of a camParams file) or "cameraParams" {width, height, dfov} """
+        if "cameraParams" in request:
+            params = request["cameraParams"]
+            key = (params["width"], params["height"], params["dfov"])
+            if key not in self.inlineCameras:
+                self.inlineCameras[key] = CameraModel(*key, useLut=self.cameraLut)
+            return self.inlineCameras[key]
+        if "camera" not in request:
+            raise ValueError('The request needs "camera" (name of a camera parameter file) or "cameraParams" {width, height, dfov}.')
+        name = request["camera"]
+        if name not in self.cameraFiles and self.camParams is not None:
+            #Camera parameter files added since the service started
+            self.cameraFiles = FindCameraParams(self.camParams)
+        if name not in self.cameraFiles or not os.path.isfile(self.cameraFiles[name]):
+            raise ValueError("No camera parameter file "+str(name)+".txt under "+str(self.camParams))
+        path = self.cameraFiles[name]
+        fingerprint = FileFingerprint(path)
+        cached = self.fileCameras.get(path)
+        if cached is None or cached[0] != fingerprint:
+            cached = (fingerprint, CameraModel.FromConfigFile(path, useLut=self.cameraLut))
+            self.fileCameras[path] = cached
+            Count("GeoService.cameraLoads")
+        return cached[1]
+
+    def _Heights(self, lats, lons):
+        tilePaths = self.tileIndex.FindMany(lats, lons) if self.tileIndex is not None else None
+        return self.elevationService.GetAltitudes(lats, lons, tilePaths)
+
+    def Localise(self, request):
+        """
+        {"camera" or "cameraParams", "projection" (optional), "frames": {frame: [[boxes], {sensor}]}} ->
+        {"frames": localised frames, "boxesLocated", "framesWithoutTelemetry"}. Frames without sensor data keep [box, []] boxes.
+        """
+        frames = request.get("frames")
+        if not isinstance(frames, dict):
+            raise ValueError('"frames" must be an object {frame: [[boxes], {sensor}]}.')
+        cameraModel = self._CameraModel(request)
+        projectionEngine = GetProjectionEngine(request.get("projection", self.projection))
+        frameKeys = []
+        for frameNum, frameData in frames.items():
+            if len(frameData[1]) <= 1:
+                continue
+            missing = [key for key in SENSOR_KEYS if key not in frameData[1]]
+            if len(missing) > 0:
+                raise ValueError("The sensor data of frame "+str(frameNum)+" lacks "+", ".join(missing))
+            frameKeys.append(frameNum)
+        if len(frameKeys) > 0:
+            demStats = self.elevationService.Stats() if self.tileIndex is not None else None
+            with Span("DEM lookup"):
+                ResolveHeights(frames, frameKeys, self.tileIndex, self.elevationService)
+            if demStats is not None:
+                CountDemStats(demStats, self.elevationService.Stats())
+        with Span("box projection"):
+            _, boxesLocated, framesWithoutSensor, boxesWithoutSensor = ProjectBoxes(frames, cameraModel, projectionEngine)
+        Count("GeoService.frames", len(frames))
+        Count("GeoService.boxes", boxesLocated+boxesWithoutSensor)
+        Count("GeoService.boxesLocated", boxesLocated)
+        return {"frames": frames, "boxesLocated": boxesLocated, "framesWithoutTelemetry": framesWithoutSensor}
+
+    def Heights(self, request):
+        """ {"points": [[lat, lon], ...]} -> {"heights": [terrain height of every point]} """
+        points = request.get("points")
+        if not isinstance(points, list):
+            raise ValueError('"points" must be a list of [lat, lon].')
+        if len(points) == 0:
+            return {"heights": []}
+        lats = [float(point[0]) for point in points]
+        lons = [float(point[1]) for point in points]
+        with Span("DEM lookup"):
+            heights = self._Heights(lats, lons)
+        Count("GeoService.points", len(points))
+        return {"heights": heights.tolist()}
+
+    def Health(self, request=None):
+        return {"status": "ok", "uptime": time.time()-self.startedAt}
+
+    def Stats(self, request=None):
+        """ Counters, latency per endpoint and DEM cache statistics since the service started """
+        return {
+            "uptime": time.time()-self.startedAt,
+            "counters": dict(CurrentMetrics().counters),
+            "latency": {endpoint: stats.Summary() for endpoint, stats in self.latency.items()},
+            "dem": self.elevationService.Stats() if self.tileIndex is not None else "mosaic",
+            "cameraModels": len(self.fileCameras)+len(self.inlineCameras),
+        }
+
+    def Routes(self):
+        return {("POST", "/localise"): self.Localise, ("POST", "/heights"): self.Heights,
+                ("GET", "/health"): self.Health, ("GET", "/stats"): self.Stats}
+
+    def RecordLatency(self, endpoint, seconds):
+        self.latency.setdefault(endpoint, LatencyStats(LATENCY_SAMPLES)).Add(seconds)
+
+
+async def _ReadRequest(reader):
+    """ (method, path, version, headers, body) of the next HTTP/1.1 request, None when the client closed the connection """
+    requestLine = await reader.readline()
+    if not requestLine.strip():
+        return None
+    parts = requestLine.decode('latin-1').split()
+    if len(parts) != 3:
+        raise ValueError("Malformed request line")
+    method, path, version = parts
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode('latin-1').partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", 0))
+    if length > MAX_BODY_BYTES:
+        return method, path, version, headers, None
+    body = await reader.readexactly(length) if length > 0 else b""
+    return method, path, version, headers, body
+
+def _WriteResponse(writer, status, response, keepAlive):
+    payload = json.dumps(response).encode('utf-8')
+    head = "HTTP/1.1 "+str(status)+" "+HTTP_REASONS.get(status, "")+"\r\nContent-Type: application/json\r\nContent-Length: "+str(len(payload))+ \
+        "\r\nConnection: "+("keep-alive" if keepAlive else "close")+"\r\n\r\n"
+    writer.write(head.encode('latin-1')+payload)
+
+async def _Dispatch(service, executor, run, method, path, body):
+    """
+    (status, response) of a request. The service works on the executor thread, the event loop keeps accepting clients.
+    run(function, request) makes the call on that thread (ProfileCalls)
+    """
+    routes = service.Routes()
+    path = path.split("?", 1)[0]
+    if (method, path) not in routes:
+        if any(routePath == path for _, routePath in routes):
+            return 405, {"error": "Method "+method+" not allowed on "+path}
+        return 404, {"error": "Unknown endpoint "+path+". Expected one of: "+", ".join(method+" "+routePath for method, routePath in routes)}
+    try:
+        request = json.loads(body) if body else {}
+    except ValueError as e:
+        return 400, {"error": "The body is not valid JSON: "+str(e)}
+    if not isinstance(request, dict):
+        return 400, {"error": "The body must be a JSON object"}
+    start = time.perf_counter()
+    try:
+        response = await asyncio.get_running_loop().run_in_executor(executor, run, routes[(method, path)], request)
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        #Bad frames, missing cameras or points outside the DEM
+        Count("GeoService.rejected")
+        return 422, {"error": type(e).__name__+": "+str(e)}
+    except Exception as e:
+        print("ERROR: ", method, " ", path, ": ", type(e).__name__, ": ", e)
+        return 500, {"error": type(e).__name__+": "+str(e)}
+    service.RecordLatency(path, time.perf_counter()-start)
+    Count("GeoService.requests")
+    return 200, response
+
+async def _HandleConnection(service, executor, run, reader, writer):
+    try:
+        while True:
+            try:
+                request = await _ReadRequest(reader)
+            except ValueError as e:
+                _WriteResponse(writer, 400, {"error": str(e)}, False)
+                break
+            if request is None:
+                break
+            method, path, version, headers, body = request
+            keepAlive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+            if body is None:
+                _WriteResponse(writer, 413, {"error": "The body is larger than "+str(MAX_BODY_BYTES)+" bytes"}, False)
+                break
+            status, response = await _Dispatch(service, executor, run, method, path, body)
+            _WriteResponse(writer, status, response, keepAlive)
+            await writer.drain()
+            if not keepAlive:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass #client gone
+    finally:
+        writer.close()
+
+async def ServeGeoService(service, host='127.0.0.1', port=8765, socketPath=None):
+    """ Serve service over HTTP on host:port, or on the Unix socket socketPath, until cancelled """
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="GeoService")
+    #The requests are profiled on the executor thread, the profile of the main thread only sees the event loop
+    with ProfileCalls("GeoService", "requests") as run:
+        await _ServeRequests(service, executor, run, host, port, socketPath)
+
+async def _ServeRequests(service, executor, run, host, port, socketPath):
+    async def Handle(reader, writer):
+        await _HandleConnection(service, executor, run, reader, writer)
+    if socketPath is not None:
+        if os.path.exists(socketPath):
+            os.remove(socketPath) #left by a previous run
+        server = await asyncio.start_unix_server(Handle, path=socketPath, limit=MAX_BODY_BYTES)
+        print("GeoService listening on unix:", socketPath)
+    else:
+        server = await asyncio.start_server(Handle, host, port, limit=MAX_BODY_BYTES)
+        print("GeoService listening on http://", host, ":", port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=True)
+        if socketPath is not None and os.path.exists(socketPath):
+            os.remove(socketPath)
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--demFolder', type=str, default='/content/input/DEM/', help='Input folder containing all the GeoTIF images')
+    parser.add_argument('--camParams', type=str, default='/content/input/camParams/', help='Input folder containing all the videos camera parameter files')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address the service listens on')
+    parser.add_argument('--port', type=int, default=8765, help='Port the service listens on')
+    parser.add_argument('--socket', type=str, default=None, help='Listen on this Unix socket instead of host:port')
+    parser.add_argument('--tileCatalog', type=str, default=None, help='Path of the sidecar catalog of GeoTIF footprints (default: inside demFolder)')
+    parser.add_argument('--indexWorkers', type=int, default=8, help='Number of threads used to open new or changed GeoTIF files')
+    parser.add_argument('--maxOpenTiles', type=int, default=32, help='Maximum number of GeoTIF files kept open at the same time')
+    parser.add_argument('--demCacheMB', type=int, default=256, help='Size in MB of the cache of decoded GeoTIF blocks')
+    parser.add_argument('--demMosaic', type=str, default=None, help='Path (without extension) of an existing memory-mapped mosaic of the DEM tiles, read instead of the tiles')
+    parser.add_argument('--projection', type=str, default='geopy', choices=list(PROJECTION_ENGINES), help='Engine used to project the bounding boxes when a request does not choose one')
+    parser.add_argument('--cameraLut', action='store_true', help='Use cached per-resolution lookup tables for the angle of every pixel to the image centre')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json written when the service stops')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the service are written when it stops')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    with ProfileStage("GeoService"):
+        service = GeoService(args.demFolder, args.camParams, args.tileCatalog, args.indexWorkers, args.maxOpenTiles, args.demCacheMB,
+            args.demMosaic, args.projection, args.cameraLut)
+        try:
+            asyncio.run(ServeGeoService(service, args.host, args.port, args.socket))
+        except KeyboardInterrupt:
+            print("GeoService stopped.")
+    if args.metrics is not None:
+        WriteRunMetrics(args.metrics, "GeoService", args, {"latency": service.Stats()["latency"]})
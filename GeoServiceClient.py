@@ -0,0 +1,148 @@
+import argparse
+import os
+import json
+import time
+import socket
+import http.client
+from StageIO import ListVideoInputs, LoadVideo, WriteJsonIncremental
+from Metrics import LatencyStats
+
+
+class GeoServiceError(Exception):
+    """ Error answered by the GeoService, with its HTTP status """
+    def __init__(self, status, message):
+        super().__init__(str(status)+": "+message)
+        self.status = status
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socketPath, timeout):
+        super().__init__("localhost", timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+
+class GeoServiceClient:
+    """
+    Client of a running GeoService, keeping its connection open between calls.
+    Only needs the standard library: the workers calling it do not load GDAL, OpenCV or the DEM.
+    """
+    def __init__(self, host='127.0.0.1', port=8765, socketPath=None, timeout=60.0):
+        self.host = host
+        self.port = port
+        self.socketPath = socketPath
+        self.timeout = timeout
+        self.connection = None
+
+    def _Connection(self):
+        if self.connection is None:
+            if self.socketPath is not None:
+                self.connection = _UnixHTTPConnection(self.socketPath, self.timeout)
+            else:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self.connection
+
+    def Request(self, method, path, payload=None):
+        """ Response of an endpoint. A connection closed by the service while idle is opened again once """
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            try:
+                connection = self._Connection()
+                connection.request(method, path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+                break
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                self.Close()
+                if attempt == 1:
+                    raise
+        result = json.loads(data) if data else {}
+        if response.status != 200:
+            raise GeoServiceError(response.status, result.get("error", ""))
+        if response.getheader("Connection", "").lower() == "close":
+            self.Close()
+        return result
+
+    def Localise(self, frames, camera=None, cameraParams=None, projection=None):
+        """
+        frames {frame: [[boxes], {sensor}]} localised by the service, camera being the name of a camParams file
+        or cameraParams {width, height, dfov}. Returns the frames as GeoLocaliseBoxes writes them
+        """
+        request = {"frames": frames}
+        if camera is not None:
+            request["camera"] = camera
+        if cameraParams is not None:
+            request["cameraParams"] = cameraParams
+        if projection is not None:
+            request["projection"] = projection
+        return self.Request("POST", "/localise", request)["frames"]
+
+    def Heights(self, points):
+        """ Terrain height of every [lat, lon] point """
+        return self.Request("POST", "/heights", {"points": points})["heights"]
+
+    def Health(self):
+        return self.Request("GET", "/health")
+
+    def Stats(self):
+        return self.Request("GET", "/stats")
+
+    def Close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.Close()
+        return False
+
+
+def LocaliseFolder(client, framesFolder, outputFolder=None, batchFrames=1, projection=None):
+    """
+    Send the frames of every video of framesFolder (Consolidate or GeoLocaliseDrone output) to the service, batchFrames
+    frames per request, as an ingestion worker would. The results are written to outputFolder like GeoLocaliseBoxes does (.json).
+    Returns the LatencyStats of the requests.
+    """
+    latency = LatencyStats()
+    for videoName, path in ListVideoInputs(framesFolder).items():
+        frames = LoadVideo(path)
+        keys = list(frames)
+        localised = {}
+        for start in range(0, len(keys), batchFrames):
+            batch = {key: frames[key] for key in keys[start:start+batchFrames]}
+            requestStart = time.perf_counter()
+            localised.update(client.Localise(batch, camera=videoName, projection=projection))
+            latency.Add(time.perf_counter()-requestStart)
+        print("Video ", videoName, ": ", len(frames), " frames localised in ", -(-len(keys)//batchFrames), " request(s)")
+        if outputFolder is not None:
+            os.makedirs(outputFolder, exist_ok=True)
+            finalPathJson = os.path.join(outputFolder, videoName+".json")
+            WriteJsonIncremental(finalPathJson, localised.items())
+            print("\t Json >> ", finalPathJson)
+    return latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address of the GeoService')
+    parser.add_argument('--port', type=int, default=8765, help='Port of the GeoService')
+    parser.add_argument('--socket', type=str, default=None, help='Unix socket of the GeoService, instead of host:port')
+    parser.add_argument('--framesFolder', type=str, default=None, help='Folder with the .json files of Consolidate or GeoLocaliseDrone to localise. Without it the health and statistics of the service are printed')
+    parser.add_argument('--outputFolder', type=str, default=None, help='Folder where the localised frames are written')
+    parser.add_argument('--batch', type=int, default=1, help='Frames sent per request')
+    parser.add_argument('--projection', type=str, default=None, help='Projection engine of the requests (default: the one of the service)')
+    args = parser.parse_args()
+    with GeoServiceClient(args.host, args.port, args.socket) as client:
+        print(client.Health())
+        if args.framesFolder is not None:
+            latency = LocaliseFolder(client, args.framesFolder, args.outputFolder, args.batch, args.projection)
+            print("Request latency: ", latency.Describe())
+        print(json.dumps(client.Stats(), indent=4))
@@ -0,0 +1,155 @@
+import argparse
+import time
+import numpy as np
+import geopy.distance
+
+#WGS-84 ellipsoid, the default one of geopy.distance.distance
+WGS84_A = 6378137.0
+WGS84_F = 1/298.257223563
+WGS84_B = (1-WGS84_F)*WGS84_A
+WGS84_E2 = WGS84_F*(2-WGS84_F)
+
+
+def NormaliseLongitude(lon):
+    return (lon + 180.0) % 360.0 - 180.0
+
+def DestinationGeopy(originLat, originLon, bearing, distanceMetres):
+    """ Reference engine: one geopy geodesic per point """
+    originLat, originLon, bearing, distanceMetres = np.broadcast_arrays(
+        np.asarray(originLat, dtype=np.float64), np.asarray(originLon, dtype=np.float64),
+        np.asarray(bearing, dtype=np.float64), np.asarray(distanceMetres, dtype=np.float64))
+    lats = np.empty(originLat.shape, dtype=np.float64)
+    lons = np.empty(originLat.shape, dtype=np.float64)
+    for i in np.ndindex(originLat.shape):
+        pointCoord = geopy.distance.distance(kilometers=(distanceMetres[i]/1000.0)).destination((originLat[i], originLon[i]), bearing=bearing[i])
+        lats[i] = pointCoord.latitude
+        lons[i] = pointCoord.longitude
+    return lats, lons
+
+def DestinationVincenty(originLat, originLon, bearing, distanceMetres, tolerance=1e-12, maxIterations=100):
+    """ Vincenty's direct geodesic solution on the WGS-84 ellipsoid, vectorised over arrays of points """
+    phi1 = np.radians(np.asarray(originLat, dtype=np.float64))
+    alpha1 = np.radians(np.asarray(bearing, dtype=np.float64))
+    s = np.asarray(distanceMetres, dtype=np.float64)
+    a, b, f = WGS84_A, WGS84_B, WGS84_F
+
+    sinAlpha1 = np.sin(alpha1)
+    cosAlpha1 = np.cos(alpha1)
+    tanU1 = (1-f)*np.tan(phi1)
+    cosU1 = 1/np.sqrt(1+tanU1**2)
+    sinU1 = tanU1*cosU1
+    sigma1 = np.arctan2(tanU1, cosAlpha1)
+    sinAlpha = cosU1*sinAlpha1
+    cosSqAlpha = 1-sinAlpha**2
+    uSq = cosSqAlpha*(a**2-b**2)/(b**2)
+    A = 1+uSq/16384*(4096+uSq*(-768+uSq*(320-175*uSq)))
+    B = uSq/1024*(256+uSq*(-128+uSq*(74-47*uSq)))
+
+    sigma = s/(b*A)
+    for _ in range(maxIterations):
+        cos2SigmaM = np.cos(2*sigma1+sigma)
+        sinSigma = np.sin(sigma)
+        cosSigma = np.cos(sigma)
+        deltaSigma = B*sinSigma*(cos2SigmaM+B/4*(cosSigma*(-1+2*cos2SigmaM**2)-B/6*cos2SigmaM*(-3+4*sinSigma**2)*(-3+4*cos2SigmaM**2)))
+        sigmaPrev = sigma
+        sigma = s/(b*A)+deltaSigma
+        if np.all(np.abs(sigma-sigmaPrev) <= tolerance):
+            break
+    cos2SigmaM = np.cos(2*sigma1+sigma)
+    sinSigma = np.sin(sigma)
+    cosSigma = np.cos(sigma)
+
+    tmp = sinU1*sinSigma-cosU1*cosSigma*cosAlpha1
+    phi2 = np.arctan2(sinU1*cosSigma+cosU1*sinSigma*cosAlpha1, (1-f)*np.sqrt(sinAlpha**2+tmp**2))
+    lam = np.arctan2(sinSigma*sinAlpha1, cosU1*cosSigma-sinU1*sinSigma*cosAlpha1)
+    C = f/16*cosSqAlpha*(4+f*(4-3*cosSqAlpha))
+    L = lam-(1-C)*f*sinAlpha*(sigma+C*sinSigma*(cos2SigmaM+C*cosSigma*(-1+2*cos2SigmaM**2)))
+    return np.degrees(phi2), NormaliseLongitude(np.asarray(originLon, dtype=np.float64)+np.degrees(L))
+
+def DestinationENU(originLat, originLon, bearing, distanceMetres):
+    """
+    Local tangent plane (east/north) approximation using the meridional and prime vertical radii of curvature
+    at the origin. Valid for offsets of tens to a few hundred metres.
+    """
+    phi = np.radians(np.asarray(originLat, dtype=np.float64))
+    alpha = np.radians(np.asarray(bearing, dtype=np.float64))
+    s = np.asarray(distanceMetres, dtype=np.float64)
+    sinPhi = np.sin(phi)
+    w = np.sqrt(1-WGS84_E2*sinPhi**2)
+    M = WGS84_A*(1-WGS84_E2)/(w**3) #meridional radius of curvature
+    N = WGS84_A/w #prime vertical radius of curvature
+    north = s*np.cos(alpha)
+    east = s*np.sin(alpha)
+    lats = np.asarray(originLat, dtype=np.float64)+np.degrees(north/M)
+    lons = np.asarray(originLon, dtype=np.float64)+np.degrees(east/(N*np.cos(phi)))
+    return lats, NormaliseLongitude(lons)
+
+PROJECTION_ENGINES = {
+    "geopy": DestinationGeopy,
+    "vincenty": DestinationVincenty,
+    "enu": DestinationENU,
+}
+
+def GetProjectionEngine(name):
+    if name not in PROJECTION_ENGINES:
+        raise ValueError("Unknown projection engine "+str(name)+". Expected one of: "+", ".join(PROJECTION_ENGINES))
+    return PROJECTION_ENGINES[name]
+
+def MetresPerDegree(lat):
+    """ Length in metres of one degree of latitude and of longitude at the given latitude """
+    phi = np.radians(lat)
+    w = np.sqrt(1-WGS84_E2*np.sin(phi)**2)
+    metresPerDegreeLat = np.radians(1.0)*WGS84_A*(1-WGS84_E2)/(w**3)
+    metresPerDegreeLon = np.radians(1.0)*WGS84_A/w*np.cos(phi)
+    return metresPerDegreeLat, metresPerDegreeLon
+
+def OffsetInMetres(latA, lonA, latB, lonB):
+    """ Approximate ground distance in metres between close points, used to measure engine errors """
+    phi = np.radians(latA)
+    sinPhi = np.sin(phi)
+    w = np.sqrt(1-WGS84_E2*sinPhi**2)
+    north = np.radians(latB-latA)*WGS84_A*(1-WGS84_E2)/(w**3)
+    east = np.radians(NormaliseLongitude(lonB-lonA))*WGS84_A/w*np.cos(phi)
+    return np.hypot(north, east)
+
+def AccuracyReport(samples=20000, maxDistance=100.0, seed=0, latRange=(-70.0, 70.0)):
+    """ Compare every engine against geopy on random (origin, bearing, distance) triples """
+    rng = np.random.default_rng(seed)
+    originLat = rng.uniform(latRange[0], latRange[1], samples)
+    originLon = rng.uniform(-180.0, 180.0, samples)
+    bearing = rng.uniform(-180.0, 180.0, samples)
+    distance = rng.uniform(0.0, maxDistance, samples)
+
+    start = time.perf_counter()
+    refLat, refLon = DestinationGeopy(originLat, originLon, bearing, distance)
+    refSeconds = time.perf_counter()-start
+
+    report = {}
+    for name, engine in PROJECTION_ENGINES.items():
+        start = time.perf_counter()
+        lats, lons = engine(originLat, originLon, bearing, distance)
+        seconds = time.perf_counter()-start
+        errors = OffsetInMetres(refLat, refLon, lats, lons)
+        report[name] = {
+            "maxErrorMetres": float(np.max(errors)),
+            "meanErrorMetres": float(np.mean(errors)),
+            "p99ErrorMetres": float(np.percentile(errors, 99)),
+            "pointsPerSecond": samples/seconds if seconds > 0 else float("inf"),
+            "speedup": refSeconds/seconds if seconds > 0 else float("inf"),
+        }
+    return report
+
+def PrintAccuracyReport(report, samples, maxDistance):
+    print("Accuracy against geopy over ", samples, " points with distances up to ", maxDistance, " m:")
+    for name, values in report.items():
+        print("\t", name, ": max error ", "%.3e" % values["maxErrorMetres"], " m, mean error ", "%.3e" % values["meanErrorMetres"], \
+            " m, p99 error ", "%.3e" % values["p99ErrorMetres"], " m, ", int(values["pointsPerSecond"]), " points/s (x", round(values["speedup"], 1), ")")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--samples', type=int, default=20000, help='Number of random points compared against geopy')
+    parser.add_argument('--maxDistance', type=float, default=100.0, help='Maximum distance in metres between the drone and a bounding box')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random points')
+    args = parser.parse_args()
+    PrintAccuracyReport(AccuracyReport(args.samples, args.maxDistance, args.seed), args.samples, args.maxDistance)
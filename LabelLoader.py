@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from Metrics import Count
+from Manifest import DataDigest
+from SourceCatalog import ListFiles, ScanEntries
+
+#Columns of the per-video box arrays
+BOX_COLUMNS = ["Frame", "Class", "CentreX", "CentreY", "Width", "Height"]
+#Entry of the label archive with the key of the prediction folder it was packed from
+ARCHIVE_KEY = "folderKey"
+
+
+class VideoLabels:
+    """ Labels of one video: every frame with a label file and a (N, 6) array of boxes sorted by frame """
+    def __init__(self, frames, boxes):
+        self.frames = frames
+        self.boxes = boxes
+
+    def BoxesPerFrame(self):
+        """ {frameNum: [[class, x, y, w, h], ...]} including the frames without boxes """
+        result = {}
+        starts = np.searchsorted(self.boxes[:, 0], self.frames, side='left')
+        ends = np.searchsorted(self.boxes[:, 0], self.frames, side='right')
+        rows = self.boxes[:, 1:].tolist()
+        classes = self.boxes[:, 1].astype(np.int64).tolist()
+        for frameNum, start, end in zip(self.frames.tolist(), starts.tolist(), ends.tolist()):
+            result[frameNum] = [[classes[i]]+rows[i][1:] for i in range(start, end)]
+        return result
+
+
+def SplitLabelFileName(path):
+    """ <video>_<frame>.txt -> (video, frame) """
+    fileName = os.path.splitext(os.path.basename(path))[0]
+    split2 = fileName.rpartition('_')
+    return split2[0], int(split2[2])
+
+def ParseLabelText(text):
+    """ (n, 5) array of class, x, y, w, h. Only the first 5 values of every line are used """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if len(lines) == 0:
+        return np.empty((0, 5), dtype=np.float64)
+    tokens = text.split()
+    if len(tokens) == 5*len(lines):
+        return np.array(tokens, dtype=np.float64).reshape(len(lines), 5)
+    return np.array([line.split()[:5] for line in lines], dtype=np.float64)
+
+def ReadLabelFile(path):
+    with open(path, 'r') as reader:
+        text = reader.read()
+    videoName, frameNum = SplitLabelFileName(path)
+    return videoName, frameNum, ParseLabelText(text)
+
+def GroupLabels(parsedFiles):
+    """ Build the VideoLabels of every video from (video, frame, boxes) tuples """
+    framesPerVideo = {}
+    for videoName, frameNum, boxes in parsedFiles:
+        framesPerVideo.setdefault(videoName, []).append((frameNum, boxes))
+    videos = {}
+    for videoName, frameList in framesPerVideo.items():
+        frameList.sort(key=lambda item: item[0])
+        frames = np.array([frameNum for frameNum, _ in frameList], dtype=np.int64)
+        counts = np.array([boxes.shape[0] for _, boxes in frameList], dtype=np.int64)
+        boxes = np.empty((int(counts.sum()), len(BOX_COLUMNS)), dtype=np.float64)
+        boxes[:, 0] = np.repeat(frames, counts)
+        if boxes.shape[0] > 0:
+            boxes[:, 1:] = np.concatenate([frameBoxes for _, frameBoxes in frameList if frameBoxes.shape[0] > 0])
+        videos[videoName] = VideoLabels(frames, boxes)
+    return videos
+
+def LoadLabelFolder(predictionFolder, workers=16):
+    labelFiles = ListFiles(predictionFolder, ".txt")
+    print("Reading ", len(labelFiles), " label files with ", workers, " thread(s)")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        parsedFiles = list(executor.map(ReadLabelFile, labelFiles, chunksize=256))
+    Count("labelFiles", len(labelFiles))
+    return GroupLabels(parsedFiles)
+
+def LabelFolderKey(predictionFolder):
+    """
+    Key of the label files of predictionFolder: path, size and mtime of every label file.
+    Adding, removing or rewriting a label file changes it (YOLO appends to the label files of a frame), at the cost of one stat per file
+    """
+    stats = []
+    for entry in ScanEntries(predictionFolder, ".txt"):
+        stat = entry.stat()
+        stats.append([os.path.relpath(entry.path, predictionFolder), stat.st_size, stat.st_mtime_ns])
+    return DataDigest(sorted(stats))
+
+def SaveLabelArchive(videos, archivePath, folderKey=None):
+    arrays = {}
+    if folderKey is not None:
+        arrays[ARCHIVE_KEY] = np.array(folderKey)
+    for videoName, labels in videos.items():
+        arrays[videoName+"/frames"] = labels.frames
+        arrays[videoName+"/boxes"] = labels.boxes
+    tmpPath = archivePath+".tmp.npz"
+    np.savez(tmpPath, **arrays)
+    os.replace(tmpPath, archivePath)
+
+def LabelArchiveKey(archivePath):
+    """ Key of the prediction folder the archive was packed from, None when unknown or unreadable """
+    try:
+        with np.load(archivePath, allow_pickle=False) as archive:
+            return str(archive[ARCHIVE_KEY]) if ARCHIVE_KEY in archive.files else None
+    except (OSError, ValueError):
+        return None
+
+def LoadLabelArchive(archivePath):
+    videos = {}
+    Count("bytesRead", os.path.getsize(archivePath))
+    with np.load(archivePath, allow_pickle=False) as archive:
+        for key in archive.files:
+            videoName, _, column = key.rpartition("/")
+            if column == "frames":
+                videos[videoName] = VideoLabels(archive[key], archive[videoName+"/boxes"])
+    return videos
+
+def LoadLabels(predictionFolder, labelArchive=None, workers=16):
+    """
+    Labels of every video. When labelArchive was packed from predictionFolder as it is now (LabelFolderKey) it is read
+    instead of the folder, otherwise the folder is read and the archive is written again for the next runs.
+    """
+    folderKey = LabelFolderKey(predictionFolder) if labelArchive is not None else None
+    if labelArchive is not None and os.path.isfile(labelArchive):
+        if LabelArchiveKey(labelArchive) == folderKey:
+            print("Reading packed labels from ", labelArchive)
+            return LoadLabelArchive(labelArchive)
+        print("The label files changed since ", labelArchive, " was packed, reading them again")
+    videos = LoadLabelFolder(predictionFolder, workers)
+    if labelArchive is not None:
+        SaveLabelArchive(videos, labelArchive, folderKey)
+        print("Packed labels >> ", labelArchive)
+    return videos
@@ -0,0 +1,268 @@
+import argparse
+import os
+import csv
+import time
+from collections import OrderedDict
+from SrtTelemetry import SrtTail, CACHE_SUFFIX as SRT_CACHE_SUFFIX
+from LabelLoader import ReadLabelFile
+from SourceCatalog import FolderIndex, FindSources, FindCameraParams
+from VideoMetadata import VideoMetadataProvider, DefaultCachePath
+from CameraModel import LoadCameraModel
+from Geodesy import GetProjectionEngine, PROJECTION_ENGINES
+from GeoLocaliseDrone import OpenDem, ResolveHeights
+from GeoLocaliseBoxes import ProjectBoxes, BOXES_CSV_HEADER, BoxesCsvRows
+from Clustering import OnlineClusterer, TreeWriter
+from StageIO import JsonIncrementalWriter
+from Pipeline import STAGE_FOLDERS
+from Metrics import Count, Phase, LatencyStats, PROGRESS_INTERVAL, WriteRunMetrics
+from Profiling import EnableProfiling, ProfileStage, Span
+
+#Label files modified less than this before a poll may still be being written, they are read by the next poll
+SETTLE_SECONDS = 0.2
+
+
+class LabelWatcher:
+    """
+    Label files <video>_<frame>.txt appearing in predictionFolder, found through its source catalog.
+    Only the directories whose mtime changed are listed again, and only the files not read yet are kept.
+    """
+    def __init__(self, predictionFolder):
+        self.index = FolderIndex(predictionFolder)
+        #Paths of the label files found but still being written. None before the first poll, which takes every file
+        self.pending = None
+
+    def Poll(self):
+        """ (videoName, frameNum, [[class, x, y, w, h]], writtenAt) of every label file written since the last call """
+        self.index.Refresh()
+        if self.pending is None:
+            self.pending = set(self.index.Files(".txt"))
+        else:
+            self.pending.update(self.index.Added(".txt"))
+        now = time.time()
+        found = []
+        for path in sorted(self.pending):
+            try:
+                writtenAt = os.path.getmtime(path)
+            except FileNotFoundError:
+                self.pending.discard(path)
+                continue
+            if now-writtenAt < SETTLE_SECONDS:
+                continue
+            self.pending.discard(path)
+            videoName, frameNum, boxes = ReadLabelFile(path)
+            #Same boxes as VideoLabels.BoxesPerFrame()
+            found.append((videoName, frameNum, [[int(row[0])]+row[1:] for row in boxes.tolist()], writtenAt))
+        Count("labelFiles", len(found))
+        return found
+
+
+class LiveVideo:
+    """ A video being processed live: its growing subtitles, the frames waiting for them and its open outputs """
+    def __init__(self, videoName, srtPath, fps, cameraModel, outputFolder, hThreshold=None, vThreshold=None, viewFrames=30):
+        self.videoName = videoName
+        self.fps = fps
+        self.cameraModel = cameraModel
+        self.srtTail = SrtTail(srtPath)
+        #{frameNum: (boxes, arrivedAt)}
+        self.pending = {}
+        boxesFolder = os.path.join(outputFolder, STAGE_FOLDERS["boxes"])
+        os.makedirs(boxesFolder, exist_ok=True)
+        self.json = JsonIncrementalWriter(os.path.join(boxesFolder, videoName+".json"))
+        self.csvFile = open(os.path.join(boxesFolder, videoName+".csv"), mode='w')
+        self.csvWriter = csv.writer(self.csvFile, delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL)
+        self.csvWriter.writerow(BOXES_CSV_HEADER)
+        self.treeWriter = None
+        self.clusterer = None
+        if hThreshold is not None and vThreshold is not None:
+            self.treeWriter = TreeWriter(os.path.join(outputFolder, STAGE_FOLDERS["clustering"]), videoName)
+            self.clusterer = OnlineClusterer(hThreshold, vThreshold, self.treeWriter.Add, viewFrames)
+
+    def ReadyFrames(self, final=False):
+        """
+        {FrameNum:[[Labels],{sensor:sensorData}]} of the pending frames whose subtitles record is known, in frame order,
+        and the time every one of them arrived. With final, every pending frame is ready.
+        """
+        frames = OrderedDict()
+        arrivals = []
+        for frameNum in sorted(self.pending):
+            timestamp = frameNum/self.fps
+            sensor = self.srtTail.Match(1000.0*timestamp, final)
+            if sensor is None:
+                break #the next frames are later in the subtitles too
+            boxes, arrivedAt = self.pending.pop(frameNum)
+            sensor["Timestamp"] = timestamp
+            frames[frameNum] = [boxes, sensor]
+            arrivals.append(arrivedAt)
+        return frames, arrivals
+
+    def Write(self, frames):
+        """ Append the localised frames to the outputs, and their boxes to the online clustering """
+        for frameNum, frameData in frames.items():
+            self.json.Add(str(frameNum), frameData)
+            self.csvWriter.writerows(BoxesCsvRows(frameNum, frameData))
+            if self.clusterer is None:
+                continue
+            if self.clusterer.frameNum is not None and frameNum < self.clusterer.frameNum:
+                Count("Live.lateFrames")
+                continue #arrived after later frames were clustered
+            for box, coordinate in frameData[0]:
+                if len(coordinate) == 2:
+                    self.clusterer.Add(frameNum, coordinate[0], coordinate[1], int(box[0]))
+        self.json.Flush()
+        self.csvFile.flush()
+        if self.treeWriter is not None:
+            self.treeWriter.Flush()
+
+    def Close(self):
+        self.json.Close()
+        self.csvFile.close()
+        if self.clusterer is not None:
+            self.clusterer.Close()
+            self.treeWriter.Close()
+
+
+class LiveWatch:
+    """
+    Consolidate -> GeoLocaliseDrone -> GeoLocaliseBoxes (-> online Clustering) run frame by frame while the inference
+    writes its label files and the drone its subtitles. Every Poll() reads the new label files and subtitles records,
+    localises the frames whose telemetry is known and appends them to the outputs of outputFolder.
+    The latency of a frame goes from its label file being written (or the start of the watch) to its output being flushed.
+    """
+    def __init__(self, sourceFolder, predictionFolder, demFolder, camParams, outputFolder, fps=None, tileCatalog=None, indexWorkers=8,
+            maxOpenTiles=32, demCacheMB=256, projection='geopy', cameraLut=False, hThreshold=None, vThreshold=None, viewFrames=30):
+        self.sourceFolder = sourceFolder
+        self.camParams = camParams
+        self.outputFolder = outputFolder
+        self.fps = fps
+        self.cameraLut = cameraLut
+        self.clusterArgs = (hThreshold, vThreshold, viewFrames)
+        self.projectionEngine = GetProjectionEngine(projection)
+        self.labels = LabelWatcher(predictionFolder)
+        self.metadata = VideoMetadataProvider(DefaultCachePath(sourceFolder))
+        self.tileIndex, self.elevationService = OpenDem(demFolder, tileCatalog, indexWorkers, maxOpenTiles, demCacheMB)
+        self.sources = {}
+        self.cameraFiles = {}
+        self.videos = {}
+        self.startedAt = time.time()
+        self.latency = LatencyStats()
+
+    def _OpenVideo(self, videoName):
+        if videoName not in self.sources:
+            self.sources = FindSources(self.sourceFolder, ignoredSuffixes=[SRT_CACHE_SUFFIX])
+            if videoName not in self.sources:
+                raise Exception("The labels of "+videoName+" do not have a matching video in "+self.sourceFolder)
+        if videoName not in self.cameraFiles:
+            self.cameraFiles = FindCameraParams(self.camParams)
+        videoPath, srtPath, _ = self.sources[videoName]
+        metadata = self.metadata.Probe([videoPath])[videoPath]
+        #A video still being recorded may not be readable yet
+        fps = metadata["fps"] if metadata is not None else self.fps
+        if fps is None:
+            raise Exception("The frame rate of "+videoPath+" is unknown. Give it with --fps.")
+        cameraModel = LoadCameraModel(self.cameraFiles.get(videoName, os.path.join(self.camParams, videoName+".txt")), useLut=self.cameraLut)
+        print("Watching video ", videoName, " (", fps, " fps): ", srtPath)
+        return LiveVideo(videoName, srtPath, fps, cameraModel, self.outputFolder, *self.clusterArgs)
+
+    def Poll(self, final=False):
+        """ Process what arrived since the last call. Returns True when new label files or subtitles records were read """
+        arrived = self.labels.Poll()
+        for videoName, frameNum, boxes, writtenAt in arrived:
+            if videoName not in self.videos:
+                self.videos[videoName] = self._OpenVideo(videoName)
+            self.videos[videoName].pending[frameNum] = (boxes, max(writtenAt, self.startedAt))
+        records = 0
+        for video in self.videos.values():
+            with Span("SRT parsing"):
+                records += video.srtTail.Poll()
+            frames, arrivals = video.ReadyFrames(final)
+            if len(frames) > 0:
+                self._Localise(video, frames)
+                doneAt = time.time()
+                for arrivedAt in arrivals:
+                    self.latency.Add(doneAt-arrivedAt)
+        return len(arrived) > 0 or records > 0
+
+    def _Localise(self, video, frames):
+        frameKeys = [frameNum for frameNum, frameData in frames.items() if len(frameData[1]) > 1]
+        if len(frameKeys) > 0:
+            with Span("DEM lookup"):
+                ResolveHeights(frames, frameKeys, self.tileIndex, self.elevationService)
+        with Span("box projection"):
+            _, boxesLocated, framesWithoutSensor, boxesWithoutSensor = ProjectBoxes(frames, video.cameraModel, self.projectionEngine)
+        with Span("output writing"):
+            video.Write(frames)
+        Count("Live.frames", len(frames))
+        Count("Live.boxes", boxesLocated+boxesWithoutSensor)
+        Count("Live.boxesLocated", boxesLocated)
+        Count("Live.framesWithoutTelemetry", framesWithoutSensor)
+
+    def Close(self):
+        """ Localise the frames still waiting for their subtitles with what was read, and close the outputs """
+        self.Poll(final=True)
+        for video in self.videos.values():
+            video.Close()
+        self.labels.index.Save()
+
+
+def WatchPipeline(sourceFolder, predictionFolder, demFolder, camParams, outputFolder, pollInterval=0.5, idleTimeout=60.0, fps=None,
+        tileCatalog=None, indexWorkers=8, maxOpenTiles=32, demCacheMB=256, projection='geopy', cameraLut=False,
+        hThreshold=None, vThreshold=None, viewFrames=30):
+    """
+    Run a LiveWatch every pollInterval seconds until nothing arrived for idleTimeout seconds (or Ctrl+C).
+    The localised frames go to <outputFolder>/localisation_boxes, and the trees to <outputFolder>/clustering when the
+    thresholds are given. Returns the LatencyStats of the frames.
+    """
+    with Phase("Live"), ProfileStage("Live"):
+        watch = LiveWatch(sourceFolder, predictionFolder, demFolder, camParams, outputFolder, fps, tileCatalog, indexWorkers,
+            maxOpenTiles, demCacheMB, projection, cameraLut, hThreshold, vThreshold, viewFrames)
+        print("Watching ", predictionFolder, " every ", pollInterval, "s, until nothing arrives for ", idleTimeout, "s")
+        lastActivity = time.perf_counter()
+        lastReport = lastActivity
+        try:
+            while time.perf_counter()-lastActivity < idleTimeout:
+                if watch.Poll():
+                    lastActivity = time.perf_counter()
+                if time.perf_counter()-lastReport >= PROGRESS_INTERVAL:
+                    lastReport = time.perf_counter()
+                    print("Live: frame latency ", watch.latency.Describe())
+                time.sleep(pollInterval)
+        except KeyboardInterrupt:
+            print("Watch interrupted.")
+        watch.Close()
+    print("Live: frame latency ", watch.latency.Describe())
+    return watch.latency
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sourceFolder', type=str, default='/content/input/source/', help='Folder containing the video folder and srt subtitles folder')
+    parser.add_argument('--predictionFolder', type=str, default='/content/output/inference/', help='Folder where the prediction model is writing its label files')
+    parser.add_argument('--demFolder', type=str, default='/content/input/DEM/', help='Input folder containing all the GeoTIF images')
+    parser.add_argument('--camParams', type=str, default='/content/input/camParams/', help='Input folder containing all the videos camera parameter files')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/', help='Output folder, the localised frames go to localisation_boxes and the trees to clustering')
+    parser.add_argument('--pollInterval', type=float, default=0.5, help='Seconds between two checks of the label files and subtitles')
+    parser.add_argument('--idleTimeout', type=float, default=60.0, help='Stop after this many seconds without new label files or subtitles records')
+    parser.add_argument('--fps', type=float, default=None, help='Frame rate of the videos that cannot be probed yet (still being recorded)')
+    parser.add_argument('--tileCatalog', type=str, default=None, help='Path of the sidecar catalog of GeoTIF footprints (default: inside demFolder)')
+    parser.add_argument('--indexWorkers', type=int, default=8, help='Number of threads used to open new or changed GeoTIF files')
+    parser.add_argument('--maxOpenTiles', type=int, default=32, help='Maximum number of GeoTIF files kept open at the same time')
+    parser.add_argument('--demCacheMB', type=int, default=256, help='Size in MB of the cache of decoded GeoTIF blocks')
+    parser.add_argument('--projection', type=str, default='geopy', choices=list(PROJECTION_ENGINES), help='Engine used to project the bounding boxes from the drone position')
+    parser.add_argument('--cameraLut', action='store_true', help='Use cached per-resolution lookup tables for the angle of every pixel to the image centre')
+    parser.add_argument('--verticalThreshold', type=float, default=None, help='With --horizontalThreshold, cluster the boxes online into trees: north-south distance in metres of the same object')
+    parser.add_argument('--horizontalThreshold', type=float, default=None, help='With --verticalThreshold, cluster the boxes online into trees: east-west distance in metres of the same object')
+    parser.add_argument('--viewFrames', type=int, default=30, help='Number of frames whose boxes make up the field of view of the online clustering')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: live.metrics.json in outputFolder)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the watch are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    latency = WatchPipeline(args.sourceFolder, args.predictionFolder, args.demFolder, args.camParams, args.outputFolder,
+        args.pollInterval, args.idleTimeout, args.fps, args.tileCatalog, args.indexWorkers, args.maxOpenTiles, args.demCacheMB,
+        args.projection, args.cameraLut, args.horizontalThreshold, args.verticalThreshold, args.viewFrames)
+    WriteRunMetrics(args.metrics or os.path.join(args.outputFolder, "live.metrics.json"), "Live", args, {"frameLatency": latency.Summary()})
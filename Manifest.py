@@ -0,0 +1,115 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
+from Columnar import META_FILE
+from StageIO import OutputPaths
+from VideoPool import RunPerVideo, VideoFailures
+from Metrics import Count, PathSize
+
+MANIFEST_VERSION = 1
+MANIFEST_NAME = ".stageManifest"
+
+
+def FileFingerprint(path):
+    """ [size, mtime] of a file. Columnar folders are identified by their meta file, written last """
+    if os.path.isdir(path):
+        path = os.path.join(path, META_FILE)
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+def FileDigest(path):
+    with open(path, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+def DataDigest(data):
+    """ Digest of the JSON form of data, so a video gets the same digest in memory and once read back from its .json """
+    return hashlib.blake2b(json.dumps(data, ensure_ascii=False).encode('utf-8'), digest_size=16).hexdigest()
+
+def ArrayDigest(*arrays):
+    digest = hashlib.blake2b(digest_size=16)
+    for array in arrays:
+        digest.update((str(array.dtype)+str(array.shape)).encode('utf-8'))
+        digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def InputKey(*parts):
+    """ Key of the inputs and parameters of a video in a stage """
+    return hashlib.blake2b(json.dumps([MANIFEST_VERSION]+list(parts), sort_keys=True, default=str).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class StageManifest:
+    """
+    Input key and output fingerprints of every video written to the folder of a stage.
+    It is saved after every video, so an interrupted run resumes from the last finished one.
+    """
+    def __init__(self, outputFolder, stage):
+        self.path = os.path.join(outputFolder, MANIFEST_NAME)
+        self.stage = stage
+        self.videos = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+                if manifest.get("version") == MANIFEST_VERSION and manifest.get("stage") == stage:
+                    self.videos = manifest.get("videos", {})
+            except (OSError, ValueError):
+                print("WARNING: The manifest "+self.path+" could not be read. Every video will be processed.")
+
+    def IsCurrent(self, videoName, key, outputs):
+        entry = self.videos.get(videoName)
+        if entry is None or entry["key"] != key or sorted(entry["outputs"]) != sorted(outputs):
+            return False
+        try:
+            return all(FileFingerprint(path) == fingerprint for path, fingerprint in entry["outputs"].items())
+        except OSError:
+            return False
+
+    def Record(self, videoName, key, outputs):
+        self.videos[videoName] = {"key": key, "outputs": {path: FileFingerprint(path) for path in outputs}}
+        self.Save()
+
+    def Save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmpPath = self.path+".tmp"
+        with open(tmpPath, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "stage": self.stage, "videos": self.videos}, f, indent=1)
+        os.replace(tmpPath, self.path)
+
+
+def RunIncremental(stage, task, jobs, keyOf, outputFolder, outputFormat, loadOutput, workers=1, setup=None, setupArgs=(), force=False):
+    """
+    RunPerVideo skipping the videos whose key, keyOf(videoName), and outputs match the manifest of outputFolder.
+    Their result is read back with loadOutput(path) from the first output of the video, or is None without loadOutput.
+    Without outputFolder nothing is kept between runs and every video is processed.
+    """
+    if outputFolder is None:
+        return RunPerVideo(stage, task, jobs, workers, setup, setupArgs)
+    manifest = StageManifest(outputFolder, stage)
+    jobs = list(jobs)
+    keys = {}
+    results = {}
+    pending = []
+    for videoName, args in jobs:
+        keys[videoName] = keyOf(videoName)
+        outputs = OutputPaths(outputFolder, videoName, outputFormat)
+        if not force and manifest.IsCurrent(videoName, keys[videoName], outputs):
+            results[videoName] = loadOutput(outputs[0]) if loadOutput is not None else None
+        else:
+            pending.append((videoName, args))
+    print(stage, ": ", len(jobs)-len(pending), " video(s) up to date, ", len(pending), " to process")
+    Count(stage+".skippedVideos", len(jobs)-len(pending))
+
+    def RecordVideo(videoName, result):
+        outputs = OutputPaths(outputFolder, videoName, outputFormat)
+        manifest.Record(videoName, keys[videoName], outputs)
+        Count("bytesWritten", sum(PathSize(path) for path in outputs))
+
+    try:
+        results.update(RunPerVideo(stage, task, pending, workers, setup, setupArgs, onDone=RecordVideo))
+    except VideoFailures as e:
+        results.update(e.results)
+        e.results = OrderedDict((videoName, results[videoName]) for videoName, _ in jobs if videoName in results)
+        raise
+    return OrderedDict((videoName, results[videoName]) for videoName, _ in jobs)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import datetime
+from collections import deque
+from contextlib import contextmanager
+
+#Minimum seconds between two progress lines of the same task
+PROGRESS_INTERVAL = 5.0
+
+#Metrics of the running process, see CurrentMetrics()
+_current = None
+
+
+class RunMetrics:
+    """
+    Counters (frames, boxes, bytes, cache hits...) and wall time per phase of a run.
+    Metrics of the worker processes are merged into the ones of the main process with Merge().
+    """
+    def __init__(self):
+        self.counters = {}
+        self.phases = {}
+        self.startedAt = datetime.datetime.now().isoformat(timespec='seconds')
+
+    def Count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0)+amount
+
+    def AddTime(self, name, seconds, calls=1):
+        phase = self.phases.setdefault(name, {"seconds": 0.0, "calls": 0})
+        phase["seconds"] += seconds
+        phase["calls"] += calls
+
+    @contextmanager
+    def Phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.AddTime(name, time.perf_counter()-start)
+
+    def Snapshot(self):
+        return {"counters": dict(self.counters), "phases": {name: dict(phase) for name, phase in self.phases.items()}}
+
+    def Merge(self, snapshot):
+        for name, amount in snapshot["counters"].items():
+            self.Count(name, amount)
+        for name, phase in snapshot["phases"].items():
+            self.AddTime(name, phase["seconds"], phase["calls"])
+
+    def ToDict(self):
+        """ Counters and phases, with the throughput of every phase that has <phase>.frames/.boxes counters and the hit rate of every cache """
+        phases = {}
+        for name, phase in sorted(self.phases.items()):
+            phases[name] = dict(phase)
+            for unit in ("frames", "boxes"):
+                amount = self.counters.get(name+"."+unit)
+                if amount is not None and phase["seconds"] > 0:
+                    phases[name][unit+"PerSecond"] = amount/phase["seconds"]
+        hitRates = {}
+        for name, hits in self.counters.items():
+            if name.endswith(".hits"):
+                cache = name[:-len(".hits")]
+                lookups = hits+self.counters.get(cache+".misses", 0)
+                hitRates[cache] = hits/lookups if lookups > 0 else 0.0
+        return {"startedAt": self.startedAt, "phases": phases, "counters": dict(sorted(self.counters.items())), "hitRates": hitRates}
+
+    def Write(self, path, extra=None):
+        """ Write the metrics as JSON, replacing path atomically """
+        metrics = self.ToDict()
+        if extra is not None:
+            metrics.update(extra)
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        tmpPath = path+".tmp"
+        with open(tmpPath, 'w', encoding='utf-8') as f:
+            json.dump(metrics, f, indent=4, default=str)
+        os.replace(tmpPath, path)
+        return path
+
+    def PrintSummary(self):
+        metrics = self.ToDict()
+        print("Metrics:")
+        for name, phase in metrics["phases"].items():
+            rates = ", ".join(str(round(value, 1))+" "+key[:-len("PerSecond")]+"/s" for key, value in phase.items() if key.endswith("PerSecond"))
+            print("\t", name, ": ", round(phase["seconds"], 3), "s", (" ("+rates+")" if rates else ""))
+        for name, amount in metrics["counters"].items():
+            if not name.endswith((".hits", ".misses")):
+                print("\t", name, ": ", amount)
+        for cache, hitRate in metrics["hitRates"].items():
+            print("\t", cache, " hit rate: ", round(hitRate*100, 1), "%")
+
+
+def CurrentMetrics():
+    global _current
+    if _current is None:
+        _current = RunMetrics()
+    return _current
+
+def TakeMetrics():
+    """ Snapshot of the metrics of this process, which start again from zero. Used by the worker processes after every video """
+    global _current
+    snapshot = CurrentMetrics().Snapshot()
+    _current = RunMetrics()
+    return snapshot
+
+def Count(name, amount=1):
+    CurrentMetrics().Count(name, amount)
+
+def Phase(name):
+    return CurrentMetrics().Phase(name)
+
+def PathSize(path):
+    """ Size in bytes of a file, or of the files of a folder (columnar outputs) """
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for folder, _, files in os.walk(path):
+        for fileName in files:
+            total += os.path.getsize(os.path.join(folder, fileName))
+    return total
+
+def DefaultMetricsPath(outputFolder):
+    """ <outputFolder>.metrics.json, next to the folder so the next stage does not take it for a video """
+    return os.path.normpath(outputFolder)+".metrics.json"
+
+def WriteRunMetrics(path, stage, arguments=None, sections=None):
+    """ Print the summary of the metrics of the run and write them to path, with the sections {name: dict} added at the top level """
+    metrics = CurrentMetrics()
+    metrics.PrintSummary()
+    extra = {"stage": stage, "finishedAt": datetime.datetime.now().isoformat(timespec='seconds')}
+    if arguments is not None:
+        extra["arguments"] = vars(arguments) if hasattr(arguments, "__dict__") else arguments
+    if sections is not None:
+        extra.update(sections)
+    print("Metrics >> ", metrics.Write(path, extra))
+
+
+class Progress:
+    """ Progress of a task, printed at most every PROGRESS_INTERVAL seconds (and when it ends) """
+    def __init__(self, label, total, interval=None):
+        self.label = label
+        self.total = total
+        self.done = 0
+        self.interval = PROGRESS_INTERVAL if interval is None else interval
+        self.start = time.perf_counter()
+        self.lastReport = self.start
+
+    def Update(self, amount=1):
+        self.done += amount
+        now = time.perf_counter()
+        if now-self.lastReport >= self.interval or self.done >= self.total:
+            self.lastReport = now
+            percent = round(self.done/self.total*100, 1) if self.total > 0 else 100.0
+            rate = self.done/(now-self.start) if now > self.start else 0.0
+            print("[", percent, "%] ", self.label, ": ", self.done, " of ", self.total, " (", round(rate, 1), "/s)")
+
+
+class LatencyStats:
+    """
+    Latencies in seconds of the items of a task (frames, trees...), summarised as percentiles.
+    With maxSamples only the last ones are kept, for the processes that run for days.
+    """
+    def __init__(self, maxSamples=None):
+        self.samples = deque(maxlen=maxSamples)
+
+    def Add(self, seconds):
+        self.samples.append(seconds)
+
+    def Summary(self):
+        """ {count, mean, p50, p95, max} in seconds, nearest-rank percentiles """
+        if len(self.samples) == 0:
+            return {"count": 0}
+        ordered = sorted(self.samples)
+        def Percentile(percent):
+            return ordered[max(0, min(len(ordered)-1, int(round(percent/100.0*len(ordered)))-1))]
+        return {"count": len(ordered), "mean": sum(ordered)/len(ordered), "p50": Percentile(50), "p95": Percentile(95), "max": ordered[-1]}
+
+    def Describe(self):
+        summary = self.Summary()
+        if summary["count"] == 0:
+            return "no samples"
+        return ", ".join(key+" "+str(round(summary[key], 3))+"s" for key in ("mean", "p50", "p95", "max"))+" over "+str(summary["count"])
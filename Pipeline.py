@@ -0,0 +1,158 @@
+import argparse
+import os
+import sys
+from collections import OrderedDict
+from Consolidate import Consolidate
+from GeoLocaliseDrone import GeoLocaliseDrone
+from GeoLocaliseBoxes import GeoLocaliseBoxes
+from Clustering import Clustering, ClusteringDetections
+from StageIO import ListVideoInputs
+from Metrics import Phase, WriteRunMetrics
+from Profiling import EnableProfiling
+from Geodesy import PROJECTION_ENGINES
+from Columnar import OUTPUT_FORMATS
+from GeoExport import EXPORT_FORMATS
+from VideoPool import VideoFailures
+
+#Sub folders of outputFolder, one per stage
+STAGE_FOLDERS = {
+    "consolidate": "consolidation",
+    "drone": "localisation_drone",
+    "boxes": "localisation_boxes",
+    "clustering": "clustering",
+}
+
+
+def StageOutput(outputFolder, stage, writeIntermediate):
+    if stage != "clustering" and not writeIntermediate:
+        return None
+    return os.path.join(outputFolder, STAGE_FOLDERS[stage])
+
+def RunStage(failures, stage, *args, **kwargs):
+    """ stage(*args, **kwargs). Its failed videos are added to failures and the pipeline goes on with the videos that succeeded """
+    try:
+        return stage(*args, **kwargs)
+    except VideoFailures as e:
+        print("ERROR: ", e, ". The next stages go on with the other videos")
+        failures.update(e.failures)
+        return e.results
+
+def StageInputs(stageFolder, failures):
+    """ ListVideoInputs of stageFolder without the failed videos, whose files may be left from a previous run """
+    return OrderedDict((videoName, path) for videoName, path in ListVideoInputs(stageFolder).items() if videoName not in failures)
+
+def RunPipeline(sourceFolder, predictionFolder, demFolder, camParams, outputFolder, hThreshold, vThreshold,
+        writeIntermediate=False, srtCache=True, labelArchive=None, labelWorkers=16, probeWorkers=8,
+        tileCatalog=None, indexWorkers=8, maxOpenTiles=32, demCacheMB=256, demMosaic=None, batch=True,
+        projection='geopy', cameraLut=False, outputFormat='json', workers=1, force=False, online=False, viewFrames=30,
+        exportFormats=()):
+    """
+    Consolidate -> GeoLocaliseDrone -> GeoLocaliseBoxes -> Clustering in a single process.
+    Every stage works on the in-memory result of the previous one, intermediate files are only written on request.
+    With workers > 1 every stage sends the videos to a pool of processes.
+    Stages with an output folder only process the videos whose inputs changed since the last run, unless force.
+    exportFormats ("gpkg", "parquet") also writes the trees, and the boxes when their folder is written, as spatially indexed point layers.
+    A video failing in a stage is left out of the next ones, the others go through every stage. The failures are then raised
+    together as VideoFailures, with the trees of the other videos as results.
+    Returns {videoName: [trees]}.
+    """
+    failures = OrderedDict()
+    videosList = RunStage(failures, Consolidate, sourceFolder, predictionFolder, StageOutput(outputFolder, "consolidate", writeIntermediate),
+        srtCache=srtCache, labelArchive=labelArchive, labelWorkers=labelWorkers, outputFormat=outputFormat, workers=workers, force=force, probeWorkers=probeWorkers)
+    videosList = RunStage(failures, GeoLocaliseDrone, videosList, demFolder, StageOutput(outputFolder, "drone", writeIntermediate),
+        tileCatalog=tileCatalog, indexWorkers=indexWorkers, maxOpenTiles=maxOpenTiles, demCacheMB=demCacheMB, batch=batch, outputFormat=outputFormat, workers=workers, force=force,
+        demMosaic=demMosaic)
+    videosList = RunStage(failures, GeoLocaliseBoxes, videosList, camParams, StageOutput(outputFolder, "boxes", writeIntermediate),
+        projection=projection, cameraLut=cameraLut, outputFormat=outputFormat, workers=workers, force=force, exportFormats=exportFormats)
+    trees = RunStage(failures, Clustering, videosList, hThreshold, vThreshold, StageOutput(outputFolder, "clustering", writeIntermediate), outputFormat, workers, force,
+        online=online, viewFrames=viewFrames, exportFormats=exportFormats)
+    if len(failures) > 0:
+        raise VideoFailures("Pipeline", failures, trees)
+    return trees
+
+
+def RunPipelineStream(sourceFolder, predictionFolder, demFolder, camParams, outputFolder, hThreshold, vThreshold,
+        srtCache=True, labelArchive=None, labelWorkers=16, probeWorkers=8, tileCatalog=None, indexWorkers=8, maxOpenTiles=32, demCacheMB=256, demMosaic=None,
+        batch=True, projection='geopy', cameraLut=False, outputFormat='json', workers=1, force=False, online=False, viewFrames=30,
+        exportFormats=()):
+    """
+    RunPipeline keeping a single video in memory at a time (per process).
+    Every stage reads its videos one by one from the folder written by the previous stage, so the intermediate files are always written.
+    Nothing is returned, the trees are in the clustering folder. Failed videos are left out of the next stages and raised
+    together as VideoFailures at the end, like RunPipeline does.
+    """
+    stageFolders = {stage: StageOutput(outputFolder, stage, True) for stage in STAGE_FOLDERS}
+    failures = OrderedDict()
+    RunStage(failures, Consolidate, sourceFolder, predictionFolder, stageFolders["consolidate"], srtCache=srtCache, labelArchive=labelArchive,
+        labelWorkers=labelWorkers, outputFormat=outputFormat, workers=workers, force=force, stream=True, probeWorkers=probeWorkers)
+    RunStage(failures, GeoLocaliseDrone, StageInputs(stageFolders["consolidate"], failures), demFolder, stageFolders["drone"], tileCatalog=tileCatalog, indexWorkers=indexWorkers,
+        maxOpenTiles=maxOpenTiles, demCacheMB=demCacheMB, batch=batch, outputFormat=outputFormat, workers=workers, force=force, stream=True, demMosaic=demMosaic)
+    RunStage(failures, GeoLocaliseBoxes, StageInputs(stageFolders["drone"], failures), camParams, stageFolders["boxes"], projection=projection, cameraLut=cameraLut,
+        outputFormat=outputFormat, workers=workers, force=force, stream=True, exportFormats=exportFormats)
+    RunStage(failures, ClusteringDetections, StageInputs(stageFolders["boxes"], failures), hThreshold, vThreshold, stageFolders["clustering"], outputFormat, workers, force, stream=True,
+        online=online, viewFrames=viewFrames, exportFormats=exportFormats)
+    if len(failures) > 0:
+        raise VideoFailures("Pipeline", failures, None)
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sourceFolder', type=str, default='/content/input/source/', help='Folder containing the video folder and srt subtitles folder')
+    parser.add_argument('--predictionFolder', type=str, default='/content/output/inference/', help='Output folder for the prediction model')
+    parser.add_argument('--demFolder', type=str, default='/content/input/DEM/', help='Input folder containing all the GeoTIF images')
+    parser.add_argument('--camParams', type=str, default='/content/input/camParams/', help='Input folder containing all the videos camera parameter files')
+    parser.add_argument('--outputFolder', type=str, default='/content/output/', help='Output folder, the results of every stage go to a sub folder')
+    parser.add_argument('--verticalThreshold', type=float, default=2.0, help='north-south distance in metres in which the variation of the bounding box is still considered of the same object')
+    parser.add_argument('--horizontalThreshold', type=float, default=2.0, help='east-west distance in metres in which the variation of the bounding box is still considered of the same object')
+    parser.add_argument('--writeIntermediate', action='store_true', help='Also write the .json and .csv files of the consolidation and localisation stages')
+    parser.add_argument('--noSrtCache', action='store_true', help='Always parse the .srt files instead of reusing the .npz telemetry cache written next to them')
+    parser.add_argument('--labelArchive', type=str, default=None, help='Packed .npz archive of the prediction labels. Read instead of predictionFolder when it exists, written from predictionFolder otherwise')
+    parser.add_argument('--labelWorkers', type=int, default=16, help='Number of threads used to read the prediction label files')
+    parser.add_argument('--probeWorkers', type=int, default=8, help='Number of threads used to probe the videos missing from the metadata cache')
+    parser.add_argument('--tileCatalog', type=str, default=None, help='Path of the sidecar catalog of GeoTIF footprints (default: inside demFolder)')
+    parser.add_argument('--indexWorkers', type=int, default=8, help='Number of threads used to open new or changed GeoTIF files')
+    parser.add_argument('--maxOpenTiles', type=int, default=32, help='Maximum number of GeoTIF files kept open at the same time')
+    parser.add_argument('--demCacheMB', type=int, default=256, help='Size in MB of the cache of decoded GeoTIF blocks')
+    parser.add_argument('--demMosaic', type=str, default=None, help='Path (without extension) of the memory-mapped mosaic of the DEM tiles under the flights, built when missing or outdated and read instead of the tiles')
+    parser.add_argument('--noBatch', action='store_true', help='Resolve the terrain height frame by frame instead of once per video')
+    parser.add_argument('--projection', type=str, default='geopy', choices=list(PROJECTION_ENGINES), help='Engine used to project the bounding boxes from the drone position')
+    parser.add_argument('--cameraLut', action='store_true', help='Use cached per-resolution lookup tables for the angle of every pixel to the image centre')
+    parser.add_argument('--online', action='store_true', help='Cluster the boxes in frame order and write every tree as soon as the drone has flown away from it')
+    parser.add_argument('--viewFrames', type=int, default=30, help='With --online, number of frames whose boxes make up the field of view')
+    parser.add_argument('--outputFormat', type=str, default='json', choices=OUTPUT_FORMATS, help='Format of the results: json (.json and .csv), columnar (memory-mappable .npy columns) or both')
+    parser.add_argument('--export', type=str, action='append', default=[], choices=EXPORT_FORMATS, help='Also write the trees (and the boxes with --writeIntermediate or --stream) as point layers with a spatial index for GIS tools: gpkg (GeoPackage) or parquet (GeoParquet, needs pyarrow). Can be repeated')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes working on different videos at the same time')
+    parser.add_argument('--force', action='store_true', help='Process every video again, even the ones whose inputs did not change since the last run')
+    parser.add_argument('--stream', action='store_true', help='Keep a single video in memory at a time (per process). Implies --writeIntermediate')
+    parser.add_argument('--metrics', type=str, default=None, help='Path of the metrics .json of the run (default: pipeline.metrics.json in outputFolder)')
+    parser.add_argument('--profile', type=str, default=None, help='Folder where the cProfile .pstats, the collapsed stacks (flamegraph) and the span timings of the stage and of every video are written')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    print(args)
+    if args.profile is not None:
+        EnableProfiling(args.profile)
+    exitCode = 0
+    with Phase("Pipeline"):
+        try:
+            if args.stream:
+                RunPipelineStream(args.sourceFolder, args.predictionFolder, args.demFolder, args.camParams, args.outputFolder,
+                    args.horizontalThreshold, args.verticalThreshold, srtCache=not args.noSrtCache, labelArchive=args.labelArchive, labelWorkers=args.labelWorkers, probeWorkers=args.probeWorkers,
+                    tileCatalog=args.tileCatalog, indexWorkers=args.indexWorkers, maxOpenTiles=args.maxOpenTiles, demCacheMB=args.demCacheMB, demMosaic=args.demMosaic,
+                    batch=not args.noBatch, projection=args.projection, cameraLut=args.cameraLut, outputFormat=args.outputFormat, workers=args.workers, force=args.force,
+                    online=args.online, viewFrames=args.viewFrames, exportFormats=args.export)
+            else:
+                RunPipeline(args.sourceFolder, args.predictionFolder, args.demFolder, args.camParams, args.outputFolder,
+                    args.horizontalThreshold, args.verticalThreshold, writeIntermediate=args.writeIntermediate,
+                    srtCache=not args.noSrtCache, labelArchive=args.labelArchive, labelWorkers=args.labelWorkers, probeWorkers=args.probeWorkers,
+                    tileCatalog=args.tileCatalog, indexWorkers=args.indexWorkers, maxOpenTiles=args.maxOpenTiles, demCacheMB=args.demCacheMB, demMosaic=args.demMosaic,
+                    batch=not args.noBatch, projection=args.projection, cameraLut=args.cameraLut, outputFormat=args.outputFormat, workers=args.workers, force=args.force,
+                    online=args.online, viewFrames=args.viewFrames, exportFormats=args.export)
+        except VideoFailures as e:
+            #The other videos went through every stage
+            print("ERROR: ", e)
+            exitCode = 1
+    WriteRunMetrics(args.metrics or os.path.join(args.outputFolder, "pipeline.metrics.json"), "Pipeline", args)
+    sys.exit(exitCode)
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+
+#Seconds between two stack samples of the profiled thread
+SAMPLE_INTERVAL = 0.005
+
+_profileFolder = None
+#Open profiles of this process, only the last one is recording
+_profiles = []
+#(name, depth) of the open spans, replaced (never modified) so the sampler can read it at any time
+_spans = ()
+_sampler = None
+#Profiles of the videos of every stage, merged into the profile of the stage when it ends
+_videoProfiles = {}
+_NO_SPAN = nullcontext()
+
+
+def EnableProfiling(profileFolder):
+    """ Profile the stages and videos of this process into profileFolder. Without it every hook is a no-op """
+    global _profileFolder, _sampler
+    _profileFolder = profileFolder
+    os.makedirs(profileFolder, exist_ok=True)
+    if _sampler is None:
+        _sampler = threading.Thread(target=_Sample, name="ProfilingSampler", daemon=True)
+        _sampler.start()
+
+def ProfilingFolder():
+    return _profileFolder
+
+
+class _Profile:
+    """ cProfile, collapsed stack samples and span timings of a section of the run """
+    def __init__(self, path):
+        self.path = path
+        self.profiler = cProfile.Profile()
+        self.stacks = Counter()
+        self.spans = {}
+        self.threadId = threading.get_ident()
+
+    def Write(self, included=()):
+        """
+        <path>.pstats, <path>.collapsed (flamegraph.pl / speedscope input) and <path>.spans.json,
+        adding up the profiles already written to the paths of included
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        stats = pstats.Stats(self.profiler)
+        stacks = Counter(self.stacks)
+        for path in included:
+            stats.add(path+".pstats")
+            with open(path+".collapsed", 'r', encoding='utf-8') as f:
+                for line in f:
+                    stack, _, count = line.rstrip("\n").rpartition(" ")
+                    stacks[stack] += int(count)
+            with open(path+".spans.json", 'r', encoding='utf-8') as f:
+                for name, span in json.load(f).items():
+                    self.AddSpan(name, span["seconds"], span["calls"])
+        stats.dump_stats(self.path+".pstats")
+        with open(self.path+".collapsed", 'w', encoding='utf-8') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(stack+" "+str(count)+"\n")
+        with open(self.path+".spans.json", 'w', encoding='utf-8') as f:
+            json.dump(self.spans, f, indent=4)
+
+    def AddSpan(self, name, seconds, calls=1):
+        span = self.spans.setdefault(name, {"seconds": 0.0, "calls": 0})
+        span["seconds"] += seconds
+        span["calls"] += calls
+
+
+def _FrameName(frame):
+    code = frame.f_code
+    return code.co_name+" ("+os.path.basename(code.co_filename)+":"+str(code.co_firstlineno)+")"
+
+def _Sample():
+    while True:
+        time.sleep(SAMPLE_INTERVAL)
+        profiles = _profiles
+        if len(profiles) == 0:
+            continue
+        profile = profiles[-1]
+        frame = sys._current_frames().get(profile.threadId)
+        names = []
+        while frame is not None:
+            names.append(_FrameName(frame))
+            frame = frame.f_back
+        names.reverse()
+        #Spans are shown as frames at the depth they were opened
+        for name, depth in reversed(_spans):
+            names.insert(min(depth, len(names)), "[span] "+name)
+        profile.stacks[";".join(names)] += 1
+
+def _StackDepth(frame):
+    depth = 0
+    while frame is not None:
+        depth += 1
+        frame = frame.f_back
+    return depth
+
+
+@contextmanager
+def _Section(path):
+    global _profiles
+    profile = _Profile(path)
+    paused = _profiles[-1] if len(_profiles) > 0 else None
+    if paused is not None:
+        paused.profiler.disable()
+    _profiles = _profiles+[profile]
+    profile.profiler.enable()
+    try:
+        yield profile
+    finally:
+        profile.profiler.disable()
+        _profiles = _profiles[:-1]
+        if paused is not None:
+            paused.profiler.enable()
+
+def ProfileVideo(stage, videoName):
+    """ Profile of the processing of a video in <profileFolder>/<stage>/<videoName>.* """
+    if _profileFolder is None:
+        return _NO_SPAN
+    return _ProfileVideo(stage, videoName)
+
+@contextmanager
+def _ProfileVideo(stage, videoName):
+    profile = None
+    try:
+        with _Section(os.path.join(_profileFolder, stage, videoName)) as profile:
+            yield
+    finally:
+        #Failed videos are profiled too
+        profile.Write()
+
+def RecordVideoProfile(stage, videoName):
+    """ Called in the main process when a video of stage is done, wherever it was profiled """
+    if _profileFolder is not None:
+        _videoProfiles.setdefault(stage, []).append(os.path.join(_profileFolder, stage, videoName))
+
+def _Call(function, *args):
+    return function(*args)
+
+def ProfileCalls(stage, name):
+    """
+    Context manager yielding run(function, *args), which profiles the call on the thread running it into
+    <profileFolder>/<stage>/<name>.*, included in the profile of the stage. cProfile only records the thread that enables it:
+    this is how the work a service hands to its worker thread is profiled. The calls must not overlap
+    """
+    if _profileFolder is None:
+        return nullcontext(_Call)
+    return _ProfileCalls(stage, name)
+
+@contextmanager
+def _ProfileCalls(stage, name):
+    profile = _Profile(os.path.join(_profileFolder, stage, name))
+
+    def Run(function, *args):
+        global _profiles
+        try:
+            profile.profiler.enable()
+        except ValueError:
+            #Python 3.12+: a single profiler records every thread, the one of the stage already sees this call
+            return function(*args)
+        profile.threadId = threading.get_ident()
+        _profiles = _profiles+[profile]
+        try:
+            return function(*args)
+        finally:
+            profile.profiler.disable()
+            _profiles = [other for other in _profiles if other is not profile]
+
+    try:
+        yield Run
+    finally:
+        profile.Write()
+        RecordVideoProfile(stage, name)
+
+def ProfileStage(stage):
+    """ Profile of a whole stage in <profileFolder>/<stage>.*, including the profiles of its videos """
+    if _profileFolder is None:
+        return _NO_SPAN
+    return _ProfileStage(stage)
+
+@contextmanager
+def _ProfileStage(stage):
+    _videoProfiles[stage] = []
+    with _Section(os.path.join(_profileFolder, stage)) as profile:
+        yield
+    profile.Write([path for path in _videoProfiles.pop(stage, []) if os.path.isfile(path+".spans.json")])
+    print("Profile >> ", profile.path+".pstats")
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global _spans
+        _spans = _spans+((self.name, _StackDepth(sys._getframe(1))),)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _spans
+        seconds = time.perf_counter()-self.start
+        _spans = _spans[:-1]
+        if len(_profiles) > 0:
+            _profiles[-1].AddSpan(self.name, seconds)
+        return False
+
+def Span(name):
+    """ Named section of the hot path. A shared no-op context manager when profiling is disabled """
+    if _profileFolder is None:
+        return _NO_SPAN
+    return _Span(name)
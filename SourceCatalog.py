@@ -0,0 +1,166 @@
+import os
+import json
+import time
+from Metrics import Count
+
+INDEX_VERSION = 1
+INDEX_SUFFIX = ".sourceCatalog.json"
+#Directories modified less than this before the scan are listed again next time: their mtime may not have ticked yet
+MTIME_SLACK_NS = 2*10**9
+
+
+def ScanEntries(dirName, extension):
+    """ Recursive listing of the os.DirEntry of the files of dirName ending with extension, using os.scandir """
+    found = []
+    pending = [dirName]
+    while pending:
+        current = pending.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    pending.append(entry.path)
+                elif entry.name.endswith(extension):
+                    found.append(entry)
+    return found
+
+def ScanFiles(dirName, extension):
+    """ Recursive listing of the files of dirName ending with extension, using os.scandir """
+    return [entry.path for entry in ScanEntries(dirName, extension)]
+
+def IndexPath(root):
+    """ <root>.sourceCatalog.json, next to the folder so writing it does not change the mtime of the folder """
+    return os.path.normpath(root)+INDEX_SUFFIX
+
+
+class FolderIndex:
+    """
+    Files and sub folders of every directory under root, stored in IndexPath(root).
+    Refresh() only lists again the directories whose mtime changed, the others cost a single stat.
+    """
+    def __init__(self, root):
+        self.root = root
+        self.path = IndexPath(root)
+        self.dirs = {}
+        #{relDir: [names]} of the files that the last Refresh() found in the directories it listed again
+        self.added = {}
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    index = json.load(f)
+                if index.get("version") == INDEX_VERSION:
+                    self.dirs = index.get("dirs", {})
+            except (OSError, ValueError):
+                print("WARNING: The source catalog "+self.path+" could not be read. "+self.root+" will be scanned again.")
+
+    def Refresh(self):
+        """ Bring the index up to date with the disk. Returns True when something changed """
+        scanStart = time.time_ns()
+        dirs = {}
+        self.added = {}
+        pending = [""]
+        while pending:
+            relDir = pending.pop()
+            dirPath = os.path.join(self.root, relDir) if relDir else self.root
+            mtime = os.stat(dirPath).st_mtime_ns
+            entry = self.dirs.get(relDir)
+            if entry is not None and entry["mtime"] == mtime:
+                Count("sourceCatalog.hits")
+            else:
+                Count("sourceCatalog.misses")
+                files = []
+                subDirs = []
+                with os.scandir(dirPath) as entries:
+                    for dirEntry in entries:
+                        if dirEntry.is_dir():
+                            subDirs.append(dirEntry.name)
+                        else:
+                            files.append(dirEntry.name)
+                previous = self.dirs.get(relDir)
+                added = set(files).difference(previous["files"]) if previous is not None else files
+                if len(added) > 0:
+                    self.added[relDir] = sorted(added)
+                entry = {"mtime": mtime if mtime < scanStart-MTIME_SLACK_NS else None, "files": sorted(files), "dirs": sorted(subDirs)}
+            dirs[relDir] = entry
+            pending.extend(relDir+"/"+name if relDir else name for name in entry["dirs"])
+        changed = dirs != self.dirs
+        self.dirs = dirs
+        return changed
+
+    def Save(self):
+        tmpPath = self.path+".tmp"
+        try:
+            with open(tmpPath, 'w', encoding='utf-8') as f:
+                json.dump({"version": INDEX_VERSION, "root": os.path.abspath(self.root), "dirs": self.dirs}, f, ensure_ascii=False)
+            os.replace(tmpPath, self.path)
+        except OSError as e:
+            print("WARNING: The source catalog "+self.path+" could not be written ("+str(e)+"). "+self.root+" will be scanned again next time.")
+
+    def Files(self, extension=None, subFolder=None):
+        """ Sorted paths of the files under root (or root/subFolder) ending with extension """
+        prefix = subFolder.strip("/\\").replace("\\", "/") if subFolder else ""
+        if prefix and prefix not in self.dirs:
+            raise FileNotFoundError("The folder "+os.path.join(self.root, subFolder)+" does not exist.")
+        found = []
+        for relDir, entry in self.dirs.items():
+            if prefix and relDir != prefix and not relDir.startswith(prefix+"/"):
+                continue
+            dirPath = self._DirPath(relDir)
+            found.extend(os.path.join(dirPath, name) for name in entry["files"] if extension is None or name.endswith(extension))
+        return sorted(found)
+
+    def Added(self, extension=None):
+        """ Sorted paths of the files ending with extension that appeared since the previous Refresh() """
+        found = []
+        for relDir, names in self.added.items():
+            dirPath = self._DirPath(relDir)
+            found.extend(os.path.join(dirPath, name) for name in names if extension is None or name.endswith(extension))
+        return sorted(found)
+
+    def _DirPath(self, relDir):
+        return os.path.join(self.root, *relDir.split("/")) if relDir else self.root
+
+
+def OpenIndex(root):
+    """ FolderIndex of root, refreshed and saved """
+    index = FolderIndex(root)
+    if index.Refresh() or not os.path.isfile(index.path):
+        index.Save()
+    return index
+
+def ListFiles(root, extension=None):
+    """ Sorted paths of the files under root ending with extension, through the source catalog of root """
+    files = OpenIndex(root).Files(extension)
+    print(len(files), " file(s) found in ", root)
+    return files
+
+
+def FindSources(sourceFolder, ignoredSuffixes=()):
+    """
+    Videos of sourceFolder/videos with their subtitles in sourceFolder/subtitles.
+    Returns {objectName: [videoPath, subtitlesPath, {}]}. Files ending with ignoredSuffixes are not reported.
+    """
+    index = OpenIndex(sourceFolder)
+    dictSubt = {}
+    for subtPath in index.Files(subFolder="subtitles"):
+        if subtPath.endswith(tuple(ignoredSuffixes)):
+            continue
+        split = os.path.splitext(subtPath)
+        tmpKey = os.path.basename(split[0])
+        if split[1] == ".srt":
+            dictSubt[tmpKey] = subtPath
+        else :
+            print("WARNING: The file "+subtPath+" found is not an .srt subtitles file! This file has been omited.")
+    dictFiles = {}
+    for vidPath in index.Files(subFolder="videos"):
+        tmpKey = os.path.basename(os.path.splitext(vidPath)[0])
+        if tmpKey in dictSubt:
+            #Create a dictionary {objectName: [videoPath, subtitlesPath, {FrameNum:[Labels]}]}
+            dictFiles[tmpKey] = [vidPath, dictSubt[tmpKey], {}]
+        else:
+            raise Exception("The file "+vidPath+" does not have a matching subtitles file (.srt).")
+    print(str(len(dictFiles))+" object(s) were found as source file(s)")
+    return dictFiles
+
+def FindCameraParams(camParams):
+    """ {videoName: path} of the camera parameter files (<videoName>.txt) under camParams """
+    return {os.path.splitext(os.path.basename(path))[0]: path for path in ListFiles(camParams, ".txt")}
@@ -0,0 +1,260 @@
+import os
+import bisect
+import numpy as np
+from Metrics import Count
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".telemetry.npz"
+
+
+def timestamp_to_miliseconds(line):
+    timeValues = line.split("-->")
+    startValuesTxt = timeValues[0].strip().replace(",",":").split(":")
+    endValuesTxt = timeValues[1].strip().replace(",",":").split(":")
+    startValuesList = list(map(int, startValuesTxt))
+    endValuesList = list(map(int, endValuesTxt))
+    startValueMs = (startValuesList[0] * 60 * 60 * 1000) + (startValuesList[1] * 60000) + (startValuesList[2] * 1000) + startValuesList[3]
+    endValueMs = (endValuesList[0] * 60 * 60 * 1000) + (endValuesList[1] * 60000) + (endValuesList[2] * 1000) + endValuesList[3]
+    return startValueMs, endValueMs
+
+
+class _SrtRecordParser:
+    """ Records of a DJI subtitles file fed line by line. Records are 4 lines long: index, timestamps, sensor values and a blank line """
+    def __init__(self):
+        self.startMs = 0
+        self.endMs = 0
+        self.l = 0
+
+    def Feed(self, line_):
+        """ (startMs, endMs, {sensor:value}) once the sensor line of a record is fed, None otherwise """
+        record = None
+        if self.l == 1:
+            self.startMs, self.endMs = timestamp_to_miliseconds(line_)
+        elif self.l == 2:
+            varDict = {}
+            for var in line_.split(" "):
+                sd = var.split(":")
+                if(len(sd)==2):
+                    varDict[sd[0]] = float(sd[1])
+            record = (self.startMs, self.endMs, varDict)
+            self.startMs = 0
+            self.endMs = 0
+        self.l+=1
+        if(self.l==4):
+            self.l=0
+        return record
+
+def IterSrtRecords(srtPath):
+    """ Stream the records of a DJI subtitles file as (startMs, endMs, {sensor:value}) """
+    parser = _SrtRecordParser()
+    with open(srtPath, 'r', encoding='utf-8') as f:
+        for line_ in f:
+            record = parser.Feed(line_)
+            if record is not None:
+                yield record
+
+
+class SrtTelemetry:
+    """
+    Columnar telemetry of a subtitles file: sorted start/end arrays in ms and one float column per sensor key.
+    Values missing from a record are stored as NaN.
+    """
+    def __init__(self, starts, ends, keys, values):
+        self.starts = starts
+        self.ends = ends
+        self.keys = list(keys)
+        self.values = values
+
+    def __len__(self):
+        return self.starts.shape[0]
+
+    def Column(self, key):
+        return self.values[self.keys.index(key)]
+
+    def Record(self, index):
+        record = {}
+        for key, value in zip(self.keys, self.values[:, index].tolist()):
+            if value == value: #skip NaN
+                record[key] = value
+        return record
+
+    @classmethod
+    def FromRecords(cls, records):
+        #Same start: the last record wins, as when filling a dict keyed by start
+        byStart = {}
+        keyOrder = {}
+        for startMs, endMs, varDict in records:
+            byStart[startMs] = (endMs, varDict)
+            for key in varDict:
+                keyOrder.setdefault(key, len(keyOrder))
+        startList = sorted(byStart)
+        keys = list(keyOrder)
+        starts = np.array(startList, dtype=np.float64)
+        ends = np.array([byStart[start][0] for start in startList], dtype=np.float64)
+        values = np.full((len(keys), len(startList)), np.nan, dtype=np.float64)
+        for i, start in enumerate(startList):
+            for key, value in byStart[start][1].items():
+                values[keyOrder[key], i] = value
+        return cls(starts, ends, keys, values)
+
+    def Save(self, cachePath, srtSize, srtMtime):
+        tmpPath = cachePath+".tmp.npz"
+        np.savez(tmpPath, version=np.int64(CACHE_VERSION), srtSize=np.int64(srtSize), srtMtime=np.int64(srtMtime),
+            starts=self.starts, ends=self.ends, keys=np.array(self.keys, dtype=str), values=self.values)
+        os.replace(tmpPath, cachePath)
+
+    @classmethod
+    def Load(cls, cachePath, srtSize, srtMtime):
+        """ Cached telemetry, or None when the cache is missing or does not belong to this version of the .srt """
+        if not os.path.isfile(cachePath):
+            return None
+        try:
+            with np.load(cachePath, allow_pickle=False) as cached:
+                if int(cached["version"]) != CACHE_VERSION or int(cached["srtSize"]) != srtSize or int(cached["srtMtime"]) != srtMtime:
+                    return None
+                return cls(cached["starts"], cached["ends"], cached["keys"].tolist(), cached["values"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+
+def LoadSrtTelemetry(srtPath, useCache=True):
+    """ Parse a subtitles file, reusing the .npz cache next to it while the .srt does not change """
+    stat = os.stat(srtPath)
+    cachePath = srtPath+CACHE_SUFFIX
+    if useCache:
+        telemetry = SrtTelemetry.Load(cachePath, stat.st_size, stat.st_mtime_ns)
+        if telemetry is not None:
+            Count("srtCache.hits")
+            Count("bytesRead", os.path.getsize(cachePath))
+            return telemetry
+        Count("srtCache.misses")
+    telemetry = SrtTelemetry.FromRecords(IterSrtRecords(srtPath))
+    Count("bytesRead", stat.st_size)
+    if useCache:
+        try:
+            telemetry.Save(cachePath, stat.st_size, stat.st_mtime_ns)
+        except OSError as e:
+            print("WARNING: The telemetry cache could not be written in "+cachePath+": "+str(e))
+    return telemetry
+
+
+class SubtitleIndex:
+    """
+    Interval index over the sorted start/end arrays of an SrtTelemetry.
+    A frame at frameMs gets the last record (in start order) with start <= frameMs < end,
+    which is what walking the sorted records until the start passes frameMs returns.
+    """
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.starts = telemetry.starts
+        self.ends = telemetry.ends
+        #Largest end seen up to each record, to know when an earlier record may still cover a frame
+        self.maxEnds = np.maximum.accumulate(self.ends) if len(telemetry) > 0 else self.ends
+
+    def __len__(self):
+        return len(self.telemetry)
+
+    def Match(self, frameMs):
+        """ Index of the matching record of every frame, -1 when no record covers it """
+        frameMs = np.asarray(frameMs, dtype=np.float64)
+        if len(self.telemetry) == 0:
+            return np.full(frameMs.shape, -1, dtype=np.int64)
+        last = np.searchsorted(self.starts, frameMs, side='right')-1
+        lastClipped = np.maximum(last, 0)
+        matches = np.where((last >= 0) & (frameMs < self.ends[lastClipped]), last, -1)
+        #Overlapping records: an earlier record can still cover the frame
+        pending = np.flatnonzero((matches < 0) & (last >= 0) & (self.maxEnds[lastClipped] > frameMs))
+        for i in pending.tolist():
+            for k in range(int(last[i])-1, -1, -1):
+                if frameMs[i] < self.ends[k]:
+                    matches[i] = k
+                    break
+        return matches
+
+    def Record(self, match):
+        if match < 0:
+            return {}
+        return self.telemetry.Record(match)
+
+
+class SrtTail:
+    """
+    Telemetry of a subtitles file that is still being written, read from where the previous Poll() stopped.
+    Frames are matched like SubtitleIndex does, once a record starting after them has been read (the drone writes
+    the records in time order), or at once when final.
+    """
+    def __init__(self, srtPath):
+        self.srtPath = srtPath
+        self.offset = 0
+        self.partial = b""
+        self.parser = _SrtRecordParser()
+        self.keyOrder = {}
+        self.starts = []
+        self.ends = []
+        self.maxEnds = []
+        self.records = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def Poll(self):
+        """ Read the records appended since the last call. Returns how many were read """
+        try:
+            size = os.path.getsize(self.srtPath)
+        except FileNotFoundError:
+            return 0
+        if size < self.offset:
+            #Written again from the start
+            self.__init__(self.srtPath)
+        if size == self.offset:
+            return 0
+        with open(self.srtPath, 'rb') as f:
+            f.seek(self.offset)
+            data = f.read(size-self.offset)
+        self.offset += len(data)
+        Count("bytesRead", len(data))
+        #The last line is only parsed once its end of line is written
+        lines = (self.partial+data).split(b"\n")
+        self.partial = lines.pop()
+        added = 0
+        for line_ in lines:
+            record = self.parser.Feed(line_.decode('utf-8'))
+            if record is not None:
+                self._Insert(*record)
+                added += 1
+        return added
+
+    def _Insert(self, startMs, endMs, varDict):
+        for key in varDict:
+            self.keyOrder.setdefault(key, len(self.keyOrder))
+        index = bisect.bisect_left(self.starts, startMs)
+        if index < len(self.starts) and self.starts[index] == startMs:
+            #Same start: the last record wins, as in SrtTelemetry.FromRecords
+            self.ends[index] = endMs
+            self.records[index] = varDict
+        else:
+            self.starts.insert(index, startMs)
+            self.ends.insert(index, endMs)
+            self.records.insert(index, varDict)
+            self.maxEnds.insert(index, 0)
+        for i in range(index, len(self.starts)):
+            self.maxEnds[i] = max(self.maxEnds[i-1], self.ends[i]) if i > 0 else self.ends[i]
+
+    def Match(self, frameMs, final=False):
+        """ Sensor data of the frame at frameMs ({} without a covering record), None while a later record could still change it """
+        last = bisect.bisect_right(self.starts, frameMs)-1
+        if not final and last == len(self.starts)-1:
+            return None
+        if last >= 0 and frameMs < self.ends[last]:
+            return self._Record(last)
+        if last >= 0 and self.maxEnds[last] > frameMs:
+            #Overlapping records: an earlier record can still cover the frame
+            for k in range(last-1, -1, -1):
+                if frameMs < self.ends[k]:
+                    return self._Record(k)
+        return {}
+
+    def _Record(self, index):
+        #Keys in the order of SrtTelemetry.Record
+        varDict = self.records[index]
+        return {key: varDict[key] for key in self.keyOrder if key in varDict}
@@ -0,0 +1,161 @@
+import os
+import json
+import numpy as np
+from SourceCatalog import ScanFiles
+from Metrics import Count, PathSize
+from Columnar import COLUMNAR_SUFFIX, IsColumnar, ReadFramesColumnar, ReadMeta, ReadTable, ColumnarPath, WritesJson, WritesColumnar
+
+
+def ScanColumnar(dirName):
+    """ Columnar video folders (<video>.columns) under dirName """
+    found = []
+    pending = [dirName]
+    while pending:
+        current = pending.pop()
+        with os.scandir(current) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    continue
+                if entry.name.endswith(COLUMNAR_SUFFIX) and IsColumnar(entry.path):
+                    found.append(entry.path)
+                else:
+                    pending.append(entry.path)
+    return found
+
+def ListVideoInputs(framesFolder):
+    """ {videoName: path} of the .json files and columnar folders written by the previous stage. Columnar wins """
+    inputs = {}
+    for jsonFile in sorted(ScanFiles(framesFolder, ".json")):
+        inputs[os.path.splitext(os.path.basename(jsonFile))[0]] = jsonFile
+    for columnarPath in sorted(ScanColumnar(framesFolder)):
+        inputs[os.path.basename(columnarPath)[:-len(COLUMNAR_SUFFIX)]] = columnarPath
+    return dict(sorted(inputs.items()))
+
+def OutputPaths(outputFolder, videoName, outputFormat):
+    """ Files written for a video by the Write<Stage> functions. The columnar folder comes first, it is the one read back """
+    paths = []
+    if WritesColumnar(outputFormat):
+        paths.append(ColumnarPath(outputFolder, videoName))
+    if WritesJson(outputFormat):
+        paths.append(os.path.join(outputFolder, videoName+".json"))
+        paths.append(os.path.join(outputFolder, videoName+".csv"))
+    return paths
+
+class JsonIncrementalWriter:
+    """ Same file as json.dump(dict, indent=4), written as the (key, value) entries arrive """
+    def __init__(self, path):
+        self.file = open(path, 'w', encoding='utf-8')
+        self.file.write("{")
+        self.separator = "\n"
+
+    def Add(self, key, value):
+        #Entry as dumped inside the dict, without the braces around it
+        self.file.write(self.separator+json.dumps({key: value}, ensure_ascii=False, indent=4)[2:-2])
+        self.separator = ",\n"
+
+    def Flush(self):
+        self.file.flush()
+
+    def Close(self):
+        self.file.write("}" if self.separator == "\n" else "\n}")
+        self.file.close()
+
+def WriteJsonIncremental(path, items):
+    """ Same file as json.dump(dict(items), indent=4), written one (key, value) entry at a time """
+    writer = JsonIncrementalWriter(path)
+    try:
+        for key, value in items:
+            writer.Add(key, value)
+    finally:
+        writer.Close()
+
+def LoadVideo(path):
+    Count("bytesRead", PathSize(path))
+    if os.path.isdir(path):
+        return ReadFramesColumnar(path)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def IterJsonItems(path, chunkSize=1 << 20):
+    """ (key, value) entries of the object of a .json file, parsed as the file is read: one entry is in memory at a time """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = ""
+        position = 0
+        eof = False
+
+        def Fill():
+            nonlocal buffer, position, eof
+            chunk = f.read(chunkSize)
+            eof = len(chunk) == 0
+            buffer = buffer[position:]+chunk
+            position = 0
+
+        def Next():
+            """ Next character that is not whitespace, None at the end of the file """
+            nonlocal position
+            while True:
+                while position < len(buffer) and buffer[position].isspace():
+                    position += 1
+                if position < len(buffer):
+                    return buffer[position]
+                if eof:
+                    return None
+                Fill()
+
+        def Decode():
+            nonlocal position
+            while True:
+                try:
+                    value, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    end = None
+                #A value ending with the buffer may be cut (a number), read on to be sure
+                if end is not None and (end < len(buffer) or eof):
+                    position = end
+                    return value
+                Fill()
+
+        if Next() != '{':
+            raise ValueError(path+" does not hold a json object")
+        position += 1
+        while True:
+            character = Next()
+            if character == '}':
+                return
+            if character == ',':
+                position += 1
+                continue
+            if character is None:
+                raise ValueError(path+" ends before the json object is closed")
+            key = Decode()
+            if Next() != ':':
+                raise ValueError("Expected ':' after the key "+str(key)+" in "+path)
+            position += 1
+            Next()
+            yield key, Decode()
+
+def LoadPositions(path):
+    """ Lat and Lon arrays of the frames of a video with sensor data, read without building its frames """
+    if IsColumnar(path):
+        meta = ReadMeta(path)
+        if "Lat" not in meta["tables"]["frames"]:
+            return np.empty(0, dtype=np.float64), np.empty(0, dtype=np.float64)
+        table = ReadTable(path, "frames", ["Lat", "Lon"], meta)
+        lats = np.asarray(table["Lat"])
+        keep = lats == lats
+        return lats[keep], np.asarray(table["Lon"])[keep]
+    positions = [(frameData[1]["Lat"], frameData[1]["Lon"]) for _, frameData in IterJsonItems(path) if len(frameData[1]) > 1]
+    positions = np.array(positions, dtype=np.float64).reshape(-1, 2)
+    return positions[:, 0], positions[:, 1]
+
+def LoadVideosFromFolder(framesFolder):
+    """ {videoName: {frameNum: [[boxes], {sensor:sensorData}]}} from the .json files or columnar folders of the previous stage """
+    print("Loading frames data")
+    videosList = {}
+    for videoName, path in ListVideoInputs(framesFolder).items():
+        videosList[videoName] = LoadVideo(path)
+    print("Loaded ", len(videosList), " videos")
+    return videosList
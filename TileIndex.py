@@ -0,0 +1,204 @@
+import os
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal,osr
+
+CATALOG_VERSION = 1
+DEFAULT_CATALOG_NAME = ".tileCatalog.json"
+
+
+def GetExtent(ds):
+    """ Return list of corner coordinates from a gdal Dataset """
+    xmin, xpixel, _, ymax, _, ypixel = ds.GetGeoTransform()
+    width, height = ds.RasterXSize, ds.RasterYSize
+    xmax = xmin + width * xpixel
+    ymin = ymax + height * ypixel
+
+    return (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)
+
+def ReprojectCoords(coords,src_srs,tgt_srs):
+    """ Reproject a list of x,y coordinates. """
+    trans_coords=[]
+    transform = osr.CoordinateTransformation( src_srs, tgt_srs)
+    for x,y in coords:
+        x,y,z = transform.TransformPoint(x,y)
+        trans_coords.append([x,y])
+    return trans_coords
+
+def GetRasterCorners(ds):
+    ext=GetExtent(ds)
+    src_srs=osr.SpatialReference()
+    src_srs.ImportFromWkt(ds.GetProjection())
+    tgt_srs = src_srs.CloneGeogCS()
+    geo_ext=ReprojectCoords(ext, src_srs, tgt_srs)
+    return geo_ext
+
+def GetFileFingerprint(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+def ReadTileCorners(tilePath):
+    raster = gdal.Open(tilePath, gdal.GA_ReadOnly)
+    if raster is None:
+        raise IOError("The DEM tile "+tilePath+" could not be opened.")
+    return GetRasterCorners(raster)
+
+
+def LoadTileCatalog(catalogPath):
+    if not os.path.isfile(catalogPath):
+        return {}
+    try:
+        with open(catalogPath, 'r', encoding='utf-8') as f:
+            catalog = json.load(f)
+    except (OSError, ValueError):
+        print("WARNING: The tile catalog "+catalogPath+" could not be read. It will be rebuilt.")
+        return {}
+    if catalog.get("version") != CATALOG_VERSION:
+        return {}
+    return catalog.get("tiles", {})
+
+def SaveTileCatalog(catalogPath, tiles):
+    tmpPath = catalogPath+".tmp"
+    with open(tmpPath, 'w', encoding='utf-8') as f:
+        json.dump({"version": CATALOG_VERSION, "tiles": tiles}, f, ensure_ascii=False)
+    os.replace(tmpPath, catalogPath)
+
+def BuildTileList(tifFiles, catalogPath, workers=8):
+    """
+    Return the tile list [P1, P2, P3, P4, path] of every GeoTIF, in the order of tifFiles.
+    Corners are taken from the sidecar catalog when the path, size and mtime of the tile did not change,
+    the rest of the tiles are opened in parallel and the catalog is updated.
+    """
+    cachedTiles = LoadTileCatalog(catalogPath)
+    tiles = {}
+    pendingTiles = []
+    for tile in tifFiles:
+        key = os.path.abspath(tile)
+        size, mtime = GetFileFingerprint(tile)
+        cached = cachedTiles.get(key)
+        if cached is not None and cached["size"] == size and cached["mtime"] == mtime:
+            tiles[key] = cached
+        else:
+            tiles[key] = {"size": size, "mtime": mtime, "corners": None}
+            pendingTiles.append(tile)
+    print("Tile catalog: ", len(tifFiles)-len(pendingTiles), " tile(s) reused, ", len(pendingTiles), " tile(s) to open")
+
+    if len(pendingTiles) > 0:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for tile, corners in zip(pendingTiles, executor.map(ReadTileCorners, pendingTiles)):
+                tiles[os.path.abspath(tile)]["corners"] = corners
+    if len(pendingTiles) > 0 or len(tiles) != len(cachedTiles):
+        try:
+            SaveTileCatalog(catalogPath, tiles)
+        except OSError as e:
+            print("WARNING: The tile catalog could not be saved in "+catalogPath+": "+str(e))
+
+    tileList = []
+    for tile in tifFiles:
+        corners_tmp = [list(corner) for corner in tiles[os.path.abspath(tile)]["corners"]]
+        corners_tmp.append(tile)
+        tileList.append(corners_tmp)
+    return tileList
+
+
+class TileIndex:
+    """
+    Packed R-tree (Sort-Tile-Recursive) over the footprints of a tile list as returned by BuildTileList.
+    Find() keeps the semantics of the linear scan it replaces: P4[0] <= lon < P3[0] and P3[1] <= lat < P2[1],
+    and the first matching tile of the list is returned.
+    """
+    def __init__(self, tileList, nodeCapacity=16):
+        self.tileList = tileList
+        self.nodeCapacity = max(2, nodeCapacity)
+        #Leaf entries: (minX, minY, maxX, maxY, order)
+        entries = []
+        for order, tile in enumerate(tileList):
+            P2 = tile[1]
+            P3 = tile[2]
+            P4 = tile[3]
+            entries.append((P4[0], P3[1], P3[0], P2[1], order))
+        self.leaves = entries
+        self.firstEverywhere = {}
+        self.root = self._Build(entries, True) if len(entries) > 0 else None
+
+    def _Build(self, entries, isLeaf):
+        #Nodes: (minX, minY, maxX, maxY, children, isLeaf)
+        nodes = []
+        capacity = self.nodeCapacity
+        numNodes = -(-len(entries)//capacity)
+        numSlices = max(1, math.ceil(math.sqrt(numNodes)))
+        sliceSize = numSlices*capacity
+        byX = sorted(entries, key=lambda e: (e[0]+e[2], e[4] if isLeaf else 0))
+        for s in range(0, len(byX), sliceSize):
+            slab = sorted(byX[s:s+sliceSize], key=lambda e: (e[1]+e[3], e[4] if isLeaf else 0))
+            for n in range(0, len(slab), capacity):
+                children = slab[n:n+capacity]
+                nodes.append((min(c[0] for c in children), min(c[1] for c in children),
+                    max(c[2] for c in children), max(c[3] for c in children), children, isLeaf))
+        if len(nodes) == 1:
+            return nodes[0]
+        return self._Build(nodes, False)
+
+    def _Search(self, minX, minY, maxX, maxY):
+        """ Orders of the leaves whose bounding box intersects the given (closed) box """
+        found = []
+        if self.root is None:
+            return found
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node[2] < minX or node[0] > maxX or node[3] < minY or node[1] > maxY:
+                continue
+            if node[5]:
+                for leaf in node[4]:
+                    if not (leaf[2] < minX or leaf[0] > maxX or leaf[3] < minY or leaf[1] > maxY):
+                        found.append(leaf[4])
+            else:
+                stack.extend(node[4])
+        return found
+
+    def Intersecting(self, minLat, minLon, maxLat, maxLon):
+        """ Paths of the tiles whose footprint intersects the box, in the order of the tile list """
+        return [self.tileList[order][4] for order in sorted(self._Search(minLon, minLat, maxLon, maxLat))]
+
+    def _FindOrder(self, lat_, lon_):
+        X = lon_
+        Y = lat_
+        best = None
+        for order in self._Search(X, Y, X, Y):
+            leaf = self.leaves[order]
+            if leaf[2] > X >= leaf[0] and leaf[3] > Y >= leaf[1]:
+                if best is None or order < best:
+                    best = order
+        return best
+
+    def Find(self, lat_, lon_):
+        best = self._FindOrder(lat_, lon_)
+        if best is None:
+            return None
+        return self.tileList[best][4]
+
+    def _IsFirstEverywhere(self, order):
+        """ True when no tile earlier in the list overlaps this one, so any point inside it resolves to it """
+        if order not in self.firstEverywhere:
+            leaf = self.leaves[order]
+            #tiles only sharing an edge or a corner with this one have no point in common with its half-open footprint
+            earlier = [self.leaves[other] for other in self._Search(leaf[0], leaf[1], leaf[2], leaf[3]) if other < order]
+            self.firstEverywhere[order] = not any(other[0] < leaf[2] and other[2] > leaf[0] and other[1] < leaf[3] and other[3] > leaf[1]
+                for other in earlier)
+        return self.firstEverywhere[order]
+
+    def FindMany(self, lats, lons):
+        """ Find() for arrays of points. Consecutive points usually share a tile, so the previous hit is tried first """
+        tilePaths = []
+        lastOrder = None
+        for lat_, lon_ in zip(lats, lons):
+            if lastOrder is not None:
+                leaf = self.leaves[lastOrder]
+                if leaf[2] > lon_ >= leaf[0] and leaf[3] > lat_ >= leaf[1] and self._IsFirstEverywhere(lastOrder):
+                    tilePaths.append(self.tileList[lastOrder][4])
+                    continue
+            lastOrder = self._FindOrder(lat_, lon_)
+            tilePaths.append(None if lastOrder is None else self.tileList[lastOrder][4])
+        return tilePaths
@@ -0,0 +1,96 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+from Manifest import FileFingerprint
+from Metrics import Count
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".videoMetadata.json"
+
+
+def DefaultCachePath(sourceFolder):
+    """ <sourceFolder>.videoMetadata.json, next to the folder like its source catalog """
+    return os.path.normpath(sourceFolder)+CACHE_SUFFIX
+
+def ProbeVideo(videoPath):
+    """ {"fps", "frameCount", "duration"} of a video container. The capture is released as soon as it is read """
+    cam = cv2.VideoCapture(videoPath)
+    try:
+        if not cam.isOpened():
+            raise IOError("The video "+videoPath+" could not be opened.")
+        fps = cam.get(cv2.CAP_PROP_FPS)
+        frameCount = int(cam.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cam.release()
+    if fps <= 0:
+        raise IOError("The video "+videoPath+" does not report its frame rate.")
+    return {"fps": fps, "frameCount": frameCount, "duration": frameCount/fps}
+
+
+class VideoMetadataProvider:
+    """
+    Metadata of the videos, probed once per file and cached in a JSON file keyed by path and [size, mtime].
+    The videos missing from the cache are probed concurrently on a thread pool (OpenCV releases the GIL while opening them).
+    """
+    def __init__(self, cachePath=None, workers=8):
+        self.cachePath = cachePath
+        self.workers = workers
+        self.videos = {}
+        if cachePath is not None and os.path.isfile(cachePath):
+            try:
+                with open(cachePath, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+                if cache.get("version") == CACHE_VERSION:
+                    self.videos = cache.get("videos", {})
+            except (OSError, ValueError):
+                print("WARNING: The video metadata cache "+cachePath+" could not be read. Every video will be probed.")
+
+    def _Cached(self, videoPath):
+        entry = self.videos.get(os.path.abspath(videoPath))
+        if entry is None or entry["fingerprint"] != FileFingerprint(videoPath):
+            return None
+        return entry["metadata"]
+
+    def Probe(self, videoPaths):
+        """
+        {videoPath: metadata} of every video. The videos that could not be probed are None and not cached,
+        so their error is raised again where they are processed.
+        """
+        results = {}
+        missing = []
+        for videoPath in videoPaths:
+            results[videoPath] = self._Cached(videoPath)
+            if results[videoPath] is None:
+                missing.append(videoPath)
+        Count("videoMetadata.hits", len(results)-len(missing))
+        Count("videoMetadata.misses", len(missing))
+        if len(missing) == 0:
+            return results
+
+        print("Probing ", len(missing), " video(s) with ", self.workers, " thread(s)")
+        def ProbeOne(videoPath):
+            try:
+                return ProbeVideo(videoPath)
+            except IOError as e:
+                print("WARNING: ", e)
+                return None
+        with ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(missing)))) as executor:
+            probed = list(executor.map(ProbeOne, missing))
+        for videoPath, metadata in zip(missing, probed):
+            results[videoPath] = metadata
+            if metadata is not None:
+                self.videos[os.path.abspath(videoPath)] = {"fingerprint": FileFingerprint(videoPath), "metadata": metadata}
+        self.Save()
+        return results
+
+    def Save(self):
+        if self.cachePath is None:
+            return
+        tmpPath = self.cachePath+".tmp"
+        try:
+            with open(tmpPath, 'w', encoding='utf-8') as f:
+                json.dump({"version": CACHE_VERSION, "videos": self.videos}, f, indent=1)
+            os.replace(tmpPath, self.cachePath)
+        except OSError as e:
+            print("WARNING: The video metadata cache "+self.cachePath+" could not be written ("+str(e)+").")
@@ -0,0 +1,110 @@
+import io
+import sys
+import time
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from Metrics import TakeMetrics, CurrentMetrics, Count
+from Profiling import EnableProfiling, ProfilingFolder, ProfileVideo, RecordVideoProfile
+
+#Per-process state built by the setup function of the pool (DEM index, elevation service...)
+_workerContext = None
+
+
+class VideoFailures(RuntimeError):
+    """ Raised once every video of a stage has been processed, when some of them failed """
+    def __init__(self, stage, failures, results):
+        self.stage = stage
+        self.failures = failures
+        self.results = results
+        super().__init__(stage+": "+str(len(failures))+" video(s) failed: "+", ".join(failures))
+
+
+def _InitWorker(setup, setupArgs, profileFolder):
+    global _workerContext
+    if profileFolder is not None:
+        EnableProfiling(profileFolder)
+    _workerContext = setup(*setupArgs) if setup is not None else None
+
+def _RunCaptured(task, stage, videoName, args):
+    """ Run a task in a worker. The output is captured so the videos processed in parallel do not interleave """
+    output = io.StringIO()
+    start = time.perf_counter()
+    result = None
+    error = None
+    with redirect_stdout(output):
+        try:
+            with ProfileVideo(stage, videoName):
+                result = task(_workerContext, *args)
+        except Exception:
+            error = traceback.format_exc()
+    #The metrics of the video travel back with its result
+    return videoName, output.getvalue(), result, error, time.perf_counter()-start, TakeMetrics()
+
+
+def RunPerVideo(stage, task, jobs, workers=1, setup=None, setupArgs=(), onDone=None):
+    """
+    Run task(context, *args) for every (videoName, args) of jobs, where context is setup(*setupArgs).
+    onDone(videoName, result) is called in this process as soon as a video succeeds.
+    With workers > 1 the videos are sent to a pool of processes, each one running setup once.
+    The failures of single videos are collected and raised together as VideoFailures after every video is done.
+    Returns {videoName: result} in the order of jobs, whatever the order in which the videos finished.
+    """
+    jobs = list(jobs)
+    workers = max(1, min(workers, len(jobs)))
+    results = {}
+    failures = OrderedDict()
+    if workers == 1:
+        context = setup(*setupArgs) if setup is not None else None
+        for videoName, args in jobs:
+            try:
+                with ProfileVideo(stage, videoName):
+                    results[videoName] = task(context, *args)
+                if onDone is not None:
+                    onDone(videoName, results[videoName])
+            except Exception:
+                failures[videoName] = traceback.format_exc()
+                print("ERROR: The video ", videoName, " failed in ", stage, ":\n", failures[videoName])
+            RecordVideoProfile(stage, videoName)
+    else:
+        print(stage, ": ", len(jobs), " videos on ", workers, " processes")
+        #spawn: GDAL and OpenCV keep threads and handles that do not survive a fork
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_InitWorker, initargs=(setup, setupArgs, ProfilingFolder()))
+        with executor:
+            futures = OrderedDict((executor.submit(_RunCaptured, task, stage, videoName, args), videoName) for videoName, args in jobs)
+            done = 0
+            for future in as_completed(futures):
+                try:
+                    videoName, output, result, error, seconds, metrics = future.result()
+                except BrokenProcessPool:
+                    #A worker died (killed for lack of memory, crash in GDAL/OpenCV): its video and the ones still queued fail
+                    done += 1
+                    videoName = futures[future]
+                    failures[videoName] = traceback.format_exc()
+                    print("[", done, "/", len(jobs), "] ", videoName, " lost")
+                    print("ERROR: The video ", videoName, " failed in ", stage, ", a worker process terminated abruptly:\n", failures[videoName])
+                    continue
+                CurrentMetrics().Merge(metrics)
+                RecordVideoProfile(stage, videoName)
+                done += 1
+                #Whole block per video, in completion order
+                sys.stdout.write(output)
+                print("[", done, "/", len(jobs), "] ", videoName, " done in ", round(seconds, 2), "s")
+                if error is not None:
+                    failures[videoName] = error
+                    print("ERROR: The video ", videoName, " failed in ", stage, ":\n", error)
+                else:
+                    results[videoName] = result
+                    if onDone is not None:
+                        onDone(videoName, result)
+        failures = OrderedDict((videoName, failures[videoName]) for videoName, _ in jobs if videoName in failures)
+    results = OrderedDict((videoName, results[videoName]) for videoName, _ in jobs if videoName in results)
+    Count(stage+".videos", len(results))
+    Count(stage+".failedVideos", len(failures))
+    if len(failures) > 0:
+        raise VideoFailures(stage, failures, results)
+    return results
@@ -0,0 +1,216 @@
+"""
+Time the four stages over synthetic datasets of several sizes and compare them with a stored baseline.
+
+    python benchmarks/RunBenchmarks.py --scales small,medium
+    python benchmarks/RunBenchmarks.py --scales small,medium --saveBaseline
+
+Every stage runs in a fresh process, reading the output of the previous stage from disk,
+so its peak memory is not mixed with the memory of the other stages. The peak memory reported is the growth of the
+peak during the stage, without the inputs read before the clock starts.
+Baselines are stored per machine in benchmarks/baselines/<name>.json.
+"""
+import argparse
+import io
+import os
+import sys
+import json
+import time
+import platform
+import multiprocessing
+from queue import Empty
+from contextlib import redirect_stdout
+
+BENCHMARKS_FOLDER = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_FOLDER))
+sys.path.insert(0, BENCHMARKS_FOLDER)
+
+from SyntheticData import GenerateDataset
+
+#videos, frames per video, mean boxes per frame, DEM tiles
+SCALES = {
+    "small": {"videos": 2, "frames": 300, "boxes": 5, "tiles": 4},
+    "medium": {"videos": 4, "frames": 3000, "boxes": 10, "tiles": 16},
+    "large": {"videos": 8, "frames": 20000, "boxes": 20, "tiles": 64},
+}
+STAGES = ["Consolidate", "GeoLocaliseDrone", "GeoLocaliseBoxes", "Clustering"]
+BASELINE_FOLDER = os.path.join(BENCHMARKS_FOLDER, "baselines")
+
+
+def PeakMemoryMB():
+    """ Peak resident memory of this process """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    #KB on Linux, bytes on macOS
+    return peak/(1024.0*1024.0) if sys.platform == "darwin" else peak/1024.0
+
+def StageFolders(outputRoot):
+    return {stage: os.path.join(outputRoot, stage) for stage in STAGES}
+
+def _RunStage(stage, datasetFolder, outputRoot, options, queue):
+    """ Run a stage in this (fresh) process and put its seconds, peak memory growth and counts in queue """
+    from Consolidate import Consolidate
+    from GeoLocaliseDrone import GeoLocaliseDrone
+    from GeoLocaliseBoxes import GeoLocaliseBoxes
+    from Clustering import ClusteringDetections, LoadDetectionsFromFolder
+    from StageIO import LoadVideosFromFolder
+
+    folders = StageFolders(outputRoot)
+    log = io.StringIO()
+    try:
+        with redirect_stdout(log if not options["verbose"] else sys.stdout):
+            #Inputs are read before the clock starts
+            if stage == "GeoLocaliseDrone":
+                inputs = LoadVideosFromFolder(folders["Consolidate"])
+            elif stage == "GeoLocaliseBoxes":
+                inputs = LoadVideosFromFolder(folders["GeoLocaliseDrone"])
+            elif stage == "Clustering":
+                inputs = LoadDetectionsFromFolder(folders["GeoLocaliseBoxes"])
+            memoryBefore = PeakMemoryMB()
+            start = time.perf_counter()
+            if stage == "Consolidate":
+                result = Consolidate(os.path.join(datasetFolder, "source"), os.path.join(datasetFolder, "prediction"), folders[stage],
+                    workers=options["workers"], force=True)
+            elif stage == "GeoLocaliseDrone":
+                result = GeoLocaliseDrone(inputs, os.path.join(datasetFolder, "dem"), folders[stage], batch=True, workers=options["workers"], force=True)
+            elif stage == "GeoLocaliseBoxes":
+                result = GeoLocaliseBoxes(inputs, os.path.join(datasetFolder, "camParams"), folders[stage], projection=options["projection"],
+                    workers=options["workers"], force=True)
+            else:
+                result = ClusteringDetections(inputs, 2.0, 2.0, folders[stage], workers=options["workers"], force=True)
+            seconds = time.perf_counter()-start
+        if stage == "Clustering":
+            frames = len(set((videoName, detection[0]) for videoName, detections in inputs.items() for detection in detections))
+            boxes = sum(len(detections) for detections in inputs.values())
+        else:
+            frames = sum(len(videoData) for videoData in result.values())
+            boxes = sum(len(frameData[0]) for videoData in result.values() for frameData in videoData.values())
+        stagePeak = max(0.0, PeakMemoryMB()-memoryBefore) if memoryBefore is not None else None
+        queue.put({"seconds": seconds, "frames": frames, "boxes": boxes, "stagePeakMB": stagePeak})
+    except Exception as e:
+        queue.put({"error": repr(e), "log": log.getvalue()[-2000:]})
+
+def RunStage(stage, datasetFolder, outputRoot, options):
+    context = multiprocessing.get_context("spawn")
+    queue = context.Queue()
+    process = context.Process(target=_RunStage, args=(stage, datasetFolder, outputRoot, options, queue))
+    process.start()
+    #A process dying without a result (segfault, killed for lack of memory, sys.exit in a stage) must not hang the benchmark
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1.0)
+        except Empty:
+            if not process.is_alive():
+                process.join()
+                try:
+                    #Its result may have been flushed just before it exited
+                    result = queue.get(timeout=1.0)
+                except Empty:
+                    raise RuntimeError(stage+" failed: its process exited with code "+str(process.exitcode)+" without a result")
+    process.join()
+    if "error" in result:
+        raise RuntimeError(stage+" failed: "+result["error"]+"\n"+result["log"])
+    return result
+
+def RunScale(scaleName, scale, options):
+    datasetFolder = GenerateDataset(options["workFolder"], scale["videos"], scale["frames"], scale["boxes"], scale["tiles"])
+    outputRoot = os.path.join(datasetFolder, "output")
+    results = {}
+    for stage in STAGES:
+        runs = [RunStage(stage, datasetFolder, outputRoot, options) for _ in range(options["repeat"])]
+        best = min(runs, key=lambda run: run["seconds"])
+        best["stagePeakMB"] = max(run["stagePeakMB"] for run in runs) if best["stagePeakMB"] is not None else None
+        best["framesPerSecond"] = best["frames"]/best["seconds"] if best["seconds"] > 0 else None
+        best["boxesPerSecond"] = best["boxes"]/best["seconds"] if best["seconds"] > 0 else None
+        results[stage] = best
+        PrintResult(scaleName, stage, best)
+    return results
+
+
+def PrintResult(scaleName, stage, result):
+    peak = "-" if result["stagePeakMB"] is None else str(round(result["stagePeakMB"], 1))
+    print("%-8s %-17s %9.3f s %12.0f frames/s %12.0f boxes/s %9s MB" % (scaleName, stage, result["seconds"],
+        result["framesPerSecond"] or 0, result["boxesPerSecond"] or 0, peak))
+
+def CompareWithBaseline(results, baseline, tolerance):
+    """ Regressions: throughput below, or peak memory growth above, the baseline by more than tolerance """
+    regressions = []
+    for scaleName, stages in results.items():
+        for stage, result in stages.items():
+            reference = baseline.get(scaleName, {}).get(stage)
+            if reference is None:
+                continue
+            for metric in ("framesPerSecond", "boxesPerSecond"):
+                if reference.get(metric) and result.get(metric) and result[metric] < reference[metric]*(1.0-tolerance):
+                    regressions.append(scaleName+" "+stage+": "+metric+" "+str(round(result[metric]))+" < baseline "+str(round(reference[metric])))
+            if reference.get("stagePeakMB") and result.get("stagePeakMB") and result["stagePeakMB"] > reference["stagePeakMB"]*(1.0+tolerance):
+                regressions.append(scaleName+" "+stage+": peak memory growth "+str(round(result["stagePeakMB"], 1))+" MB > baseline "+str(round(reference["stagePeakMB"], 1))+" MB")
+    return regressions
+
+def BaselinePath(name):
+    return os.path.join(BASELINE_FOLDER, name+".json")
+
+def LoadBaseline(name):
+    path = BaselinePath(name)
+    if not os.path.isfile(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)["results"]
+
+def SaveBaseline(name, results):
+    os.makedirs(BASELINE_FOLDER, exist_ok=True)
+    baseline = LoadBaseline(name) or {}
+    baseline.update(results)
+    with open(BaselinePath(name), 'w', encoding='utf-8') as f:
+        json.dump({"machine": platform.platform(), "python": platform.python_version(), "results": baseline}, f, indent=4)
+    return BaselinePath(name)
+
+
+def ParseArgs(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=str, default='small', help='Comma separated scales to run: '+", ".join(SCALES))
+    parser.add_argument('--custom', type=str, default=None, help='Extra scale as videos,frames,boxes,tiles. I.e: 2,5000,8,9')
+    parser.add_argument('--workFolder', type=str, default='/tmp/treeDetectionBenchmarks/', help='Folder where the synthetic datasets and the stage outputs are written')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs of every stage, the fastest one is reported')
+    parser.add_argument('--workers', type=int, default=1, help='--workers of the stages')
+    parser.add_argument('--projection', type=str, default='geopy', help='--projection of GeoLocaliseBoxes')
+    parser.add_argument('--baseline', type=str, default=platform.node() or "default", help='Name of the baseline to compare with (default: this machine)')
+    parser.add_argument('--saveBaseline', action='store_true', help='Store the results as the baseline instead of comparing with it')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Relative slow down or memory growth reported as a regression')
+    parser.add_argument('--output', type=str, default=None, help='Also write the results to this .json file')
+    parser.add_argument('--verbose', action='store_true', help='Show the output of the stages')
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = ParseArgs()
+    scales = {name: SCALES[name] for name in args.scales.split(",") if name}
+    if args.custom is not None:
+        videos, frames, boxes, tiles = [int(value) for value in args.custom.split(",")]
+        scales["custom"] = {"videos": videos, "frames": frames, "boxes": boxes, "tiles": tiles}
+    options = {"workFolder": args.workFolder, "repeat": max(1, args.repeat), "workers": args.workers,
+        "projection": args.projection, "verbose": args.verbose}
+
+    results = {}
+    for scaleName, scale in scales.items():
+        results[scaleName] = RunScale(scaleName, scale, options)
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({"scales": scales, "results": results}, f, indent=4)
+
+    if args.saveBaseline:
+        print("Baseline >> ", SaveBaseline(args.baseline, results))
+        sys.exit(0)
+    baseline = LoadBaseline(args.baseline)
+    if baseline is None:
+        print("No baseline '"+args.baseline+"' to compare with. Run with --saveBaseline to store one.")
+        sys.exit(0)
+    regressions = CompareWithBaseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print("REGRESSION: "+regression)
+    if len(regressions) == 0:
+        print("No regressions against baseline '"+args.baseline+"'")
+    sys.exit(1 if len(regressions) > 0 else 0)
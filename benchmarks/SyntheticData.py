@@ -0,0 +1,144 @@
+import argparse
+import os
+import math
+import shutil
+import numpy as np
+import cv2
+from osgeo import gdal,osr
+
+#Corner (north-west) of the surveyed area and size of a DEM pixel in degrees (~1 m)
+ORIGIN_LAT = 40.0
+ORIGIN_LON = -3.0
+PIXEL_DEGREES = 0.00001
+TILE_PIXELS = 256
+#Drone flying height over the highest terrain, in metres
+FLIGHT_HEIGHT = 60.0
+CAMERA_PARAMS = {"width": 3840, "height": 2160, "dfov": 82.9}
+COMPLETE_MARKER = ".complete"
+
+
+def TileGrid(tiles):
+    """ rows, cols of a grid of exactly `tiles` DEM tiles, as square as possible """
+    rows = max(divisor for divisor in range(1, int(math.isqrt(tiles))+1) if tiles%divisor == 0)
+    return rows, tiles//rows
+
+def DatasetFolder(workFolder, videos, framesPerVideo, boxesPerFrame, tiles):
+    return os.path.join(workFolder, str(videos)+"v_"+str(framesPerVideo)+"f_"+str(boxesPerFrame)+"b_"+str(tiles)+"t")
+
+def SrtTimestamp(ms):
+    return "%02d:%02d:%02d,%03d" % (ms//3600000, (ms//60000)%60, (ms//1000)%60, ms%1000)
+
+
+def WriteDemTiles(demFolder, tiles, rng):
+    """ Float32 GeoTIF tiles in WGS84 covering the surveyed area. Returns the (south, west, north, east) bounds of the area """
+    rows, cols = TileGrid(tiles)
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    wkt = srs.ExportToWkt()
+    driver = gdal.GetDriverByName('GTiff')
+    tileDegrees = TILE_PIXELS*PIXEL_DEGREES
+    pixels = np.arange(TILE_PIXELS, dtype=np.float64)
+    for row in range(rows):
+        for col in range(cols):
+            north = ORIGIN_LAT-row*tileDegrees
+            west = ORIGIN_LON+col*tileDegrees
+            #Rolling hills plus noise, continuous across tiles
+            y = (row*TILE_PIXELS+pixels)[:, None]
+            x = (col*TILE_PIXELS+pixels)[None, :]
+            heights = 120.0+15.0*np.sin(x/180.0)*np.cos(y/240.0)+rng.normal(0.0, 0.3, (TILE_PIXELS, TILE_PIXELS))
+            tilePath = os.path.join(demFolder, "tile_"+str(row)+"_"+str(col)+".tif")
+            dataset = driver.Create(tilePath, TILE_PIXELS, TILE_PIXELS, 1, gdal.GDT_Float32, options=['TILED=YES', 'BLOCKXSIZE=128', 'BLOCKYSIZE=128'])
+            dataset.SetGeoTransform([west, PIXEL_DEGREES, 0.0, north, 0.0, -PIXEL_DEGREES])
+            dataset.SetProjection(wkt)
+            dataset.GetRasterBand(1).WriteArray(heights.astype(np.float32))
+            dataset.FlushCache()
+            dataset = None
+    return ORIGIN_LAT-rows*tileDegrees, ORIGIN_LON, ORIGIN_LAT, ORIGIN_LON+cols*tileDegrees
+
+def FlightPath(bounds, frames, videoIndex):
+    """ Lawnmower path over the area, frames positions as (lats, lons, yaws). Every video starts on a different line """
+    south, west, north, east = bounds
+    margin = 0.1*min(north-south, east-west)
+    lines = max(2, int(round(math.sqrt(frames/50.0))))
+    lineOffsets = ((np.arange(lines)+videoIndex*0.37)%lines+0.5)/lines
+    progress = np.linspace(0.0, lines, frames, endpoint=False)
+    line = progress.astype(np.int64)
+    along = progress-line
+    #Odd lines are flown back
+    along = np.where(line%2 == 0, along, 1.0-along)
+    lats = (south+margin)+(north-south-2*margin)*lineOffsets[line]
+    lons = (west+margin)+(east-west-2*margin)*along
+    yaws = np.where(line%2 == 0, 90.0, -90.0)
+    return lats, lons, yaws
+
+def WriteVideo(videoPath, frames, fps):
+    """ Tiny video with the frame count and frame rate of the flight, read by Consolidate for its metadata """
+    writer = cv2.VideoWriter(videoPath, cv2.VideoWriter_fourcc(*'mp4v'), fps, (64, 36))
+    blank = np.zeros((36, 64, 3), dtype=np.uint8)
+    for _ in range(frames):
+        writer.write(blank)
+    writer.release()
+
+def WriteSubtitles(srtPath, lats, lons, yaws, fps, rng):
+    """ DJI style subtitles, one record per frame """
+    frameMs = 1000.0/fps
+    with open(srtPath, 'w', encoding='utf-8') as f:
+        for i in range(lats.shape[0]):
+            startMs = int(round(i*frameMs))
+            endMs = int(round((i+1)*frameMs))
+            f.write(str(i+1)+"\n")
+            f.write(SrtTimestamp(startMs)+" --> "+SrtTimestamp(endMs)+"\n")
+            f.write("Lat:%.8f Lon:%.8f Alt:%.2f Yaw:%.1f Pitch:%.1f Roll:%.1f GimYaw:%.1f GimPitch:-90.0 GimRoll:0.0\n" % (
+                lats[i], lons[i], 135.0+FLIGHT_HEIGHT+rng.normal(0.0, 0.5), yaws[i], rng.normal(0.0, 1.0), rng.normal(0.0, 1.0), yaws[i]))
+            f.write("\n")
+
+def WriteLabels(predictionFolder, videoName, frames, boxesPerFrame, rng):
+    """ One YOLO label file per frame: class, centre x, centre y, width, height (relative) and confidence """
+    for frameNum in range(frames):
+        count = rng.poisson(boxesPerFrame)
+        boxes = np.column_stack([rng.integers(0, 2, count), rng.uniform(0.05, 0.95, (count, 2)),
+            rng.uniform(0.02, 0.08, (count, 2)), rng.uniform(0.4, 1.0, count)])
+        with open(os.path.join(predictionFolder, videoName+"_"+str(frameNum)+".txt"), 'w') as f:
+            for box in boxes.tolist():
+                f.write("%d %.6f %.6f %.6f %.6f %.4f\n" % tuple(box))
+
+def GenerateDataset(workFolder, videos=2, framesPerVideo=300, boxesPerFrame=5, tiles=4, fps=30.0, seed=0):
+    """
+    Write a synthetic survey under workFolder: source/videos, source/subtitles, prediction, camParams and dem.
+    Datasets are reused while their parameters are the same. Returns the folder of the dataset.
+    """
+    root = DatasetFolder(workFolder, videos, framesPerVideo, boxesPerFrame, tiles)
+    if os.path.isfile(os.path.join(root, COMPLETE_MARKER)):
+        return root
+    shutil.rmtree(root, ignore_errors=True)
+    folders = {name: os.path.join(root, *name.split("/")) for name in ["source/videos", "source/subtitles", "prediction", "camParams", "dem"]}
+    for folder in folders.values():
+        os.makedirs(folder)
+    rng = np.random.default_rng(seed)
+
+    print("Generating ", videos, " videos of ", framesPerVideo, " frames, ", boxesPerFrame, " boxes per frame and ", tiles, " DEM tiles in ", root)
+    bounds = WriteDemTiles(folders["dem"], tiles, rng)
+    for videoIndex in range(videos):
+        videoName = "DJI_%04d" % (videoIndex+1)
+        lats, lons, yaws = FlightPath(bounds, framesPerVideo, videoIndex)
+        WriteVideo(os.path.join(folders["source/videos"], videoName+".MP4"), framesPerVideo, fps)
+        WriteSubtitles(os.path.join(folders["source/subtitles"], videoName+".srt"), lats, lons, yaws, fps, rng)
+        WriteLabels(folders["prediction"], videoName, framesPerVideo, boxesPerFrame, rng)
+        with open(os.path.join(folders["camParams"], videoName+".txt"), 'w') as f:
+            f.write("".join(key+"="+str(value)+"\n" for key, value in CAMERA_PARAMS.items()))
+
+    with open(os.path.join(root, COMPLETE_MARKER), 'w') as f:
+        f.write("complete\n")
+    return root
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--workFolder', type=str, default='/tmp/treeDetectionBenchmarks/', help='Folder where the synthetic datasets are written')
+    parser.add_argument('--videos', type=int, default=2, help='Number of videos')
+    parser.add_argument('--frames', type=int, default=300, help='Frames per video')
+    parser.add_argument('--boxes', type=int, default=5, help='Mean number of bounding boxes per frame')
+    parser.add_argument('--tiles', type=int, default=4, help='Number of DEM tiles')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator')
+    args = parser.parse_args()
+    print(GenerateDataset(args.workFolder, args.videos, args.frames, args.boxes, args.tiles, seed=args.seed))
@@ -0,0 +1,47 @@
+"""
+The label archive is read instead of the label files only while they are unchanged.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from LabelLoader import LoadLabels, LabelArchiveKey, LabelFolderKey
+
+
+def WriteLabelFile(path, lines, mode='w'):
+    with open(path, mode) as writer:
+        writer.write("".join(line+"\n" for line in lines))
+
+def test_archive_repacked_after_append(tmp_path):
+    predictionFolder = str(tmp_path/"labels")
+    archivePath = str(tmp_path/"labels.npz")
+    os.makedirs(predictionFolder)
+    labelPath = os.path.join(predictionFolder, "DJI_0001_5.txt")
+    WriteLabelFile(labelPath, ["0 0.5 0.5 0.1 0.1"])
+    WriteLabelFile(os.path.join(predictionFolder, "DJI_0001_7.txt"), ["0 0.2 0.3 0.1 0.1"])
+    #Backdate the files so the append below also keeps the mtime of the directory
+    for name in os.listdir(predictionFolder):
+        os.utime(os.path.join(predictionFolder, name), ns=(10**18, 10**18))
+    os.utime(predictionFolder, ns=(10**18, 10**18))
+
+    videos = LoadLabels(predictionFolder, archivePath, workers=1)
+    assert videos["DJI_0001"].boxes.shape[0] == 2
+    packedKey = LabelArchiveKey(archivePath)
+    assert packedKey == LabelFolderKey(predictionFolder)
+
+    #YOLO appends the boxes of a frame to its existing label file
+    WriteLabelFile(labelPath, ["1 0.7 0.7 0.2 0.2"], mode='a')
+    os.utime(predictionFolder, ns=(10**18, 10**18))
+    assert LabelFolderKey(predictionFolder) != packedKey
+
+    videos = LoadLabels(predictionFolder, archivePath, workers=1)
+    boxes = videos["DJI_0001"].boxes
+    assert boxes.shape[0] == 3
+    assert np.array_equal(boxes[boxes[:, 0] == 5][:, 1], [0, 1])
+    assert LabelArchiveKey(archivePath) == LabelFolderKey(predictionFolder)
+    #The repacked archive is read back as it was written
+    assert np.array_equal(LoadLabels(predictionFolder, archivePath, workers=1)["DJI_0001"].boxes, boxes)